@@ -3,6 +3,7 @@ import os
 
 from app import socketio
 from app.endpoints import endpoints
+from app.logs import setup_logging
 from app.shared_state import radio_link
 from flask import Flask
 
@@ -11,7 +12,7 @@ os.environ["MAVLINK20"] = "1"
 PORT = 4237
 HOST = "127.0.0.1"
 
-logging.basicConfig(level=logging.DEBUG)
+setup_logging(logging.DEBUG)
 
 logger = logging.getLogger("multicontrol")
 logger.setLevel(logging.DEBUG)
@@ -1,3 +1,17 @@
 from flask_socketio import SocketIO
 
-socketio = SocketIO(cors_allowed_origins="*", async_mode="threading")
+
+def get_async_mode() -> str:
+    """
+    Use gevent when the production server has monkey patched the standard
+    library, otherwise every client and handler gets its own thread.
+    """
+    try:
+        from gevent import monkey
+    except ImportError:
+        return "threading"
+    return "gevent" if monkey.is_module_patched("threading") else "threading"
+
+
+async_mode = get_async_mode()
+socketio = SocketIO(cors_allowed_origins="*", async_mode=async_mode)
@@ -0,0 +1,390 @@
+import logging
+import time
+from collections import deque
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Deque,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from pymavlink.mavutil import mavlink
+
+if TYPE_CHECKING:
+    from app.radio_link import RadioLink
+
+EKF_VARIANCE_FIELDS = (
+    "velocity_variance",
+    "compass_variance",
+    "pos_horiz_variance",
+    "pos_vert_variance",
+    "terrain_alt_variance",
+)
+VIBRATION_FIELDS = ("vibration_x", "vibration_y", "vibration_z")
+SENSOR_FIELDS = (
+    "onboard_control_sensors_present",
+    "onboard_control_sensors_enabled",
+    "onboard_control_sensors_health",
+)
+
+
+class AlertRule:
+    """
+    Raises an alert when a value computed from some fields of a message goes
+    past a threshold, and clears it once the value is back past the clear
+    threshold. The gap between the two stops a value hovering around the
+    threshold from raising the alert over and over.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        message_type: str,
+        fields: Tuple[str, ...],
+        value: Callable[[tuple], Optional[float]],
+        above: bool,
+        threshold: float,
+        clear_threshold: float,
+        severity: str,
+        description: str,
+    ):
+        self.name = name
+        self.message_type = message_type
+        self.fields = fields
+        self.value = value
+        self.above = above
+        self.threshold = threshold
+        self.clear_threshold = clear_threshold
+        self.severity = severity
+        self.description = description
+
+    def is_triggered(self, value: float, active: bool) -> bool:
+        if self.above:
+            return value >= self.clear_threshold if active else value > self.threshold
+        return value <= self.clear_threshold if active else value < self.threshold
+
+
+def first_value(inputs: tuple) -> Optional[float]:
+    return inputs[0]
+
+
+def battery_remaining(inputs: tuple) -> Optional[float]:
+    # -1 when the autopilot doesn't know
+    return inputs[0] if inputs[0] >= 0 else None
+
+
+def satellites_visible(inputs: tuple) -> Optional[float]:
+    return inputs[0] if inputs[0] != 255 else None
+
+
+def hdop(inputs: tuple) -> Optional[float]:
+    return inputs[0] / 100 if inputs[0] != 65535 else None
+
+
+def no_attitude(inputs: tuple) -> Optional[float]:
+    return 0.0 if inputs[0] & mavlink.EKF_ATTITUDE else 1.0
+
+
+def unhealthy_sensors(inputs: tuple) -> Optional[float]:
+    present, enabled, health = inputs
+    return float(bin(present & enabled & ~health).count("1"))
+
+
+# Thresholds match the vehicle cards in the GUI
+DEFAULT_ALERT_RULES: List[AlertRule] = [
+    AlertRule(
+        "ekf_variance_high",
+        "EKF_STATUS_REPORT",
+        EKF_VARIANCE_FIELDS,
+        max,
+        True,
+        0.5,
+        0.4,
+        "warning",
+        "EKF variance is high",
+    ),
+    AlertRule(
+        "ekf_variance_critical",
+        "EKF_STATUS_REPORT",
+        EKF_VARIANCE_FIELDS,
+        max,
+        True,
+        0.8,
+        0.7,
+        "critical",
+        "EKF variance is critical",
+    ),
+    AlertRule(
+        "ekf_no_attitude",
+        "EKF_STATUS_REPORT",
+        ("flags",),
+        no_attitude,
+        True,
+        0.5,
+        0.5,
+        "critical",
+        "EKF has no attitude solution",
+    ),
+    AlertRule(
+        "gps_no_fix",
+        "GPS_RAW_INT",
+        ("fix_type",),
+        first_value,
+        False,
+        mavlink.GPS_FIX_TYPE_2D_FIX,
+        mavlink.GPS_FIX_TYPE_2D_FIX,
+        "critical",
+        "GPS has no fix",
+    ),
+    AlertRule(
+        "gps_no_3d_fix",
+        "GPS_RAW_INT",
+        ("fix_type",),
+        first_value,
+        False,
+        mavlink.GPS_FIX_TYPE_3D_FIX,
+        mavlink.GPS_FIX_TYPE_3D_FIX,
+        "warning",
+        "GPS has no 3D fix",
+    ),
+    AlertRule(
+        "gps_satellites_low",
+        "GPS_RAW_INT",
+        ("satellites_visible",),
+        satellites_visible,
+        False,
+        10,
+        11,
+        "warning",
+        "Few GPS satellites visible",
+    ),
+    AlertRule(
+        "gps_satellites_critical",
+        "GPS_RAW_INT",
+        ("satellites_visible",),
+        satellites_visible,
+        False,
+        6,
+        7,
+        "critical",
+        "Too few GPS satellites visible",
+    ),
+    AlertRule(
+        "gps_hdop_high",
+        "GPS_RAW_INT",
+        ("eph",),
+        hdop,
+        True,
+        1.0,
+        0.9,
+        "warning",
+        "GPS HDOP is high",
+    ),
+    AlertRule(
+        "gps_hdop_critical",
+        "GPS_RAW_INT",
+        ("eph",),
+        hdop,
+        True,
+        2.0,
+        1.8,
+        "critical",
+        "GPS HDOP is critical",
+    ),
+    AlertRule(
+        "battery_low",
+        "BATTERY_STATUS",
+        ("battery_remaining",),
+        battery_remaining,
+        False,
+        20,
+        25,
+        "warning",
+        "Battery is low",
+    ),
+    AlertRule(
+        "battery_critical",
+        "BATTERY_STATUS",
+        ("battery_remaining",),
+        battery_remaining,
+        False,
+        10,
+        15,
+        "critical",
+        "Battery is critically low",
+    ),
+    AlertRule(
+        "sensors_unhealthy",
+        "SYS_STATUS",
+        SENSOR_FIELDS,
+        unhealthy_sensors,
+        True,
+        0.5,
+        0.5,
+        "warning",
+        "Sensors are reporting unhealthy",
+    ),
+    AlertRule(
+        "vibration_high",
+        "VIBRATION",
+        VIBRATION_FIELDS,
+        max,
+        True,
+        30,
+        25,
+        "warning",
+        "Vibration is high",
+    ),
+    AlertRule(
+        "vibration_critical",
+        "VIBRATION",
+        VIBRATION_FIELDS,
+        max,
+        True,
+        60,
+        50,
+        "critical",
+        "Vibration is critical",
+    ),
+]
+
+
+class AlertEngine:
+    """
+    Watches the fleet's health messages and sends an alert when a rule starts
+    or stops being triggered. A message that reads the same as the vehicle's
+    last one of that type is skipped with a single comparison, and otherwise
+    only the rules reading a field that changed are evaluated, so the work done
+    follows how often things change rather than the number of vehicles and
+    rules.
+
+    The reader thread only queues messages, they are evaluated on a background
+    thread.
+    """
+
+    def __init__(
+        self,
+        radio_link: "RadioLink",
+        alert_callback: Optional[Callable] = None,
+        rules: Sequence[AlertRule] = DEFAULT_ALERT_RULES,
+        interval: float = 0.1,
+    ):
+        self.logger = logging.getLogger("alert_engine")
+
+        self.radio_link = radio_link
+        self.alert_callback = alert_callback
+        self.interval = interval
+
+        # Message type -> the fields read by any of its rules
+        self.message_fields: Dict[str, Tuple[str, ...]] = {}
+        # Message type -> positions of a rule's fields in those -> the rules
+        self.rule_groups: Dict[str, Dict[Tuple[int, ...], List[AlertRule]]] = {}
+        for rule in rules:
+            fields = self.message_fields.get(rule.message_type, ())
+            fields += tuple(field for field in rule.fields if field not in fields)
+            self.message_fields[rule.message_type] = fields
+        for rule in rules:
+            fields = self.message_fields[rule.message_type]
+            positions = tuple(fields.index(field) for field in rule.fields)
+            self.rule_groups.setdefault(rule.message_type, {}).setdefault(
+                positions, []
+            ).append(rule)
+
+        self.pending: Deque[Tuple[int, mavlink.MAVLink_message]] = deque()
+        # (system ID, message type) -> the fields of the last message
+        self.last_inputs: Dict[Tuple[int, str], tuple] = {}
+        # (system ID, rule name) -> the alert, for the rules currently triggered
+        self.active_alerts: Dict[Tuple[int, str], dict] = {}
+
+        self.messages_checked: int = 0
+        self.rules_evaluated: int = 0
+
+    def update(
+        self, system_id: int, message_type: str, message: mavlink.MAVLink_message
+    ) -> None:
+        if message_type in self.message_fields:
+            self.pending.append((system_id, message))
+
+    def _make_alert(
+        self, system_id: int, rule: AlertRule, value: float, active: bool
+    ) -> dict:
+        return {
+            "system_id": system_id,
+            "rule": rule.name,
+            "severity": rule.severity,
+            "message": rule.description,
+            "value": value,
+            "active": active,
+            "time": time.time(),
+        }
+
+    def check_message(
+        self, system_id: int, message: mavlink.MAVLink_message
+    ) -> List[dict]:
+        """Evaluate the rules whose fields have changed, get the alerts raised or cleared."""
+        self.messages_checked += 1
+        message_type = message.get_type()
+        inputs = tuple(
+            getattr(message, field) for field in self.message_fields[message_type]
+        )
+        key = (system_id, message_type)
+        last_inputs = self.last_inputs.get(key)
+        if last_inputs == inputs:
+            return []
+        self.last_inputs[key] = inputs
+
+        alerts = []
+        for positions, rules in self.rule_groups[message_type].items():
+            rule_inputs = tuple(inputs[position] for position in positions)
+            if last_inputs is not None and rule_inputs == tuple(
+                last_inputs[position] for position in positions
+            ):
+                continue
+
+            for rule in rules:
+                self.rules_evaluated += 1
+                value = rule.value(rule_inputs)
+                alert_key = (system_id, rule.name)
+                active = alert_key in self.active_alerts
+                # A value that isn't known leaves the alert as it is
+                if value is None or rule.is_triggered(value, active) == active:
+                    continue
+
+                alert = self._make_alert(system_id, rule, value, not active)
+                if active:
+                    del self.active_alerts[alert_key]
+                else:
+                    self.active_alerts[alert_key] = alert
+                alerts.append(alert)
+        return alerts
+
+    def get_active_alerts(self, system_ids: Optional[List[int]] = None) -> List[dict]:
+        wanted_system_ids = set(system_ids) if system_ids is not None else None
+        return [
+            alert
+            for (system_id, _), alert in list(self.active_alerts.items())
+            if wanted_system_ids is None or system_id in wanted_system_ids
+        ]
+
+    def run(self) -> None:
+        while self.radio_link.is_active.is_set():
+            if not self.pending:
+                time.sleep(self.interval)
+                continue
+
+            alerts = []
+            for _ in range(len(self.pending)):
+                system_id, message = self.pending.popleft()
+                alerts.extend(self.check_message(system_id, message))
+
+            for alert in alerts:
+                self.logger.info(
+                    f"[{alert['system_id']}] {alert['message']}"
+                    f"{'' if alert['active'] else ' (cleared)'}"
+                )
+                if self.alert_callback:
+                    self.alert_callback(alert)
@@ -0,0 +1,461 @@
+import json
+import logging
+import os
+import re
+import shutil
+import time
+from collections import deque
+from typing import TYPE_CHECKING, Deque, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from pymavlink.mavutil import mavlink
+
+from app.blocking import run_blocking
+from app.snapshot import TELEMETRY_MESSAGES
+
+if TYPE_CHECKING:
+    from app.radio_link import RadioLink
+
+DEFAULT_ARCHIVE_DIR = os.path.join(os.path.expanduser("~"), ".multicontrol", "archive")
+SESSION_FILE = "session.json"
+# Session IDs are the time the session started, with a suffix if two started
+# in the same second
+SESSION_ID_PATTERN = re.compile(r"\d{8}-\d{6}(-\d+)?")
+CHUNK_ROWS = 1 << 20
+# Messages waiting to be written, anything more is dropped rather than letting
+# memory grow while the disk can't keep up
+MAX_PENDING_MESSAGES = 500_000
+# Older sessions are deleted once the archive grows past this
+MAX_ARCHIVE_BYTES = 10 << 30
+PRUNE_INTERVAL = 60.0
+
+MAVLINK_DTYPES = {
+    "float": "<f4",
+    "double": "<f8",
+    "int8_t": "i1",
+    "uint8_t": "u1",
+    "uint8_t_mavlink_version": "u1",
+    "int16_t": "<i2",
+    "uint16_t": "<u2",
+    "int32_t": "<i4",
+    "uint32_t": "<u4",
+    "int64_t": "<i8",
+    "uint64_t": "<u8",
+}
+
+# Every table starts with these, before the message's own fields
+TIMESTAMP_COLUMN = "timestamp"
+SYSTEM_ID_COLUMN = "system_id"
+
+
+class Column:
+    """A fixed width column, a MAVLink array field is a column of sub-arrays."""
+
+    def __init__(self, name: str, dtype: str, length: int = 0):
+        self.name = name
+        self.dtype = np.dtype(dtype)
+        self.length = length
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return (self.length,) if self.length else ()
+
+    def to_json(self) -> list:
+        return [self.name, self.dtype.str, self.length]
+
+    @classmethod
+    def from_json(cls, column: list) -> "Column":
+        return cls(column[0], column[1], column[2])
+
+
+def get_message_columns(message: mavlink.MAVLink_message) -> List[Column]:
+    """Work out the columns of a message type from its pymavlink definition."""
+    array_lengths = dict(zip(message.ordered_fieldnames, message.array_lengths))
+    columns = [Column(TIMESTAMP_COLUMN, "<f8"), Column(SYSTEM_ID_COLUMN, "u1")]
+    for name, field_type in zip(message.fieldnames, message.fieldtypes):
+        length = array_lengths.get(name, 0)
+        if field_type == "char":
+            # Strings are stored as fixed width bytes
+            columns.append(Column(name, f"S{max(length, 1)}"))
+        else:
+            columns.append(Column(name, MAVLINK_DTYPES[field_type], length))
+    return columns
+
+
+def get_chunk_path(table_dir: str, column: str, chunk: int) -> str:
+    return os.path.join(table_dir, f"{column}.{chunk:04d}.bin")
+
+
+class ArchiveTable:
+    """
+    The on-disk table of one message type. Each column is a flat file of
+    fixed width values per chunk, so a chunk's row count is just its size
+    divided by the row width and the files can be memory mapped as they are.
+    """
+
+    def __init__(self, table_dir: str, columns: List[Column], chunk_rows: int):
+        self.table_dir = table_dir
+        self.columns = columns
+        self.chunk_rows = chunk_rows
+
+        os.makedirs(self.table_dir, exist_ok=True)
+        self.chunk, self.chunk_row_count = self._find_last_chunk()
+
+    def _find_last_chunk(self) -> Tuple[int, int]:
+        first_column = self.columns[0]
+        chunk = 0
+        while os.path.exists(
+            get_chunk_path(self.table_dir, first_column.name, chunk + 1)
+        ):
+            chunk += 1
+        path = get_chunk_path(self.table_dir, first_column.name, chunk)
+        if not os.path.exists(path):
+            return chunk, 0
+        return chunk, os.path.getsize(path) // first_column.dtype.itemsize
+
+    def _build_column(
+        self, column: Column, messages: List[Tuple[float, int, mavlink.MAVLink_message]]
+    ) -> np.ndarray:
+        if column.name == TIMESTAMP_COLUMN:
+            return np.array([timestamp for timestamp, _, _ in messages], column.dtype)
+        if column.name == SYSTEM_ID_COLUMN:
+            return np.array([system_id for _, system_id, _ in messages], column.dtype)
+
+        if column.dtype.kind == "S":
+            return np.array(
+                [
+                    str(getattr(message, column.name, "")).encode(errors="replace")
+                    for _, _, message in messages
+                ],
+                column.dtype,
+            )
+
+        # A message decoded with an older dialect may be missing extension fields
+        default = [0] * column.length if column.length else 0
+        return np.array(
+            [getattr(message, column.name, default) for _, _, message in messages],
+            column.dtype,
+        ).reshape((len(messages),) + column.shape)
+
+    def append(
+        self, messages: List[Tuple[float, int, mavlink.MAVLink_message]]
+    ) -> None:
+        arrays = [self._build_column(column, messages) for column in self.columns]
+
+        start = 0
+        while start < len(messages):
+            if self.chunk_row_count >= self.chunk_rows:
+                self.chunk += 1
+                self.chunk_row_count = 0
+
+            end = min(start + self.chunk_rows - self.chunk_row_count, len(messages))
+            for column, array in zip(self.columns, arrays):
+                with open(
+                    get_chunk_path(self.table_dir, column.name, self.chunk), "ab"
+                ) as column_file:
+                    column_file.write(array[start:end].tobytes())
+            self.chunk_row_count += end - start
+            start = end
+
+
+class TelemetryArchive:
+    """
+    Archives the decoded telemetry of a session into one columnar table per
+    message type. The reader thread only queues messages, a background thread
+    writes them out in batches.
+    """
+
+    def __init__(
+        self,
+        radio_link: "RadioLink",
+        archive_dir: str = DEFAULT_ARCHIVE_DIR,
+        message_types: List[str] = TELEMETRY_MESSAGES,
+        flush_interval: float = 1.0,
+        chunk_rows: int = CHUNK_ROWS,
+        max_pending: int = MAX_PENDING_MESSAGES,
+        max_archive_bytes: int = MAX_ARCHIVE_BYTES,
+    ):
+        self.logger = logging.getLogger("telemetry_archive")
+
+        self.radio_link = radio_link
+        self.archive_dir = archive_dir
+        self.message_types = set(message_types)
+        self.flush_interval = flush_interval
+        self.chunk_rows = chunk_rows
+        self.max_pending = max_pending
+        self.max_archive_bytes = max_archive_bytes
+
+        self.session_id = time.strftime("%Y%m%d-%H%M%S")
+        suffix = 1
+        while os.path.exists(os.path.join(archive_dir, self.session_id)):
+            suffix += 1
+            self.session_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{suffix}"
+        self.session_dir = os.path.join(archive_dir, self.session_id)
+        self.start_time = time.time()
+
+        self.pending: Deque[Tuple[float, int, mavlink.MAVLink_message]] = deque()
+        self.tables: Dict[str, ArchiveTable] = {}
+        self.rows_written: int = 0
+        self.dropped: int = 0
+        self._reported_dropped: int = 0
+
+    def append(
+        self, system_id: int, message_type: str, message: mavlink.MAVLink_message
+    ) -> None:
+        if message_type not in self.message_types:
+            return
+        if len(self.pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        self.pending.append((time.time(), system_id, message))
+
+    def _write_session_file(self) -> None:
+        session = {
+            "session_id": self.session_id,
+            "start_time": self.start_time,
+            "chunk_rows": self.chunk_rows,
+            "tables": {
+                message_type: [column.to_json() for column in table.columns]
+                for message_type, table in self.tables.items()
+            },
+        }
+        path = os.path.join(self.session_dir, SESSION_FILE)
+        with open(f"{path}.tmp", "w") as session_file:
+            json.dump(session, session_file)
+        os.replace(f"{path}.tmp", path)
+
+    def flush(self) -> None:
+        """Write out everything queued so far, grouped by message type."""
+        batches: Dict[str, List[Tuple[float, int, mavlink.MAVLink_message]]] = {}
+        for _ in range(len(self.pending)):
+            item = self.pending.popleft()
+            batches.setdefault(item[2].get_type(), []).append(item)
+
+        if self.dropped != self._reported_dropped:
+            self.logger.warning(
+                f"Archive can't keep up, dropped "
+                f"{self.dropped - self._reported_dropped} messages"
+            )
+            self._reported_dropped = self.dropped
+
+        if not batches:
+            return
+
+        new_tables = False
+        for message_type, messages in batches.items():
+            table = self.tables.get(message_type)
+            if table is None:
+                table = ArchiveTable(
+                    os.path.join(self.session_dir, message_type),
+                    get_message_columns(messages[0][2]),
+                    self.chunk_rows,
+                )
+                self.tables[message_type] = table
+                new_tables = True
+            # Under gevent the file writes would otherwise hold up the event loop
+            run_blocking(table.append, messages)
+            self.rows_written += len(messages)
+
+        if new_tables:
+            self._write_session_file()
+
+    def prune(self) -> None:
+        try:
+            removed = run_blocking(
+                prune_sessions,
+                self.archive_dir,
+                self.max_archive_bytes,
+                self.session_id,
+            )
+        except OSError:
+            self.logger.error("Could not prune telemetry archive", exc_info=True)
+            return
+        if removed:
+            self.logger.info(f"Removed old archived sessions {', '.join(removed)}")
+
+    def run(self) -> None:
+        last_prune_time = 0.0
+        while self.radio_link.is_active.is_set():
+            if time.monotonic() - last_prune_time >= PRUNE_INTERVAL:
+                self.prune()
+                last_prune_time = time.monotonic()
+
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError:
+                self.logger.error("Could not write telemetry archive", exc_info=True)
+
+        # Write out whatever arrived before the link closed
+        try:
+            self.flush()
+        except OSError:
+            self.logger.error("Could not write telemetry archive", exc_info=True)
+
+
+class ArchivedSession:
+    """
+    Read access to an archived session. Columns are memory mapped so nothing
+    is loaded until it's used, and a column that fits in one chunk is returned
+    without copying.
+    """
+
+    def __init__(self, session_dir: str):
+        self.session_dir = session_dir
+        with open(os.path.join(session_dir, SESSION_FILE)) as session_file:
+            session = json.load(session_file)
+
+        self.session_id: str = session["session_id"]
+        self.start_time: float = session["start_time"]
+        self.tables: Dict[str, List[Column]] = {
+            message_type: [Column.from_json(column) for column in columns]
+            for message_type, columns in session["tables"].items()
+        }
+
+    @property
+    def message_types(self) -> List[str]:
+        return sorted(self.tables.keys())
+
+    def get_column_info(self, message_type: str, column_name: str) -> Column:
+        for column in self.tables[message_type]:
+            if column.name == column_name:
+                return column
+        raise KeyError(f"{message_type} has no column {column_name}")
+
+    def get_chunks(self, message_type: str, column_name: str) -> List[np.ndarray]:
+        """Get a memory map of each chunk of a column, in order."""
+        column = self.get_column_info(message_type, column_name)
+        table_dir = os.path.join(self.session_dir, message_type)
+        # Only map whole rows, the writer may be part way through a batch
+        row_size = column.dtype.itemsize * max(column.length, 1)
+
+        chunks: List[np.ndarray] = []
+        chunk = 0
+        while True:
+            path = get_chunk_path(table_dir, column.name, chunk)
+            if not os.path.exists(path):
+                break
+            rows = os.path.getsize(path) // row_size
+            if rows:
+                chunks.append(
+                    np.memmap(
+                        path, dtype=column.dtype, mode="r", shape=(rows,) + column.shape
+                    )
+                )
+            chunk += 1
+        return chunks
+
+    def iter_chunks(
+        self, message_type: str, column_names: List[str]
+    ) -> Iterator[Tuple[np.ndarray, ...]]:
+        """
+        Go through several columns a chunk at a time, so only the rows that are
+        used get paged in. Columns are appended one after another, so each
+        chunk is trimmed to the rows all of them have.
+        """
+        for chunks in zip(
+            *(self.get_chunks(message_type, name) for name in column_names)
+        ):
+            rows = min(len(chunk) for chunk in chunks)
+            yield tuple(chunk[:rows] for chunk in chunks)
+
+    def get_column(self, message_type: str, column_name: str) -> np.ndarray:
+        chunks = self.get_chunks(message_type, column_name)
+        if not chunks:
+            column = self.get_column_info(message_type, column_name)
+            return np.empty((0,) + column.shape, column.dtype)
+        if len(chunks) == 1:
+            return chunks[0]
+        return np.concatenate(chunks)
+
+    def get_field(
+        self,
+        message_type: str,
+        field: str,
+        system_id: Optional[int] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Get the timestamps and values of a field, optionally for one vehicle."""
+        column = self.get_column_info(message_type, field)
+        timestamp_chunks = [np.empty(0, np.float64)]
+        value_chunks = [np.empty((0,) + column.shape, column.dtype)]
+        for timestamps, sources, values in self.iter_chunks(
+            message_type, [TIMESTAMP_COLUMN, SYSTEM_ID_COLUMN, field]
+        ):
+            if system_id is not None:
+                mask = sources == system_id
+                timestamps, values = timestamps[mask], values[mask]
+            timestamp_chunks.append(timestamps)
+            value_chunks.append(values)
+
+        if len(timestamp_chunks) == 2:
+            return timestamp_chunks[1], value_chunks[1]
+        return np.concatenate(timestamp_chunks), np.concatenate(value_chunks)
+
+
+def list_sessions(archive_dir: str = DEFAULT_ARCHIVE_DIR) -> List[str]:
+    """Get the IDs of the archived sessions, oldest first."""
+    if not os.path.isdir(archive_dir):
+        return []
+    return sorted(
+        session_id
+        for session_id in os.listdir(archive_dir)
+        if SESSION_ID_PATTERN.fullmatch(session_id)
+        and os.path.exists(os.path.join(archive_dir, session_id, SESSION_FILE))
+    )
+
+
+def get_directory_size(path: str) -> int:
+    size = 0
+    for directory, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(directory, name)).st_size
+            except FileNotFoundError:
+                pass
+    return size
+
+
+def prune_sessions(
+    archive_dir: str = DEFAULT_ARCHIVE_DIR,
+    max_bytes: int = MAX_ARCHIVE_BYTES,
+    keep_session_id: Optional[str] = None,
+) -> List[str]:
+    """
+    Delete the oldest archived sessions until the archive fits in max_bytes,
+    never the one being written. Returns the IDs of the deleted sessions.
+    """
+    sessions = [
+        (session_id, get_directory_size(os.path.join(archive_dir, session_id)))
+        for session_id in list_sessions(archive_dir)
+    ]
+    total = sum(size for _, size in sessions)
+    if keep_session_id is not None and keep_session_id not in dict(sessions):
+        # Not listed until its session file has been written
+        total += get_directory_size(os.path.join(archive_dir, keep_session_id))
+
+    removed = []
+    for session_id, size in sessions:
+        if total <= max_bytes:
+            break
+        if session_id == keep_session_id:
+            continue
+        shutil.rmtree(os.path.join(archive_dir, session_id))
+        total -= size
+        removed.append(session_id)
+    return removed
+
+
+def open_session(
+    session_id: str, archive_dir: str = DEFAULT_ARCHIVE_DIR
+) -> ArchivedSession:
+    """
+    Open an archived session. The ID can come from a client, so only the
+    sessions in the archive directory can be opened, never another path.
+    """
+    if (
+        not isinstance(session_id, str)
+        or not SESSION_ID_PATTERN.fullmatch(session_id)
+        or session_id not in list_sessions(archive_dir)
+    ):
+        raise FileNotFoundError(f"No archived session {session_id}")
+    return ArchivedSession(os.path.join(archive_dir, session_id))
@@ -0,0 +1,32 @@
+from typing import Any, Callable
+
+from app import async_mode
+
+
+def run_blocking(func: Callable, *args: Any, **kwargs: Any) -> Any:
+    """
+    Run a call that blocks without yielding, like file IO or a long numpy
+    computation. Under gevent it goes to the hub's thread pool so the event
+    loop keeps serving clients, otherwise it's called directly since every
+    handler already has its own thread.
+
+    Only pure functions should be passed, anything touching locks, queues or
+    sockets has to stay on the event loop.
+    """
+    if async_mode == "gevent":
+        from gevent import get_hub
+
+        return get_hub().threadpool.apply(func, args, kwargs)
+    return func(*args, **kwargs)
+
+
+def wait_for_read(fileno: int) -> None:
+    """
+    Wait for a pipe or socket that gevent hasn't patched to have something to
+    read. Under gevent this parks the greenlet on the event loop instead of
+    blocking it, otherwise the read that follows blocks its own thread anyway.
+    """
+    if async_mode == "gevent":
+        from gevent.socket import wait_read
+
+        wait_read(fileno)
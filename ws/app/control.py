@@ -0,0 +1,367 @@
+import logging
+import os
+import socket
+import stat
+import struct
+from enum import IntEnum
+from queue import Empty, Full, Queue
+from typing import TYPE_CHECKING, Any, List, Optional, Sequence, Tuple, Union
+
+from app.types import Response
+
+if TYPE_CHECKING:
+    from app.radio_link import RadioLink
+
+# Every datagram starts with a header, all fields are little endian:
+#   magic (u8), message type (u8), sequence (u16, echoed back in the result)
+# Setpoint messages follow it with a count (u16) and that many setpoints:
+#   position: system_id (u8), latitude and longitude (i32, degrees * 1e7),
+#             relative altitude (f32, m)
+#   velocity: system_id (u8), vx, vy, vz (f32, m/s north, east, down)
+# A command is one action (u8), system_id (u8, 0 for every vehicle) and a
+# parameter (f32), the takeoff altitude or 1 to force arming and disarming.
+# A result is success (u8) followed by the message in UTF-8.
+CONTROL_MAGIC = 0xC7
+HEADER = struct.Struct("<BBH")
+COUNT = struct.Struct("<H")
+POSITION_SETPOINT = struct.Struct("<Biif")
+VELOCITY_SETPOINT = struct.Struct("<Bfff")
+COMMAND = struct.Struct("<BBf")
+RESULT = struct.Struct("<B")
+
+MAX_DATAGRAM_SIZE = 65507
+COMMAND_QUEUE_SIZE = 256
+
+
+class ControlMessage(IntEnum):
+    POSITION_SETPOINTS = 1
+    VELOCITY_SETPOINTS = 2
+    COMMAND = 3
+    RESULT = 4
+
+
+class ControlAction(IntEnum):
+    ARM = 1
+    DISARM = 2
+    GUIDED = 3
+    TAKEOFF = 4
+    STOP_SETPOINTS = 5
+
+
+def check_control_address(address: Any) -> Union[int, str]:
+    """
+    Make sure a control address is a port number or a socket path, raising a
+    ValueError if not. It comes from clients, so nothing is opened before
+    this has been checked.
+    """
+    if isinstance(address, int) and not isinstance(address, bool):
+        if not 0 < address < 65536:
+            raise ValueError(f"Control port {address} is out of range")
+        return address
+    if isinstance(address, str) and address:
+        return address
+    raise ValueError("Control address should be a port number or a socket path")
+
+
+def remove_stale_socket(path: str) -> None:
+    """
+    Remove a Unix socket nothing is listening on any more, raising a
+    FileExistsError if something still is.
+    """
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        probe.connect(path)
+    except ConnectionRefusedError:
+        os.unlink(path)
+        return
+    except OSError:
+        # A socket of another type, which something else owns
+        pass
+    finally:
+        probe.close()
+    raise FileExistsError(f"{path} is in use")
+
+
+def pack_position_setpoints(
+    sequence: int, setpoints: Sequence[Tuple[int, float, float, float]]
+) -> bytes:
+    """Pack (system_id, latitude, longitude, altitude) setpoints into a datagram."""
+    return b"".join(
+        [
+            HEADER.pack(CONTROL_MAGIC, ControlMessage.POSITION_SETPOINTS, sequence),
+            COUNT.pack(len(setpoints)),
+        ]
+        + [
+            POSITION_SETPOINT.pack(
+                system_id, int(latitude * 1e7), int(longitude * 1e7), altitude
+            )
+            for system_id, latitude, longitude, altitude in setpoints
+        ]
+    )
+
+
+def pack_velocity_setpoints(
+    sequence: int, setpoints: Sequence[Tuple[int, float, float, float]]
+) -> bytes:
+    """Pack (system_id, vx, vy, vz) setpoints into a datagram."""
+    return b"".join(
+        [
+            HEADER.pack(CONTROL_MAGIC, ControlMessage.VELOCITY_SETPOINTS, sequence),
+            COUNT.pack(len(setpoints)),
+        ]
+        + [VELOCITY_SETPOINT.pack(*setpoint) for setpoint in setpoints]
+    )
+
+
+def pack_command(
+    sequence: int, action: ControlAction, system_id: int = 0, param: float = 0.0
+) -> bytes:
+    return HEADER.pack(CONTROL_MAGIC, ControlMessage.COMMAND, sequence) + COMMAND.pack(
+        action, system_id, param
+    )
+
+
+def unpack_result(data: bytes) -> Tuple[int, bool, str]:
+    """Get the sequence, success and message out of a result datagram."""
+    _, _, sequence = HEADER.unpack_from(data)
+    (success,) = RESULT.unpack_from(data, HEADER.size)
+    return sequence, bool(success), data[HEADER.size + RESULT.size :].decode()
+
+
+class ControlIngress:
+    """
+    Takes setpoints and commands from controllers on the same machine as
+    compact binary datagrams, over UDP on the loopback interface or a Unix
+    datagram socket, and feeds them straight into the radio link. This skips
+    JSON, Socket.IO and the web server for planners pushing thousands of
+    setpoints a second.
+
+    Setpoints go to the setpoint streamer as they arrive, and only get a
+    result back if some were rejected. Commands wait for acknowledgements, so
+    they run one at a time on a thread of their own (the same as two commands
+    couldn't both wait for COMMAND_ACK) and always get a result.
+    """
+
+    def __init__(self, radio_link: "RadioLink", address: Union[int, str]):
+        self.logger = logging.getLogger("control_ingress")
+
+        self.radio_link = radio_link
+        self.address = check_control_address(address)
+        # Identifies the socket file bound here, the only file close() will
+        # remove. Inodes get reused, so the change time is part of it.
+        self.bound_socket: Optional[Tuple[int, int, int]] = None
+
+        if isinstance(address, str):
+            # Only a socket left behind by an earlier run is replaced, the
+            # path comes from a client and could name any file
+            try:
+                existing = os.lstat(address)
+            except FileNotFoundError:
+                pass
+            else:
+                if not stat.S_ISSOCK(existing.st_mode):
+                    raise FileExistsError(f"{address} exists and isn't a socket")
+                remove_stale_socket(address)
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.sock.bind(address)
+            bound = os.lstat(address)
+            self.bound_socket = (bound.st_dev, bound.st_ino, bound.st_ctime_ns)
+        else:
+            # Loopback only, anything that can reach this can fly the fleet
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.bind(("127.0.0.1", address))
+        self.sock.settimeout(1)
+
+        self.commands: Queue = Queue(maxsize=COMMAND_QUEUE_SIZE)
+
+        self.datagrams: int = 0
+        self.setpoints: int = 0
+        self.commands_run: int = 0
+        self.rejected: int = 0
+        self.malformed: int = 0
+
+    def _reply(self, sender: Any, sequence: int, response: Response) -> None:
+        # Unix socket clients that didn't bind a path of their own can't be
+        # replied to
+        if not sender:
+            return
+        try:
+            self.sock.sendto(
+                HEADER.pack(CONTROL_MAGIC, ControlMessage.RESULT, sequence)
+                + RESULT.pack(response["success"])
+                + response.get("message", "").encode(),
+                sender,
+            )
+        except OSError as e:
+            self.logger.debug(f"Could not send result to {sender}: {e}")
+
+    def _handle_setpoints(
+        self, message_type: int, data: bytes, sender: Any, sequence: int
+    ) -> None:
+        (count,) = COUNT.unpack_from(data, HEADER.size)
+        offset = HEADER.size + COUNT.size
+        setpoint_struct = (
+            POSITION_SETPOINT
+            if message_type == ControlMessage.POSITION_SETPOINTS
+            else VELOCITY_SETPOINT
+        )
+        body = data[offset : offset + count * setpoint_struct.size]
+        if len(body) != count * setpoint_struct.size:
+            raise struct.error(f"Expected {count} setpoints")
+
+        targets: List[Tuple[int, str, Tuple[float, ...]]]
+        if message_type == ControlMessage.POSITION_SETPOINTS:
+            targets = [
+                (system_id, "position", (latitude / 1e7, longitude / 1e7, altitude))
+                for system_id, latitude, longitude, altitude in (
+                    POSITION_SETPOINT.iter_unpack(body)
+                )
+            ]
+        else:
+            targets = [
+                (system_id, "velocity", (vx, vy, vz))
+                for system_id, vx, vy, vz in VELOCITY_SETPOINT.iter_unpack(body)
+            ]
+
+        errors = self.radio_link.setpoint_streamer.set_targets(targets)
+        self.setpoints += count - len(errors)
+        if errors:
+            self.rejected += len(errors)
+            self._reply(
+                sender,
+                sequence,
+                {
+                    "success": False,
+                    "message": f"Rejected {len(errors)} setpoints: {'; '.join(errors)}",
+                },
+            )
+
+    def run_command(self, action: int, system_id: int, param: float) -> Response:
+        radio_link = self.radio_link
+        system_ids = [system_id] if system_id else sorted(radio_link.vehicles)
+        if system_id and system_id not in radio_link.vehicles:
+            return {"success": False, "message": f"Vehicle {system_id} not found"}
+
+        if action == ControlAction.ARM:
+            if system_id:
+                return radio_link.arm_vehicle(system_id, bool(param))
+            return radio_link.arm_all_vehicles(bool(param))
+        elif action == ControlAction.DISARM:
+            if system_id:
+                return radio_link.disarm_vehicle(system_id, bool(param))
+            return radio_link.disarm_all_vehicles(bool(param))
+        elif action == ControlAction.GUIDED:
+            failed_vehicles = radio_link._set_vehicles_to_guided_mode(system_ids)
+            if failed_vehicles:
+                return {
+                    "success": False,
+                    "message": f"Could not set GUIDED mode on vehicles {failed_vehicles}",
+                }
+            return {
+                "success": True,
+                "message": f"Set GUIDED mode on {len(system_ids)} vehicles",
+            }
+        elif action == ControlAction.TAKEOFF:
+            responses = [
+                radio_link.copter_takeoff(takeoff_system_id, param)
+                for takeoff_system_id in system_ids
+            ]
+            if len(responses) == 1:
+                return responses[0]
+            failed = sum(not response["success"] for response in responses)
+            return {
+                "success": not failed,
+                "message": f"{len(responses) - failed} of {len(responses)} "
+                "vehicles took off",
+            }
+        elif action == ControlAction.STOP_SETPOINTS:
+            return radio_link.setpoint_streamer.clear_setpoints(
+                [system_id] if system_id else None
+            )
+        return {"success": False, "message": f"Unknown action {action}"}
+
+    def _handle_datagram(self, data: bytes, sender: Any) -> None:
+        try:
+            magic, message_type, sequence = HEADER.unpack_from(data)
+        except struct.error:
+            self.malformed += 1
+            return
+        if magic != CONTROL_MAGIC:
+            self.malformed += 1
+            return
+
+        try:
+            if message_type in (
+                ControlMessage.POSITION_SETPOINTS,
+                ControlMessage.VELOCITY_SETPOINTS,
+            ):
+                self._handle_setpoints(message_type, data, sender, sequence)
+            elif message_type == ControlMessage.COMMAND:
+                action, system_id, param = COMMAND.unpack_from(data, HEADER.size)
+                self.commands.put_nowait((sender, sequence, action, system_id, param))
+            else:
+                raise struct.error(f"Unknown message type {message_type}")
+        except struct.error as e:
+            self.malformed += 1
+            self._reply(sender, sequence, {"success": False, "message": str(e)})
+        except Full:
+            self.rejected += 1
+            self._reply(
+                sender,
+                sequence,
+                {"success": False, "message": "Too many commands waiting to run"},
+            )
+
+    def run(self) -> None:
+        while self.radio_link.is_active.is_set():
+            try:
+                data, sender = self.sock.recvfrom(MAX_DATAGRAM_SIZE)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            self.datagrams += 1
+            self._handle_datagram(data, sender)
+
+    def run_commands(self) -> None:
+        while self.radio_link.is_active.is_set():
+            try:
+                sender, sequence, action, system_id, param = self.commands.get(
+                    timeout=1
+                )
+            except Empty:
+                continue
+            try:
+                response = self.run_command(action, system_id, param)
+            except Exception as e:
+                self.logger.error(f"Control command {action} failed", exc_info=True)
+                response = {"success": False, "message": str(e)}
+            self.commands_run += 1
+            self._reply(sender, sequence, response)
+
+    def close(self) -> None:
+        self.sock.close()
+        if self.bound_socket is None or not isinstance(self.address, str):
+            return
+        try:
+            current = os.lstat(self.address)
+        except FileNotFoundError:
+            return
+        # Leave it if something else has been put there since
+        if (
+            stat.S_ISSOCK(current.st_mode)
+            and (current.st_dev, current.st_ino, current.st_ctime_ns)
+            == self.bound_socket
+        ):
+            os.unlink(self.address)
+
+    def get_status(self) -> dict:
+        return {
+            "address": self.address,
+            "datagrams": self.datagrams,
+            "setpoints": self.setpoints,
+            "commands": self.commands_run,
+            "queued_commands": self.commands.qsize(),
+            "rejected": self.rejected,
+            "malformed": self.malformed,
+        }
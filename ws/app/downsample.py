@@ -0,0 +1,71 @@
+import numpy as np
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest triangle three buckets downsampling. Keeps the first and last
+    points and from each bucket in between picks the point making the largest
+    triangle with the previously picked point and the average of the next
+    bucket, which preserves peaks and the overall shape of the line.
+
+    Returns the indices of the picked points.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    every = (n - 2) / (threshold - 2)
+    edges = np.floor(np.arange(threshold - 1) * every).astype(np.int64) + 1
+    edges[-1] = n - 1
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_start, next_end = edges[i + 1], edges[i + 2]
+        else:
+            next_start, next_end = n - 1, n
+
+        average_x = x[next_start:next_end].mean()
+        average_y = y[next_start:next_end].mean()
+
+        # Twice the triangle area, the factor doesn't change the argmax
+        areas = np.abs(
+            (x[a] - average_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (average_y - y[a])
+        )
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+
+    return selected
+
+
+def min_max_buckets(y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Split the points into threshold / 2 buckets and keep the minimum and
+    maximum of each, in time order. Cheaper than LTTB and never loses a spike.
+
+    Returns the indices of the kept points.
+    """
+    n = len(y)
+    buckets = threshold // 2
+    if buckets < 1 or 2 * buckets >= n:
+        return np.arange(n)
+
+    edges = np.linspace(0, n, buckets + 1).astype(np.int64)
+    selected = np.empty(2 * buckets, dtype=np.int64)
+    for i in range(buckets):
+        bucket = y[edges[i] : edges[i + 1]]
+        low = edges[i] + int(np.argmin(bucket))
+        high = edges[i] + int(np.argmax(bucket))
+        selected[2 * i] = min(low, high)
+        selected[2 * i + 1] = max(low, high)
+
+    return np.unique(selected)
@@ -1,6 +1,10 @@
-from flask import Blueprint
-
 from . import actions as actions
 from . import connection as connection
-
-endpoints = Blueprint("endpoints", __name__)
+from . import debug as debug
+from . import errors as errors
+from . import history as history
+from . import missions as missions
+from . import params as params
+from . import spatial as spatial
+from . import telemetry as telemetry
+from .blueprint import endpoints as endpoints
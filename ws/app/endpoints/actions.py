@@ -1,9 +1,13 @@
 import logging
+import math
+from typing import List
 
-from typing_extensions import TypedDict
+from flask_socketio import emit
+from typing_extensions import NotRequired, TypedDict
 
 import app.shared_state as state
 from app import socketio
+from app.formation import FormationShape
 
 logger = logging.getLogger("endpoint.actions")
 
@@ -38,6 +42,36 @@ class GotoPositionSettings(TypedDict):
     altitude: float
 
 
+class FormationGotoSettings(TypedDict):
+    system_ids: List[int]
+    latitude: float
+    longitude: float
+    altitude: float
+    heading: float
+    shape: str
+    spacing: float
+    offsets: NotRequired[List[List[float]]]
+
+
+class SetpointSettings(TypedDict):
+    system_id: int
+    latitude: NotRequired[float]
+    longitude: NotRequired[float]
+    altitude: NotRequired[float]
+    vx: NotRequired[float]
+    vy: NotRequired[float]
+    vz: NotRequired[float]
+
+
+class StreamSetpointsSettings(TypedDict):
+    setpoints: List[SetpointSettings]
+    rate: NotRequired[float]
+
+
+class StopSetpointsSettings(TypedDict):
+    system_ids: NotRequired[List[int]]
+
+
 @socketio.on("arm_vehicle")
 def arm_vehicle(arm_settings: ArmDisarmSettings) -> None:
     if state.radio_link is None:
@@ -46,7 +80,7 @@ def arm_vehicle(arm_settings: ArmDisarmSettings) -> None:
 
     system_id = arm_settings.get("system_id")
     if system_id is None:
-        socketio.emit(
+        emit(
             "arm_vehicle_result",
             {
                 "success": False,
@@ -59,7 +93,7 @@ def arm_vehicle(arm_settings: ArmDisarmSettings) -> None:
 
     arm_result = state.radio_link.arm_vehicle(system_id, force)
 
-    socketio.emit("arm_vehicle_result", arm_result)
+    emit("arm_vehicle_result", arm_result)
 
 
 @socketio.on("arm_all_vehicles")
@@ -72,7 +106,7 @@ def arm_all_vehicles(arm_settings: ArmDisarmAllVehiclesSettings) -> None:
 
     arm_result = state.radio_link.arm_all_vehicles(force)
 
-    socketio.emit("arm_all_vehicles_result", arm_result)
+    emit("arm_all_vehicles_result", arm_result)
 
 
 @socketio.on("disarm_vehicle")
@@ -83,7 +117,7 @@ def disarm_vehicle(disarm_settings: ArmDisarmSettings) -> None:
 
     system_id = disarm_settings.get("system_id")
     if system_id is None:
-        socketio.emit(
+        emit(
             "disarm_vehicle_result",
             {
                 "success": False,
@@ -96,7 +130,7 @@ def disarm_vehicle(disarm_settings: ArmDisarmSettings) -> None:
 
     disarm_result = state.radio_link.disarm_vehicle(system_id, force)
 
-    socketio.emit("disarm_vehicle_result", disarm_result)
+    emit("disarm_vehicle_result", disarm_result)
 
 
 @socketio.on("disarm_all_vehicles")
@@ -109,7 +143,7 @@ def disarm_all_vehicles(disarm_settings: ArmDisarmAllVehiclesSettings) -> None:
 
     disarm_result = state.radio_link.disarm_all_vehicles(force)
 
-    socketio.emit("disarm_all_vehicles_result", disarm_result)
+    emit("disarm_all_vehicles_result", disarm_result)
 
 
 @socketio.on("set_vehicle_flight_mode")
@@ -120,7 +154,7 @@ def set_vehicle_flight_mode(flight_mode_settings: SetFlightModeSettings) -> None
 
     system_id = flight_mode_settings.get("system_id")
     if system_id is None:
-        socketio.emit(
+        emit(
             "set_vehicle_flight_mode_result",
             {
                 "success": False,
@@ -131,7 +165,7 @@ def set_vehicle_flight_mode(flight_mode_settings: SetFlightModeSettings) -> None
 
     flight_mode = flight_mode_settings.get("flight_mode", None)
     if flight_mode is None:
-        socketio.emit(
+        emit(
             "set_vehicle_flight_mode_result",
             {
                 "success": False,
@@ -143,7 +177,7 @@ def set_vehicle_flight_mode(flight_mode_settings: SetFlightModeSettings) -> None
     try:
         flight_mode = int(flight_mode)
     except ValueError:
-        socketio.emit(
+        emit(
             "set_vehicle_flight_mode_result",
             {
                 "success": False,
@@ -156,7 +190,7 @@ def set_vehicle_flight_mode(flight_mode_settings: SetFlightModeSettings) -> None
         system_id, flight_mode
     )
 
-    socketio.emit("set_vehicle_flight_mode_result", set_flight_mode_result)
+    emit("set_vehicle_flight_mode_result", set_flight_mode_result)
 
 
 @socketio.on("set_all_vehicles_flight_mode")
@@ -171,7 +205,7 @@ def set_all_vehicles_flight_mode(
 
     flight_mode = flight_mode_settings.get("flight_mode", None)
     if flight_mode is None:
-        socketio.emit(
+        emit(
             "set_all_vehicles_flight_mode_result",
             {
                 "success": False,
@@ -182,7 +216,7 @@ def set_all_vehicles_flight_mode(
 
     set_flight_mode_result = state.radio_link.set_all_vehicles_flight_mode(flight_mode)
 
-    socketio.emit("set_all_vehicles_flight_mode_result", set_flight_mode_result)
+    emit("set_all_vehicles_flight_mode_result", set_flight_mode_result)
 
 
 @socketio.on("copter_takeoff")
@@ -193,7 +227,7 @@ def copter_takeoff(takeoff_settings: CopterTakeoffSettings) -> None:
 
     system_id = takeoff_settings.get("system_id")
     if system_id is None:
-        socketio.emit(
+        emit(
             "copter_takeoff_result",
             {
                 "success": False,
@@ -204,7 +238,7 @@ def copter_takeoff(takeoff_settings: CopterTakeoffSettings) -> None:
 
     altitude = takeoff_settings.get("altitude")
     if altitude is None:
-        socketio.emit(
+        emit(
             "copter_takeoff_result",
             {
                 "success": False,
@@ -216,7 +250,7 @@ def copter_takeoff(takeoff_settings: CopterTakeoffSettings) -> None:
     try:
         altitude = float(altitude)
     except ValueError:
-        socketio.emit(
+        emit(
             "copter_takeoff_result",
             {
                 "success": False,
@@ -227,7 +261,7 @@ def copter_takeoff(takeoff_settings: CopterTakeoffSettings) -> None:
 
     takeoff_result = state.radio_link.copter_takeoff(system_id, altitude)
 
-    socketio.emit("copter_takeoff_result", takeoff_result)
+    emit("copter_takeoff_result", takeoff_result)
 
 
 @socketio.on("goto_position")
@@ -238,7 +272,7 @@ def goto_position(position_settings: GotoPositionSettings) -> None:
 
     system_id = position_settings.get("system_id")
     if system_id is None:
-        socketio.emit(
+        emit(
             "goto_position_result",
             {
                 "success": False,
@@ -249,7 +283,7 @@ def goto_position(position_settings: GotoPositionSettings) -> None:
 
     latitude = position_settings.get("latitude")
     if latitude is None:
-        socketio.emit(
+        emit(
             "goto_position_result",
             {
                 "success": False,
@@ -260,7 +294,7 @@ def goto_position(position_settings: GotoPositionSettings) -> None:
 
     longitude = position_settings.get("longitude")
     if longitude is None:
-        socketio.emit(
+        emit(
             "goto_position_result",
             {
                 "success": False,
@@ -271,7 +305,7 @@ def goto_position(position_settings: GotoPositionSettings) -> None:
 
     altitude = position_settings.get("altitude")
     if altitude is None:
-        socketio.emit(
+        emit(
             "goto_position_result",
             {
                 "success": False,
@@ -285,7 +319,7 @@ def goto_position(position_settings: GotoPositionSettings) -> None:
         longitude = float(longitude)
         altitude = float(altitude)
     except ValueError:
-        socketio.emit(
+        emit(
             "goto_position_result",
             {
                 "success": False,
@@ -298,4 +332,174 @@ def goto_position(position_settings: GotoPositionSettings) -> None:
         system_id, latitude, longitude, altitude
     )
 
-    socketio.emit("goto_position_result", goto_result)
+    emit("goto_position_result", goto_result)
+
+
+@socketio.on("formation_goto")
+def formation_goto(formation_settings: FormationGotoSettings) -> None:
+    if state.radio_link is None:
+        logger.warning("Not connected to radio link, cannot goto formation")
+        return
+
+    try:
+        system_ids = list(
+            dict.fromkeys(
+                int(system_id)
+                for system_id in formation_settings.get("system_ids")
+                or state.radio_link.vehicles.keys()
+            )
+        )
+    except (TypeError, ValueError):
+        emit(
+            "formation_goto_result",
+            {
+                "success": False,
+                "message": "Invalid system IDs specified while trying to goto formation",
+            },
+        )
+        return
+
+    try:
+        shape = FormationShape(formation_settings.get("shape"))
+    except ValueError:
+        emit(
+            "formation_goto_result",
+            {
+                "success": False,
+                "message": "Invalid formation shape specified while trying to goto formation",
+            },
+        )
+        return
+
+    try:
+        latitude = float(formation_settings["latitude"])
+        longitude = float(formation_settings["longitude"])
+        altitude = float(formation_settings["altitude"])
+        heading = float(formation_settings.get("heading", 0))
+        spacing = float(formation_settings.get("spacing", 10))
+        if not all(
+            math.isfinite(value)
+            for value in (latitude, longitude, altitude, heading, spacing)
+        ):
+            raise ValueError("Coordinates must be finite")
+    except (KeyError, TypeError, ValueError):
+        emit(
+            "formation_goto_result",
+            {
+                "success": False,
+                "message": "Invalid coordinates specified while trying to goto formation",
+            },
+        )
+        return
+
+    formation_result = state.radio_link.formation_goto(
+        system_ids,
+        latitude,
+        longitude,
+        altitude,
+        heading,
+        shape,
+        spacing,
+        formation_settings.get("offsets"),
+    )
+
+    emit("formation_goto_result", formation_result)
+
+
+@socketio.on("stream_setpoints")
+def stream_setpoints(setpoint_settings: StreamSetpointsSettings) -> None:
+    """
+    Update the targets streamed to vehicles, which have to be in GUIDED. Only
+    the latest setpoint for each vehicle is sent, at the streaming rate. To
+    keep the reply traffic down for clients pushing at a high rate, a result is
+    only sent back when something was rejected.
+    """
+    if state.radio_link is None:
+        logger.warning("Not connected to radio link, cannot stream setpoints")
+        return
+
+    setpoints = setpoint_settings.get("setpoints")
+    if not isinstance(setpoints, list):
+        emit(
+            "stream_setpoints_result",
+            {
+                "success": False,
+                "message": "No setpoints specified while trying to stream setpoints",
+            },
+        )
+        return
+
+    rate = setpoint_settings.get("rate")
+    if rate is not None:
+        try:
+            rate = float(rate)
+            if not math.isfinite(rate):
+                raise ValueError(f"Invalid rate {rate}")
+            state.radio_link.setpoint_streamer.set_rate(rate)
+        except (TypeError, ValueError):
+            emit(
+                "stream_setpoints_result",
+                {
+                    "success": False,
+                    "message": "Invalid rate specified while trying to stream setpoints",
+                },
+            )
+            return
+
+    setpoints_result = state.radio_link.setpoint_streamer.update_setpoints(setpoints)
+
+    if not setpoints_result["success"]:
+        emit("stream_setpoints_result", setpoints_result)
+
+
+@socketio.on("stop_setpoints")
+def stop_setpoints(stop_settings: StopSetpointsSettings) -> None:
+    """Stop streaming setpoints to some vehicles, leaving out system_ids means all."""
+    if state.radio_link is None:
+        logger.warning("Not connected to radio link, cannot stop setpoints")
+        return
+
+    system_ids = (stop_settings or {}).get("system_ids")
+
+    stop_result = state.radio_link.setpoint_streamer.clear_setpoints(
+        [int(system_id) for system_id in system_ids] if system_ids is not None else None
+    )
+
+    emit("stop_setpoints_result", stop_result)
+
+
+@socketio.on("get_setpoint_status")
+def get_setpoint_status() -> None:
+    """Get how many setpoints were sent, dropped and held back by the budget."""
+    if state.radio_link is None:
+        emit(
+            "get_setpoint_status_result",
+            {"success": False, "message": "Not connected to radio link"},
+        )
+        return
+
+    emit(
+        "get_setpoint_status_result",
+        {"success": True, "data": state.radio_link.setpoint_streamer.get_status()},
+    )
+
+
+@socketio.on("get_control_status")
+def get_control_status() -> None:
+    """Get how much the local control ingress has received, if it's open."""
+    if state.radio_link is None:
+        emit(
+            "get_control_status_result",
+            {"success": False, "message": "Not connected to radio link"},
+        )
+        return
+
+    control_status = state.radio_link.get_control_status()
+    if control_status is None:
+        emit(
+            "get_control_status_result",
+            {"success": False, "message": "Control ingress is not open"},
+        )
+        return
+
+    emit("get_control_status_result", {"success": True, "data": control_status})
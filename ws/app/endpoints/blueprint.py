@@ -0,0 +1,3 @@
+from flask import Blueprint
+
+endpoints = Blueprint("endpoints", __name__)
@@ -1,11 +1,24 @@
 import logging
+from typing import List, Optional, Union
 
+from flask import request
+from flask_socketio import emit
 from pymavlink import mavutil
-from typing_extensions import TypedDict
+from typing_extensions import NotRequired, TypedDict
 
 import app.shared_state as state
 from app import socketio
-from app.endpoints.telemetry import setup_telemetry_listeners
+from app.archive import DEFAULT_ARCHIVE_DIR
+from app.blocking import run_blocking
+from app.control import check_control_address
+from app.endpoints.telemetry import (
+    remove_telemetry_subscriptions,
+    setup_telemetry_listeners,
+    subscribe_to_all_telemetry,
+)
+from app.forwarding import ForwardOutputSettings
+from app.latency import LatencyStats
+from app.link_process import RadioLinkProcess
 from app.radio_link import RadioLink
 
 logger = logging.getLogger("endpoint.connection")
@@ -15,27 +28,73 @@ class ConnectionSettings(TypedDict):
     connectionType: str
     port: str
     baud: int
+    linkCapacity: NotRequired[int]
+    archiveTelemetry: NotRequired[bool]
+    # UDP port on 127.0.0.1 or Unix socket path for local controllers
+    controlAddress: NotRequired[Union[int, str]]
+    # Other ground stations to share the link with, see app/forwarding.py
+    forwardOutputs: NotRequired[List[ForwardOutputSettings]]
+
+
+class DisconnectSettings(TypedDict):
+    force: NotRequired[bool]
+
+
+def send_radio_link_status() -> None:
+    """Let every client know when the shared radio link opens or closes."""
+    socketio.emit(
+        "radio_link_status",
+        {
+            "success": True,
+            "data": {
+                "connected": bool(state.radio_link),
+                "clients": len(state.link_sessions.clients),
+            },
+        },
+    )
+
+
+def close_radio_link() -> None:
+    if state.radio_link:
+        state.radio_link.close()
+    state.radio_link = None
+    state.pipeline_latency = LatencyStats()
+    state.link_sessions.owner = None
+    send_radio_link_status()
+
+
+def close_idle_radio_link() -> None:
+    if state.radio_link:
+        logger.info("No clients left, closing radio link")
+        close_radio_link()
 
 
 @socketio.on("connect")
 def connect() -> None:
+    state.link_sessions.add(request.sid)  # type: ignore[attr-defined]
+    subscribe_to_all_telemetry()
     logger.debug("Client connected!")
 
 
 @socketio.on("disconnect")
 def disconnect() -> None:
-    if state.radio_link:
-        state.radio_link.close()
-    state.radio_link = None
+    remove_telemetry_subscriptions()
+    # The link is shared by every client, so it is only closed once the last
+    # one has been gone for a while
+    state.link_sessions.remove(
+        request.sid,  # type: ignore[attr-defined]
+        close_idle_radio_link,
+    )
     logger.debug("Client disconnected!")
 
 
 @socketio.on("get_com_ports")
 def get_com_ports() -> None:
-    com_ports = mavutil.auto_detect_serial(
-        preferred_list=["*ArduPilot*", "*MAVLink*", "*mavlink*", "*Cube*"]
+    com_ports = run_blocking(
+        mavutil.auto_detect_serial,
+        preferred_list=["*ArduPilot*", "*MAVLink*", "*mavlink*", "*Cube*"],
     )
-    socketio.emit(
+    emit(
         "get_com_ports_result",
         {"success": True, "data": [port.device for port in com_ports]},
     )
@@ -43,16 +102,14 @@ def get_com_ports() -> None:
 
 @socketio.on("is_connected_to_radio_link")
 def is_connected_to_radio_link() -> None:
-    socketio.emit(
+    emit(
         "is_connected_to_radio_link_result",
         {"success": True, "data": bool(state.radio_link)},
     )
 
 
 def send_connection_error(message: str) -> None:
-    socketio.emit(
-        "connect_to_radio_link_result", {"success": False, "message": message}
-    )
+    emit("connect_to_radio_link_result", {"success": False, "message": message})
 
 
 def initial_heartbeat_update(
@@ -61,10 +118,49 @@ def initial_heartbeat_update(
     socketio.emit("initial_heartbeat_update", message)
 
 
+def proximity_alert(message: dict) -> None:
+    socketio.emit("proximity_alert", message)
+
+
+def link_lost(message: dict) -> None:
+    socketio.emit("link_lost", message)
+
+
+def link_restored(message: dict) -> None:
+    socketio.emit("link_restored", message)
+
+
+def fleet_alert(message: dict) -> None:
+    socketio.emit("fleet_alert", message)
+
+
+def fleet_endurance(message: dict) -> None:
+    socketio.emit("fleet_endurance", message)
+
+
 @socketio.on("connect_to_radio_link")
 def connect_to_radio_link(connection_settings: ConnectionSettings) -> None:
+    if not state.connect_lock.acquire(blocking=False):
+        send_connection_error("Another client is already connecting to the radio link")
+        return
+    try:
+        open_radio_link(connection_settings)
+    finally:
+        state.connect_lock.release()
+
+
+def open_radio_link(connection_settings: ConnectionSettings) -> None:
     if state.radio_link:
-        logger.warning("Already connected to a radio link")
+        # Another operator has already opened the link, share it
+        vehicles_connected_to = state.radio_link.get_vehicles()
+        emit(
+            "connect_to_radio_link_result",
+            {
+                "success": True,
+                "message": f"Already connected to {len(vehicles_connected_to)} vehicles via radio link",
+                "data": {"vehicles": vehicles_connected_to},
+            },
+        )
         return
 
     connection_type = connection_settings.get("connectionType")
@@ -90,15 +186,40 @@ def connect_to_radio_link(connection_settings: ConnectionSettings) -> None:
         send_connection_error("Unknown connection type")
         return
 
-    radio_link = RadioLink(port, baud, initial_heartbeat_update)
+    control_address = connection_settings.get("controlAddress")
+    if control_address is not None:
+        try:
+            control_address = check_control_address(control_address)
+        except ValueError as e:
+            send_connection_error(str(e))
+            return
+
+    radio_link_class = RadioLinkProcess if state.use_link_process else RadioLink
+    radio_link = radio_link_class(
+        port,
+        baud,
+        initial_heartbeat_update,
+        link_capacity=connection_settings.get("linkCapacity"),
+        proximity_alert_callback=proximity_alert,
+        link_lost_callback=link_lost,
+        link_restored_callback=link_restored,
+        alert_callback=fleet_alert,
+        endurance_callback=fleet_endurance,
+        control_address=control_address,
+        forward_outputs=connection_settings.get("forwardOutputs"),
+        archive_dir=DEFAULT_ARCHIVE_DIR
+        if connection_settings.get("archiveTelemetry", True)
+        else None,
+    )
     if radio_link.master is None:
         # TODO: Add proper error handling and messages
         send_connection_error("Failed to connect to radio link")
         return
 
     state.radio_link = radio_link
+    state.link_sessions.owner = request.sid  # type: ignore[attr-defined]
     vehicles_connected_to = radio_link.get_vehicles()
-    socketio.emit(
+    emit(
         "connect_to_radio_link_result",
         {
             "success": True,
@@ -108,14 +229,95 @@ def connect_to_radio_link(connection_settings: ConnectionSettings) -> None:
     )
 
     setup_telemetry_listeners()
+    send_radio_link_status()
 
 
 @socketio.on("disconnect_from_radio_link")
-def disconnect_from_radio_link() -> None:
-    if state.radio_link:
-        state.radio_link.close()
-    state.radio_link = None
-    socketio.emit(
+def disconnect_from_radio_link(
+    disconnect_settings: Optional[DisconnectSettings] = None,
+) -> None:
+    """
+    Close the radio link for everyone. Only the client that opened the link
+    can do this while others are using it, unless force is set.
+    """
+    force = bool(disconnect_settings and disconnect_settings.get("force", False))
+    client_id = request.sid  # type: ignore[attr-defined]
+    if not force and not state.link_sessions.can_close(client_id):
+        emit(
+            "disconnect_from_radio_link_result",
+            {
+                "success": False,
+                "message": "The radio link is being used by other clients",
+            },
+        )
+        return
+
+    close_radio_link()
+    emit(
         "disconnect_from_radio_link_result",
         {"success": True, "message": "Disconnected from radio link"},
     )
+
+
+@socketio.on("add_forward_output")
+def add_forward_output(output_settings: ForwardOutputSettings) -> None:
+    """Start forwarding the radio link to another ground station."""
+    if state.radio_link is None:
+        emit(
+            "add_forward_output_result",
+            {"success": False, "message": "Not connected to radio link"},
+        )
+        return
+
+    address = output_settings.get("address")
+    if not address:
+        emit(
+            "add_forward_output_result",
+            {
+                "success": False,
+                "message": "No address specified while trying to add a forward output",
+            },
+        )
+        return
+
+    system_ids = output_settings.get("system_ids")
+    add_result = state.radio_link.forwarder.add_output(
+        str(address),
+        [int(system_id) for system_id in system_ids]
+        if system_ids is not None
+        else None,
+    )
+
+    emit("add_forward_output_result", add_result)
+
+
+@socketio.on("remove_forward_output")
+def remove_forward_output(output_settings: ForwardOutputSettings) -> None:
+    if state.radio_link is None:
+        emit(
+            "remove_forward_output_result",
+            {"success": False, "message": "Not connected to radio link"},
+        )
+        return
+
+    remove_result = state.radio_link.forwarder.remove_output(
+        str(output_settings.get("address"))
+    )
+
+    emit("remove_forward_output_result", remove_result)
+
+
+@socketio.on("get_forwarding_status")
+def get_forwarding_status() -> None:
+    """Get what has been forwarded to and received from each output."""
+    if state.radio_link is None:
+        emit(
+            "get_forwarding_status_result",
+            {"success": False, "message": "Not connected to radio link"},
+        )
+        return
+
+    emit(
+        "get_forwarding_status_result",
+        {"success": True, "data": state.radio_link.forwarder.get_status()},
+    )
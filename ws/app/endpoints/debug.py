@@ -0,0 +1,211 @@
+import logging
+from typing import Optional
+
+from flask import Response as FlaskResponse
+from flask import jsonify, request
+from flask.typing import ResponseReturnValue
+from flask_socketio import emit
+from typing_extensions import NotRequired, TypedDict
+
+from app import socketio
+from app.profiling import (
+    DEFAULT_SAMPLE_INTERVAL,
+    profile_threads,
+    start_memory_tracing,
+    stop_memory_tracing,
+    take_memory_snapshot,
+)
+from app.types import Response
+
+from .blueprint import endpoints
+
+logger = logging.getLogger("endpoints.debug")
+
+LOCAL_ADDRESSES = ["127.0.0.1", "::1"]
+
+
+class ProfileSettings(TypedDict):
+    duration: float
+    interval: NotRequired[float]
+
+
+class MemoryTracingSettings(TypedDict):
+    frames: NotRequired[int]
+
+
+class MemorySnapshotSettings(TypedDict):
+    group_by: NotRequired[str]
+    limit: NotRequired[int]
+
+
+def is_local_request() -> bool:
+    """Profiling is only offered to clients on the machine running the backend."""
+    return request.remote_addr in LOCAL_ADDRESSES
+
+
+def get_profile(duration: float, interval: float) -> Response:
+    logger.info(f"Profiling for {duration}s")
+    profile = profile_threads(duration, interval)
+    if profile is None:
+        return {"success": False, "message": "A profile is already running"}
+    return {"success": True, "data": profile}
+
+
+def get_memory_snapshot(group_by: str, limit: int) -> Response:
+    try:
+        snapshot = take_memory_snapshot(group_by, limit)
+    except ValueError as e:
+        return {"success": False, "message": str(e)}
+    if snapshot is None:
+        return {"success": False, "message": "Memory tracing has not been started"}
+    return {"success": True, "data": snapshot}
+
+
+@socketio.on("profile_backend")
+def profile_backend(profile_settings: ProfileSettings) -> None:
+    """
+    Sample the stacks of every thread for the given number of seconds, the
+    result has the counts of each stack in the collapsed format.
+    """
+    if not is_local_request():
+        emit(
+            "profile_backend_result",
+            {"success": False, "message": "Profiling is only allowed locally"},
+        )
+        return
+
+    try:
+        duration = float(profile_settings["duration"])
+        interval = float(profile_settings.get("interval", DEFAULT_SAMPLE_INTERVAL))
+    except (KeyError, TypeError, ValueError):
+        emit(
+            "profile_backend_result",
+            {"success": False, "message": "Invalid profile settings"},
+        )
+        return
+
+    emit("profile_backend_result", get_profile(duration, interval))
+
+
+@socketio.on("start_memory_tracing")
+def start_memory_tracing_event(
+    tracing_settings: Optional[MemoryTracingSettings] = None,
+) -> None:
+    if not is_local_request():
+        emit(
+            "start_memory_tracing_result",
+            {"success": False, "message": "Profiling is only allowed locally"},
+        )
+        return
+
+    try:
+        # tracemalloc only takes 1 to 65535 frames
+        started = start_memory_tracing(int((tracing_settings or {}).get("frames", 1)))
+    except (TypeError, ValueError):
+        emit(
+            "start_memory_tracing_result",
+            {"success": False, "message": "Invalid frames"},
+        )
+        return
+    if not started:
+        emit(
+            "start_memory_tracing_result",
+            {"success": False, "message": "Memory tracing is already running"},
+        )
+        return
+    emit("start_memory_tracing_result", {"success": True})
+
+
+@socketio.on("stop_memory_tracing")
+def stop_memory_tracing_event() -> None:
+    if not is_local_request():
+        emit(
+            "stop_memory_tracing_result",
+            {"success": False, "message": "Profiling is only allowed locally"},
+        )
+        return
+
+    if not stop_memory_tracing():
+        emit(
+            "stop_memory_tracing_result",
+            {"success": False, "message": "Memory tracing is not running"},
+        )
+        return
+    emit("stop_memory_tracing_result", {"success": True})
+
+
+@socketio.on("get_memory_snapshot")
+def get_memory_snapshot_event(
+    snapshot_settings: Optional[MemorySnapshotSettings] = None,
+) -> None:
+    """
+    Get where the most traced memory was allocated, and what has grown since
+    the last snapshot, to find what is piling up.
+    """
+    if not is_local_request():
+        emit(
+            "get_memory_snapshot_result",
+            {"success": False, "message": "Profiling is only allowed locally"},
+        )
+        return
+
+    snapshot_settings = snapshot_settings or {}
+    try:
+        limit = int(snapshot_settings.get("limit", 20))
+    except (TypeError, ValueError):
+        emit(
+            "get_memory_snapshot_result",
+            {"success": False, "message": "Invalid limit"},
+        )
+        return
+    emit(
+        "get_memory_snapshot_result",
+        get_memory_snapshot(str(snapshot_settings.get("group_by", "lineno")), limit),
+    )
+
+
+@endpoints.route("/debug/profile")
+def profile_route() -> ResponseReturnValue:
+    """
+    Profile for ?duration= seconds and get the collapsed stacks as text, to
+    pipe into flamegraph.pl or open in speedscope.
+    """
+    if not is_local_request():
+        return "Profiling is only allowed locally", 403
+
+    try:
+        duration = float(request.args.get("duration", 10))
+        interval = float(request.args.get("interval", DEFAULT_SAMPLE_INTERVAL))
+    except ValueError:
+        return "Invalid profile settings", 400
+
+    response = get_profile(duration, interval)
+    if not response["success"]:
+        return response["message"], 409
+    return FlaskResponse(response["data"]["collapsed"], mimetype="text/plain")
+
+
+@endpoints.route("/debug/memory", methods=["GET", "POST", "DELETE"])
+def memory_route() -> ResponseReturnValue:
+    """POST starts memory tracing, GET takes a snapshot and DELETE stops it."""
+    if not is_local_request():
+        return jsonify(
+            {"success": False, "message": "Profiling is only allowed locally"}
+        ), 403
+
+    if request.method == "POST":
+        try:
+            started = start_memory_tracing(int(request.args.get("frames", 1)))
+        except ValueError:
+            return jsonify({"success": False, "message": "Invalid frames"}), 400
+        return jsonify({"success": started}), 200 if started else 409
+    if request.method == "DELETE":
+        stopped = stop_memory_tracing()
+        return jsonify({"success": stopped}), 200 if stopped else 409
+
+    try:
+        limit = int(request.args.get("limit", 20))
+    except ValueError:
+        return jsonify({"success": False, "message": "Invalid limit"}), 400
+    response = get_memory_snapshot(request.args.get("group_by", "lineno"), limit)
+    return jsonify(response), 200 if response["success"] else 400
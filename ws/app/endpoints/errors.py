@@ -0,0 +1,24 @@
+import logging
+
+from flask import request
+from flask_socketio import emit
+
+from app import socketio
+from app.link_process import RemoteCallError
+
+logger = logging.getLogger("endpoint.errors")
+
+
+@socketio.on_error_default
+def handle_error(error: Exception) -> None:
+    """
+    Reply to an event whose call to the link process failed, the same way
+    its handler replies to anything else that goes wrong. Other errors are
+    left to Socket.IO.
+    """
+    if not isinstance(error, RemoteCallError):
+        raise error
+
+    event = request.event["message"]  # type: ignore[attr-defined]
+    logger.error(f"{event} failed: {error}")
+    emit(f"{event}_result", {"success": False, "message": str(error)})
@@ -0,0 +1,137 @@
+import logging
+from typing import List, Optional
+
+from flask import Response as FlaskResponse
+from flask import jsonify, request
+from flask.typing import ResponseReturnValue
+from flask_socketio import emit
+from typing_extensions import NotRequired, TypedDict
+
+import app.shared_state as state
+from app import socketio
+from app.archive import (
+    DEFAULT_ARCHIVE_DIR,
+    ArchivedSession,
+    list_sessions,
+    open_session,
+)
+from app.blocking import run_blocking
+from app.history import query_history
+from app.types import Response
+
+from .blueprint import endpoints
+
+logger = logging.getLogger("endpoints.history")
+
+
+class HistoryQuery(TypedDict):
+    message_type: str
+    field: str
+    session_id: NotRequired[str]
+    system_ids: NotRequired[List[int]]
+    start_time: NotRequired[float]
+    end_time: NotRequired[float]
+    width: NotRequired[int]
+    method: NotRequired[str]
+
+
+def get_archive_dir() -> str:
+    if state.radio_link is not None and state.radio_link.archive is not None:
+        return state.radio_link.archive.archive_dir
+    return DEFAULT_ARCHIVE_DIR
+
+
+def get_session(session_id: Optional[str]) -> ArchivedSession:
+    """
+    Open the given session, or by default the one being recorded by the radio
+    link, or the latest one if the link isn't recording.
+    """
+    archive_dir = get_archive_dir()
+    if session_id is None:
+        if state.radio_link is not None and state.radio_link.archive is not None:
+            session_id = state.radio_link.archive.session_id
+        else:
+            sessions = list_sessions(archive_dir)
+            if not sessions:
+                raise FileNotFoundError("No archived sessions")
+            session_id = sessions[-1]
+    return open_session(session_id, archive_dir)
+
+
+def get_history(query: HistoryQuery) -> Response:
+    try:
+        session = get_session(query.get("session_id"))
+        system_ids = query.get("system_ids")
+        start_time = query.get("start_time")
+        end_time = query.get("end_time")
+        # Downsampling a long session takes a while, keep it off the event loop
+        history = run_blocking(
+            query_history,
+            session,
+            str(query["message_type"]),
+            str(query["field"]),
+            [int(system_id) for system_id in system_ids]
+            if system_ids is not None
+            else None,
+            float(start_time) if start_time is not None else None,
+            float(end_time) if end_time is not None else None,
+            int(query.get("width", 1000)),
+            str(query.get("method", "lttb")),
+        )
+    except FileNotFoundError:
+        return {"success": False, "message": "Session has not been archived"}
+    except OSError as e:
+        logger.error(f"Could not read archived session: {e}")
+        return {"success": False, "message": "Could not read archived session"}
+    except (KeyError, TypeError, ValueError) as e:
+        return {"success": False, "message": f"Invalid history query: {e}"}
+
+    return {"success": True, "data": history}
+
+
+def get_sessions() -> Response:
+    return {"success": True, "data": {"sessions": list_sessions(get_archive_dir())}}
+
+
+@socketio.on("get_telemetry_history")
+def get_telemetry_history(query: HistoryQuery) -> None:
+    """
+    Get a field's history for each vehicle from the telemetry archive,
+    downsampled to the width of the chart it will be drawn on.
+    """
+    emit("get_telemetry_history_result", get_history(query))
+
+
+@socketio.on("get_archive_sessions")
+def get_archive_sessions() -> None:
+    emit("get_archive_sessions_result", get_sessions())
+
+
+@endpoints.route("/history")
+def history_route() -> ResponseReturnValue:
+    args = request.args
+    query: HistoryQuery = {
+        "message_type": args.get("message_type", ""),
+        "field": args.get("field", ""),
+    }
+    # Values are converted in get_history, the same as for Socket.IO queries
+    for key in ["session_id", "start_time", "end_time", "width", "method"]:
+        if key in args:
+            query[key] = args[key]  # type: ignore[literal-required]
+    if "system_ids" in args:
+        query["system_ids"] = args["system_ids"].split(",")  # type: ignore[typeddict-item]
+
+    response = get_history(query)
+    return jsonify(response), 200 if response["success"] else 400
+
+
+@endpoints.route("/history/sessions")
+def history_sessions_route() -> ResponseReturnValue:
+    return jsonify(get_sessions())
+
+
+@endpoints.after_request
+def allow_cross_origin(response: FlaskResponse) -> FlaskResponse:
+    # The frontend is served from a different origin to the backend
+    response.headers["Access-Control-Allow-Origin"] = "*"
+    return response
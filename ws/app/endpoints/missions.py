@@ -0,0 +1,68 @@
+import logging
+from typing import Dict, List
+
+from flask_socketio import emit
+from typing_extensions import NotRequired, TypedDict
+
+import app.shared_state as state
+from app import socketio
+from app.mission import MissionItem
+
+logger = logging.getLogger("endpoints.missions")
+
+
+class UploadMissionSettings(TypedDict):
+    missions: NotRequired[Dict[str, List[MissionItem]]]
+    system_ids: NotRequired[List[int]]
+    items: NotRequired[List[MissionItem]]
+
+
+def mission_upload_progress(message: dict) -> None:
+    emit("mission_upload_progress", message)
+
+
+@socketio.on("upload_mission")
+def upload_mission(mission_settings: UploadMissionSettings) -> None:
+    """
+    Upload missions to vehicles, either a different mission per vehicle given
+    as a map of system ID to items, or the same items to a list of vehicles.
+    """
+    if state.radio_link is None:
+        logger.warning("Not connected to radio link, cannot upload mission")
+        return
+
+    try:
+        if "missions" in mission_settings:
+            missions = {
+                int(system_id): items
+                for system_id, items in mission_settings["missions"].items()
+            }
+        else:
+            items = mission_settings.get("items", [])
+            system_ids = mission_settings.get("system_ids") or list(
+                state.radio_link.vehicles.keys()
+            )
+            missions = {int(system_id): items for system_id in system_ids}
+    except (AttributeError, TypeError, ValueError):
+        emit(
+            "upload_mission_result",
+            {
+                "success": False,
+                "message": "Invalid missions specified while trying to upload mission",
+            },
+        )
+        return
+
+    if not missions:
+        emit(
+            "upload_mission_result",
+            {
+                "success": False,
+                "message": "No vehicles specified while trying to upload mission",
+            },
+        )
+        return
+
+    upload_result = state.radio_link.upload_missions(missions, mission_upload_progress)
+
+    emit("upload_mission_result", upload_result)
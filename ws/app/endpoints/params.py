@@ -0,0 +1,128 @@
+import logging
+from typing import Dict, List
+
+from flask_socketio import emit
+from typing_extensions import NotRequired, TypedDict
+
+import app.shared_state as state
+from app import socketio
+
+logger = logging.getLogger("endpoints.params")
+
+
+class FetchParamsSettings(TypedDict):
+    system_ids: NotRequired[List[int]]
+    use_cache: NotRequired[bool]
+
+
+class GetParamsSettings(TypedDict):
+    system_id: int
+
+
+class SetParamsSettings(TypedDict):
+    system_ids: NotRequired[List[int]]
+    params: Dict[str, float]
+
+
+def params_download_progress(message: dict) -> None:
+    emit("params_download_progress", message)
+
+
+@socketio.on("fetch_params")
+def fetch_params(fetch_settings: FetchParamsSettings) -> None:
+    """
+    Fetch the parameters of the given vehicles, or all vehicles if none are
+    given. Use get_params afterwards to read each vehicle's parameters.
+    """
+    if state.radio_link is None:
+        logger.warning("Not connected to radio link, cannot fetch params")
+        return
+
+    try:
+        system_ids = [
+            int(system_id)
+            for system_id in fetch_settings.get("system_ids")
+            or state.radio_link.vehicles.keys()
+        ]
+    except (TypeError, ValueError):
+        emit(
+            "fetch_params_result",
+            {
+                "success": False,
+                "message": "Invalid system IDs specified while trying to fetch params",
+            },
+        )
+        return
+
+    fetch_result = state.radio_link.fetch_params(
+        system_ids,
+        bool(fetch_settings.get("use_cache", True)),
+        params_download_progress,
+    )
+
+    emit("fetch_params_result", fetch_result)
+
+
+@socketio.on("get_params")
+def get_params(get_settings: GetParamsSettings) -> None:
+    if state.radio_link is None:
+        logger.warning("Not connected to radio link, cannot get params")
+        return
+
+    system_id = get_settings.get("system_id")
+    if system_id is None:
+        emit(
+            "get_params_result",
+            {
+                "success": False,
+                "message": "No system ID specified while trying to get params",
+            },
+        )
+        return
+
+    emit("get_params_result", state.radio_link.get_params(system_id))
+
+
+@socketio.on("set_params")
+def set_params(set_settings: SetParamsSettings) -> None:
+    """
+    Set the same parameters on the given vehicles, or all vehicles if none are
+    given.
+    """
+    if state.radio_link is None:
+        logger.warning("Not connected to radio link, cannot set params")
+        return
+
+    try:
+        params = {
+            str(name): float(value)
+            for name, value in set_settings.get("params", {}).items()
+        }
+        system_ids = [
+            int(system_id)
+            for system_id in set_settings.get("system_ids")
+            or state.radio_link.vehicles.keys()
+        ]
+    except (AttributeError, TypeError, ValueError):
+        emit(
+            "set_params_result",
+            {
+                "success": False,
+                "message": "Invalid params specified while trying to set params",
+            },
+        )
+        return
+
+    if not params:
+        emit(
+            "set_params_result",
+            {
+                "success": False,
+                "message": "No params specified while trying to set params",
+            },
+        )
+        return
+
+    set_result = state.radio_link.set_params(system_ids, params)
+
+    emit("set_params_result", set_result)
@@ -0,0 +1,176 @@
+import logging
+import math
+from typing import Any, List, Tuple
+
+from flask_socketio import emit
+from typing_extensions import TypedDict
+
+import app.shared_state as state
+from app import socketio
+
+logger = logging.getLogger("endpoints.spatial")
+
+
+class BboxQuery(TypedDict):
+    min_latitude: float
+    min_longitude: float
+    max_latitude: float
+    max_longitude: float
+
+
+class PolygonQuery(TypedDict):
+    points: List[Tuple[float, float]]
+
+
+class RadiusQuery(TypedDict):
+    latitude: float
+    longitude: float
+    radius: float
+
+
+class NearestQuery(TypedDict):
+    latitude: float
+    longitude: float
+    count: int
+
+
+def send_query_error(event: str, message: str) -> None:
+    emit(event, {"success": False, "message": message})
+
+
+def to_finite(value: Any) -> float:
+    """
+    Convert a query value to a float, rejecting infinities and NaN.
+    """
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(f"{value} is not a finite number")
+    return number
+
+
+@socketio.on("query_vehicles_in_bbox")
+def query_vehicles_in_bbox(query: BboxQuery) -> None:
+    if state.radio_link is None:
+        send_query_error("query_vehicles_in_bbox_result", "Not connected to radio link")
+        return
+
+    if not isinstance(query, dict):
+        send_query_error("query_vehicles_in_bbox_result", "Invalid bounding box")
+        return
+
+    try:
+        system_ids = state.radio_link.spatial_index.query_bbox(
+            to_finite(query["min_latitude"]),
+            to_finite(query["min_longitude"]),
+            to_finite(query["max_latitude"]),
+            to_finite(query["max_longitude"]),
+        )
+    except (KeyError, TypeError, ValueError, OverflowError):
+        send_query_error("query_vehicles_in_bbox_result", "Invalid bounding box")
+        return
+
+    emit(
+        "query_vehicles_in_bbox_result",
+        {"success": True, "data": {"system_ids": system_ids}},
+    )
+
+
+@socketio.on("query_vehicles_in_polygon")
+def query_vehicles_in_polygon(query: PolygonQuery) -> None:
+    if state.radio_link is None:
+        send_query_error(
+            "query_vehicles_in_polygon_result", "Not connected to radio link"
+        )
+        return
+
+    points = query.get("points") if isinstance(query, dict) else None
+    if not isinstance(points, list) or len(points) < 3:
+        send_query_error(
+            "query_vehicles_in_polygon_result", "A polygon needs at least 3 points"
+        )
+        return
+
+    try:
+        system_ids = state.radio_link.spatial_index.query_polygon(
+            [(to_finite(lat), to_finite(lon)) for lat, lon in points]
+        )
+    except (TypeError, ValueError, OverflowError):
+        send_query_error("query_vehicles_in_polygon_result", "Invalid polygon")
+        return
+
+    emit(
+        "query_vehicles_in_polygon_result",
+        {"success": True, "data": {"system_ids": system_ids}},
+    )
+
+
+@socketio.on("query_vehicles_in_radius")
+def query_vehicles_in_radius(query: RadiusQuery) -> None:
+    if state.radio_link is None:
+        send_query_error(
+            "query_vehicles_in_radius_result", "Not connected to radio link"
+        )
+        return
+
+    if not isinstance(query, dict):
+        send_query_error("query_vehicles_in_radius_result", "Invalid radius query")
+        return
+
+    try:
+        radius = to_finite(query["radius"])
+        if radius < 0:
+            raise ValueError("Radius can't be negative")
+        results = state.radio_link.spatial_index.query_radius(
+            to_finite(query["latitude"]), to_finite(query["longitude"]), radius
+        )
+    except (KeyError, TypeError, ValueError, OverflowError):
+        send_query_error("query_vehicles_in_radius_result", "Invalid radius query")
+        return
+
+    emit(
+        "query_vehicles_in_radius_result",
+        {
+            "success": True,
+            "data": {
+                "vehicles": [
+                    {"system_id": system_id, "distance": distance}
+                    for system_id, distance in results
+                ]
+            },
+        },
+    )
+
+
+@socketio.on("query_nearest_vehicles")
+def query_nearest_vehicles(query: NearestQuery) -> None:
+    if state.radio_link is None:
+        send_query_error("query_nearest_vehicles_result", "Not connected to radio link")
+        return
+
+    if not isinstance(query, dict):
+        send_query_error("query_nearest_vehicles_result", "Invalid nearest query")
+        return
+
+    try:
+        count = int(query.get("count", 1))
+        if count < 1:
+            raise ValueError("Count must be at least 1")
+        results = state.radio_link.spatial_index.query_nearest(
+            to_finite(query["latitude"]), to_finite(query["longitude"]), count
+        )
+    except (KeyError, TypeError, ValueError, OverflowError):
+        send_query_error("query_nearest_vehicles_result", "Invalid nearest query")
+        return
+
+    emit(
+        "query_nearest_vehicles_result",
+        {
+            "success": True,
+            "data": {
+                "vehicles": [
+                    {"system_id": system_id, "distance": distance}
+                    for system_id, distance in results
+                ]
+            },
+        },
+    )
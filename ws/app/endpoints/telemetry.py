@@ -1,19 +1,80 @@
 import logging
+import time
+from typing import List, Optional
 
+from flask import request
+from flask_socketio import emit, join_room, leave_room
 from pymavlink.mavutil import mavlink
+from typing_extensions import NotRequired, TypedDict
 
 import app.shared_state as state
 from app import socketio
+from app.snapshot import TELEMETRY_MESSAGES, serialize_message
+from app.subscriptions import TelemetrySubscriptions
 
 logger = logging.getLogger("endpoints.telemetry")
 
 
+class FleetSnapshotSettings(TypedDict):
+    system_ids: NotRequired[List[int]]
+
+
+class TelemetryLatencySettings(TypedDict):
+    system_ids: NotRequired[List[int]]
+
+
+class FleetAlertSettings(TypedDict):
+    system_ids: NotRequired[List[int]]
+
+
+class TelemetrySubscriptionSettings(TypedDict):
+    system_ids: NotRequired[Optional[List[int]]]
+    message_types: NotRequired[Optional[List[str]]]
+    replace: NotRequired[bool]
+
+
 def send_message(message: mavlink.MAVLink_message) -> None:
     if state.radio_link is not None:
-        message_dict = message.to_dict()
-        message_dict["system_id"] = message.get_srcSystem()
+        system_id = message.get_srcSystem()
+        rooms = state.telemetry_subscriptions.get_active_rooms(
+            system_id, message.get_type()
+        )
+        if not rooms:
+            return
+
+        data = serialize_message(message)
+        # How old the message is, from the vehicle sending it to us receiving
+        # it (if its clock offset is known) and from then until now
+        link_latency = getattr(message, "_link_latency", None)
+        pipeline_latency = time.time() - message._timestamp
+        state.pipeline_latency.add(system_id, pipeline_latency)
+        socketio.emit(
+            "telemetry_message",
+            {
+                "success": True,
+                "data": data,
+                "latency": {
+                    "link_ms": round(link_latency * 1000, 1)
+                    if link_latency is not None
+                    else None,
+                    "pipeline_ms": round(pipeline_latency * 1000, 1),
+                },
+            },
+            to=rooms,
+        )
+
 
-        socketio.emit("telemetry_message", {"success": True, "data": message_dict})
+def subscribe_to_all_telemetry() -> None:
+    """New clients get all telemetry until they choose their own subscriptions."""
+    for room in state.telemetry_subscriptions.add(
+        request.sid,  # type: ignore[attr-defined]
+        TelemetrySubscriptions.get_rooms(None, None),
+    ):
+        join_room(room)
+
+
+def remove_telemetry_subscriptions() -> None:
+    state.telemetry_subscriptions.remove(request.sid)  # type: ignore[attr-defined]
 
 
 def setup_telemetry_listeners() -> bool:
@@ -23,17 +84,214 @@ def setup_telemetry_listeners() -> bool:
         )
         return False
 
-    state.radio_link.add_message_listener("HEARTBEAT", send_message)
-    state.radio_link.add_message_listener("STATUSTEXT", send_message)
-    state.radio_link.add_message_listener("VFR_HUD", send_message)
-    state.radio_link.add_message_listener("GLOBAL_POSITION_INT", send_message)
-    state.radio_link.add_message_listener("ATTITUDE", send_message)
-    state.radio_link.add_message_listener("BATTERY_STATUS", send_message)
-    state.radio_link.add_message_listener("SYS_STATUS", send_message)
-    state.radio_link.add_message_listener("GPS_RAW_INT", send_message)
-    state.radio_link.add_message_listener("VIBRATION", send_message)
-    state.radio_link.add_message_listener("EKF_STATUS_REPORT", send_message)
+    for message_type in TELEMETRY_MESSAGES:
+        state.radio_link.add_message_listener(message_type, send_message)
 
     logger.info("Telemetry listeners have been set up successfully")
 
     return True
+
+
+@socketio.on("get_fleet_snapshot")
+def get_fleet_snapshot(
+    snapshot_settings: Optional[FleetSnapshotSettings] = None,
+) -> None:
+    """
+    Get the latest message of each telemetry type from every vehicle, or just
+    the given vehicles, to fill in the GUI after connecting or reloading.
+    """
+    if state.radio_link is None:
+        emit(
+            "get_fleet_snapshot_result",
+            {"success": False, "message": "Not connected to radio link"},
+        )
+        return
+
+    snapshot = state.radio_link.fleet_snapshot.get()
+
+    system_ids = (snapshot_settings or {}).get("system_ids")
+    if system_ids is not None:
+        wanted_system_ids = set(system_ids)
+        snapshot = {
+            "version": snapshot["version"],
+            "vehicles": [
+                vehicle
+                for vehicle in snapshot["vehicles"]
+                if vehicle["system_id"] in wanted_system_ids
+            ],
+        }
+
+    emit("get_fleet_snapshot_result", {"success": True, "data": snapshot})
+
+
+@socketio.on("get_telemetry_latency")
+def get_telemetry_latency(
+    latency_settings: Optional[TelemetryLatencySettings] = None,
+) -> None:
+    """
+    Get each vehicle's clock offset and TIMESYNC round trip, and percentiles of
+    how old its telemetry is on arrival (link) and when sent to clients
+    (pipeline), to tell lag from the radio apart from lag in the backend.
+    """
+    if state.radio_link is None:
+        emit(
+            "get_telemetry_latency_result",
+            {"success": False, "message": "Not connected to radio link"},
+        )
+        return
+
+    stats = state.radio_link.latency_monitor.get_stats(
+        (latency_settings or {}).get("system_ids")
+    )
+    for system_id, vehicle_stats in stats.items():
+        vehicle_stats["pipeline"] = state.pipeline_latency.get(system_id)
+
+    emit("get_telemetry_latency_result", {"success": True, "data": stats})
+
+
+@socketio.on("get_fleet_alerts")
+def get_fleet_alerts(alert_settings: Optional[FleetAlertSettings] = None) -> None:
+    """
+    Get the alerts that are currently raised, for a client that has just joined
+    and missed them being sent out.
+    """
+    if state.radio_link is None:
+        emit(
+            "get_fleet_alerts_result",
+            {"success": False, "message": "Not connected to radio link"},
+        )
+        return
+
+    alerts = state.radio_link.alert_engine.get_active_alerts(
+        (alert_settings or {}).get("system_ids")
+    )
+    emit("get_fleet_alerts_result", {"success": True, "data": {"alerts": alerts}})
+
+
+@socketio.on("get_fleet_endurance")
+def get_fleet_endurance() -> None:
+    """Get the latest estimate of how long each vehicle can keep flying."""
+    if state.radio_link is None:
+        emit(
+            "get_fleet_endurance_result",
+            {"success": False, "message": "Not connected to radio link"},
+        )
+        return
+
+    emit(
+        "get_fleet_endurance_result",
+        {"success": True, "data": state.radio_link.endurance_monitor.get_summary()},
+    )
+
+
+@socketio.on("get_stream_rates")
+def get_stream_rates() -> None:
+    if state.radio_link is None:
+        emit(
+            "get_stream_rates_result",
+            {"success": False, "message": "Not connected to radio link"},
+        )
+        return
+
+    emit(
+        "get_stream_rates_result",
+        {"success": True, "data": state.radio_link.stream_rate_manager.get_status()},
+    )
+
+
+@socketio.on("get_outbound_status")
+def get_outbound_status() -> None:
+    """Get how much has been sent and how long packets wait to be written."""
+    if state.radio_link is None:
+        emit(
+            "get_outbound_status_result",
+            {"success": False, "message": "Not connected to radio link"},
+        )
+        return
+
+    emit(
+        "get_outbound_status_result",
+        {"success": True, "data": state.radio_link.outbound.get_status()},
+    )
+
+
+def get_subscription_rooms(
+    subscription_settings: TelemetrySubscriptionSettings,
+) -> List[str]:
+    system_ids = subscription_settings.get("system_ids")
+    message_types = subscription_settings.get("message_types")
+    return TelemetrySubscriptions.get_rooms(
+        [int(system_id) for system_id in system_ids]
+        if system_ids is not None
+        else None,
+        [str(message_type).upper() for message_type in message_types]
+        if message_types is not None
+        else None,
+    )
+
+
+@socketio.on("subscribe_telemetry")
+def subscribe_telemetry(subscription_settings: TelemetrySubscriptionSettings) -> None:
+    """
+    Subscribe to telemetry from some vehicles and message types, leaving out
+    either means all of them. With replace set, every existing subscription
+    is dropped first.
+    """
+    try:
+        rooms = get_subscription_rooms(subscription_settings)
+    except (AttributeError, TypeError, ValueError):
+        emit(
+            "subscribe_telemetry_result",
+            {"success": False, "message": "Invalid telemetry subscription"},
+        )
+        return
+
+    client_id = request.sid  # type: ignore[attr-defined]
+    if subscription_settings.get("replace", False):
+        for room in state.telemetry_subscriptions.remove(client_id):
+            if room not in rooms:
+                leave_room(room)
+
+    for room in state.telemetry_subscriptions.add(client_id, rooms):
+        join_room(room)
+
+    emit(
+        "subscribe_telemetry_result",
+        {
+            "success": True,
+            "data": state.telemetry_subscriptions.get_client_rooms(client_id),
+        },
+    )
+
+
+@socketio.on("unsubscribe_telemetry")
+def unsubscribe_telemetry(subscription_settings: TelemetrySubscriptionSettings) -> None:
+    """
+    Leave the rooms a subscribe_telemetry call with the same settings joined,
+    or every telemetry room if no vehicles or message types are given.
+    """
+    client_id = request.sid  # type: ignore[attr-defined]
+    try:
+        rooms: Optional[List[str]] = None
+        if (
+            subscription_settings.get("system_ids") is not None
+            or subscription_settings.get("message_types") is not None
+        ):
+            rooms = get_subscription_rooms(subscription_settings)
+    except (AttributeError, TypeError, ValueError):
+        emit(
+            "unsubscribe_telemetry_result",
+            {"success": False, "message": "Invalid telemetry subscription"},
+        )
+        return
+
+    for room in state.telemetry_subscriptions.remove(client_id, rooms):
+        leave_room(room)
+
+    emit(
+        "unsubscribe_telemetry_result",
+        {
+            "success": True,
+            "data": state.telemetry_subscriptions.get_client_rooms(client_id),
+        },
+    )
@@ -0,0 +1,323 @@
+import logging
+import threading
+import time
+import warnings
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.blocking import run_blocking
+from app.proximity import EARTH_RADIUS
+
+if TYPE_CHECKING:
+    from app.radio_link import RadioLink
+    from app.vehicle import Vehicle
+
+# Samples kept per vehicle, SYS_STATUS and BATTERY_STATUS together arrive at a
+# few Hz so this covers the last minute or two
+WINDOW_SIZE = 256
+WINDOW_DURATION = 120.0
+MIN_SAMPLES = 5
+
+# Percentage left when the vehicle should be on the ground
+RESERVE_PERCENT = 20.0
+# Rough LiPo cell voltages at full and empty, for vehicles that don't report a
+# percentage. Voltage sags under load, so this is a lot less reliable.
+CELL_FULL_VOLTAGE = 4.2
+CELL_EMPTY_VOLTAGE = 3.5
+# SYS_STATUS reports UINT16_MAX mV for a voltage it doesn't know
+MAX_PACK_VOLTAGE = 65.0
+# ArduCopter's default WPNAV_SPEED and WPNAV_SPEED_DN, in m/s
+RETURN_SPEED = 10.0
+DESCENT_SPEED = 1.5
+
+
+def predict_endurance(
+    times: np.ndarray,
+    remaining: np.ndarray,
+    now: float,
+    reserve_percent: float,
+    window_duration: float,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Fit a line to the battery percentage of each vehicle over the window with
+    least squares, all vehicles at once. Rows are vehicles, missing and old
+    samples are NaN or outside the window and left out of the fit.
+
+    Returns the drain rate in %/s and the seconds until the reserve is reached,
+    which is inf for a battery that isn't draining and NaN without enough
+    samples.
+    """
+    valid = np.isfinite(times) & np.isfinite(remaining)
+    valid &= times > now - window_duration
+    counts = valid.sum(axis=1)
+
+    t = np.where(valid, times - now, 0.0)
+    y = np.where(valid, remaining, 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_t = t.sum(axis=1) / counts
+        mean_y = y.sum(axis=1) / counts
+        dt = np.where(valid, t - mean_t[:, None], 0.0)
+        dy = np.where(valid, y - mean_y[:, None], 0.0)
+        slope = (dt * dy).sum(axis=1) / (dt * dt).sum(axis=1)
+
+        # The fitted percentage now, rather than the last noisy sample
+        current = mean_y - slope * mean_t
+        drain_rate = 0.0 - slope
+        endurance = np.where(
+            drain_rate > 0,
+            np.maximum(current - reserve_percent, 0) / drain_rate,
+            np.inf,
+        )
+
+    enough = counts >= MIN_SAMPLES
+    drain_rate[~enough] = np.nan
+    endurance[~enough | ~np.isfinite(slope)] = np.nan
+    return drain_rate, endurance
+
+
+def estimate_remaining_from_voltage(
+    volts: np.ndarray, peak_volts: np.ndarray
+) -> np.ndarray:
+    """
+    Estimate battery percentages from pack voltages, rows being vehicles. The
+    cell count is guessed from the highest voltage seen from each vehicle,
+    which is near full when the battery was put in.
+    """
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cells = np.ceil(peak_volts / (CELL_FULL_VOLTAGE + 0.05))
+        cell_volts = volts / np.where(cells > 0, cells, np.nan)[:, None]
+        return np.clip(
+            (cell_volts - CELL_EMPTY_VOLTAGE)
+            / (CELL_FULL_VOLTAGE - CELL_EMPTY_VOLTAGE)
+            * 100,
+            0,
+            100,
+        )
+
+
+def get_return_times(
+    latitudes: np.ndarray,
+    longitudes: np.ndarray,
+    altitudes: np.ndarray,
+    home_latitudes: np.ndarray,
+    home_longitudes: np.ndarray,
+    return_speed: float,
+    descent_speed: float,
+) -> np.ndarray:
+    """Seconds to fly back to home and descend, NaN where home isn't known."""
+    north = EARTH_RADIUS * np.radians(latitudes - home_latitudes)
+    east = EARTH_RADIUS * np.radians(longitudes - home_longitudes)
+    east *= np.cos(np.radians(home_latitudes))
+    return np.hypot(north, east) / return_speed + np.maximum(altitudes, 0) / (
+        descent_speed
+    )
+
+
+def to_list(values: np.ndarray, decimals: int = 1) -> List[Optional[float]]:
+    """Round for sending to clients, with None for values that aren't finite."""
+    return [
+        round(float(value), decimals) if np.isfinite(value) else None
+        for value in values
+    ]
+
+
+class EnduranceMonitor:
+    """
+    Keeps a window of battery percentages, voltages and currents for every
+    vehicle in arrays and regularly estimates how long each can keep flying
+    and whether that's enough to get home. Vehicles that don't report a
+    percentage are estimated from their voltage instead, or listed without an
+    estimate if they don't report that either. Each tick sends a summary of
+    the fleet in columns, ordered by how much spare time each vehicle has, so
+    the vehicles that have to leave first come first.
+    """
+
+    def __init__(
+        self,
+        radio_link: "RadioLink",
+        endurance_callback: Optional[Callable] = None,
+        rate: float = 1.0,
+        reserve_percent: float = RESERVE_PERCENT,
+        return_speed: float = RETURN_SPEED,
+        descent_speed: float = DESCENT_SPEED,
+    ):
+        self.logger = logging.getLogger("endurance")
+
+        self.radio_link = radio_link
+        self.endurance_callback = endurance_callback
+        self.rate = rate
+        self.reserve_percent = reserve_percent
+        self.return_speed = return_speed
+        self.descent_speed = descent_speed
+
+        self.lock = threading.Lock()
+        self.rows: Dict[int, int] = {}
+        self.times = np.full((0, WINDOW_SIZE), np.nan)
+        self.remaining = np.full((0, WINDOW_SIZE), np.nan)
+        self.volts = np.full((0, WINDOW_SIZE), np.nan)
+        self.current = np.full((0, WINDOW_SIZE), np.nan)
+        self.peak_volts = np.full(0, np.nan)
+        self.next_index = np.zeros(0, dtype=np.int64)
+
+        self.summary: Optional[dict] = None
+
+    def _add_row(self, system_id: int) -> int:
+        row = len(self.rows)
+        if row == len(self.times):
+            # Grow by doubling so vehicles joining one at a time stay cheap
+            extra = max(row, 8)
+            self.times = np.vstack((self.times, np.full((extra, WINDOW_SIZE), np.nan)))
+            self.remaining = np.vstack(
+                (self.remaining, np.full((extra, WINDOW_SIZE), np.nan))
+            )
+            self.volts = np.vstack((self.volts, np.full((extra, WINDOW_SIZE), np.nan)))
+            self.current = np.vstack(
+                (self.current, np.full((extra, WINDOW_SIZE), np.nan))
+            )
+            self.peak_volts = np.concatenate((self.peak_volts, np.full(extra, np.nan)))
+            self.next_index = np.concatenate(
+                (self.next_index, np.zeros(extra, dtype=np.int64))
+            )
+        self.rows[system_id] = row
+        return row
+
+    def record(self, vehicle: "Vehicle") -> None:
+        """
+        Add a vehicle's battery state after a battery message. Whatever the
+        vehicle doesn't measure is stored as NaN.
+        """
+        volts = (
+            vehicle.batt_volts if 0 < vehicle.batt_volts < MAX_PACK_VOLTAGE else np.nan
+        )
+        with self.lock:
+            row = self.rows.get(vehicle.system_id)
+            if row is None:
+                row = self._add_row(vehicle.system_id)
+            index = self.next_index[row]
+            self.times[row, index] = time.time()
+            self.remaining[row, index] = (
+                vehicle.battery_remaining
+                if vehicle.battery_remaining is not None
+                else np.nan
+            )
+            self.volts[row, index] = volts
+            self.current[row, index] = (
+                vehicle.batt_curr if np.isfinite(volts) else np.nan
+            )
+            self.peak_volts[row] = np.fmax(self.peak_volts[row], volts)
+            self.next_index[row] = (index + 1) % WINDOW_SIZE
+
+    def check(self) -> Optional[dict]:
+        """Estimate the endurance of the fleet, get the summary to send out."""
+        with self.lock:
+            system_ids = list(self.rows)
+            count = len(system_ids)
+            times = self.times[:count].copy()
+            remaining = self.remaining[:count].copy()
+            volts = self.volts[:count].copy()
+            current = self.current[:count].copy()
+            peak_volts = self.peak_volts[:count].copy()
+        if not count:
+            return None
+
+        # Fall back to the voltage for vehicles without a percentage
+        has_percentage = np.isfinite(remaining).any(axis=1)
+        has_volts = np.isfinite(volts).any(axis=1)
+        remaining = np.where(
+            has_percentage[:, None],
+            remaining,
+            estimate_remaining_from_voltage(volts, peak_volts),
+        )
+
+        vehicles = [self.radio_link.vehicles[system_id] for system_id in system_ids]
+        state = np.array(
+            [
+                (
+                    vehicle.latitude,
+                    vehicle.longitude,
+                    vehicle.relative_altitude,
+                    vehicle.home_latitude
+                    if vehicle.home_latitude is not None
+                    else np.nan,
+                    vehicle.home_longitude
+                    if vehicle.home_longitude is not None
+                    else np.nan,
+                    vehicle.batt_volts,
+                    vehicle.batt_curr,
+                )
+                for vehicle in vehicles
+            ],
+            dtype=np.float64,
+        )
+
+        drain_rate, endurance = run_blocking(
+            predict_endurance,
+            times,
+            remaining,
+            time.time(),
+            self.reserve_percent,
+            WINDOW_DURATION,
+        )
+        return_times = get_return_times(
+            state[:, 0],
+            state[:, 1],
+            state[:, 2],
+            state[:, 3],
+            state[:, 4],
+            self.return_speed,
+            self.descent_speed,
+        )
+        with np.errstate(invalid="ignore"):
+            margins = endurance - return_times
+
+        # Least spare time first, vehicles that can't be estimated last
+        order = np.lexsort((margins, np.isnan(margins)))
+        latest_remaining = [vehicles[i].battery_remaining for i in order]
+        with np.errstate(invalid="ignore"), warnings.catch_warnings():
+            # Vehicles that don't measure current have nothing to average
+            warnings.simplefilter("ignore", RuntimeWarning)
+            average_current = np.nanmean(current, axis=1)
+        return {
+            "time": time.time(),
+            "system_ids": [system_ids[i] for i in order],
+            "remaining": latest_remaining,
+            "volts": to_list(state[order, 5], 2),
+            "current": to_list(state[order, 6], 1),
+            "average_current": to_list(average_current[order], 1),
+            # What the estimate is based on, None when it can't be estimated
+            "estimated_from": [
+                "percentage"
+                if has_percentage[i]
+                else "voltage"
+                if has_volts[i]
+                else None
+                for i in order
+            ],
+            # %/min
+            "drain_rate": to_list(drain_rate[order] * 60, 2),
+            "endurance": to_list(endurance[order], 0),
+            "return_time": to_list(return_times[order], 0),
+            "margin": to_list(margins[order], 0),
+            "can_return": [
+                bool(margin >= 0) if not np.isnan(margin) else None
+                for margin in margins[order]
+            ],
+        }
+
+    def get_summary(self) -> Optional[dict]:
+        """Get the summary from the last tick, None before the first one."""
+        return self.summary
+
+    def run(self) -> None:
+        interval = 1 / self.rate
+        while self.radio_link.is_active.is_set():
+            start_time = time.time()
+            try:
+                self.summary = self.check()
+                if self.summary is not None and self.endurance_callback:
+                    self.endurance_callback(self.summary)
+            except Exception:
+                self.logger.exception("Failed to estimate fleet endurance")
+
+            time.sleep(max(interval - (time.time() - start_time), 0))
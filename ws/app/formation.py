@@ -0,0 +1,202 @@
+import math
+from enum import Enum
+from typing import Optional, Sequence
+
+import numpy as np
+
+from app.proximity import EARTH_RADIUS, project_to_enu
+
+
+class FormationShape(Enum):
+    LINE = "line"
+    GRID = "grid"
+    CIRCLE = "circle"
+    CUSTOM = "custom"
+
+
+def get_formation_offsets(
+    shape: FormationShape,
+    count: int,
+    spacing: float,
+    custom_offsets: Optional[Sequence[Sequence[float]]] = None,
+) -> np.ndarray:
+    """
+    Get the slot offsets of a formation as an (n, 3) array of forward, right
+    and up offsets in metres from the anchor point, before rotating to the
+    formation heading.
+    """
+    if shape == FormationShape.CUSTOM:
+        if not custom_offsets:
+            raise ValueError("No offsets given for custom formation")
+        offsets = np.zeros((len(custom_offsets), 3))
+        for i, offset in enumerate(custom_offsets):
+            try:
+                values = np.asarray(offset, dtype=np.float64)
+            except (TypeError, ValueError):
+                raise ValueError(f"Offset {i} should be a list of numbers")
+            if values.ndim != 1 or not 1 <= len(values) <= 3:
+                raise ValueError(
+                    f"Offset {i} should have forward, right and optionally up"
+                )
+            if not np.isfinite(values).all():
+                raise ValueError(f"Offset {i} isn't finite")
+            offsets[i, : len(values)] = values
+        return offsets
+
+    if count < 1:
+        raise ValueError("A formation needs at least one vehicle")
+
+    slots = np.arange(count, dtype=np.float64)
+    offsets = np.zeros((count, 3))
+
+    if shape == FormationShape.LINE:
+        # Centre the line on the anchor, perpendicular to the heading
+        offsets[:, 1] = (slots - (count - 1) / 2) * spacing
+    elif shape == FormationShape.GRID:
+        columns = math.ceil(math.sqrt(count))
+        rows = math.ceil(count / columns)
+        offsets[:, 0] = -(slots // columns - (rows - 1) / 2) * spacing
+        offsets[:, 1] = (slots % columns - (columns - 1) / 2) * spacing
+    elif shape == FormationShape.CIRCLE:
+        # Pick the radius so neighbouring slots are the spacing apart
+        radius = spacing / (2 * math.sin(math.pi / count)) if count > 1 else 0.0
+        angles = 2 * np.pi * slots / count
+        offsets[:, 0] = radius * np.cos(angles)
+        offsets[:, 1] = radius * np.sin(angles)
+
+    return offsets
+
+
+def offset_positions(
+    latitude: float,
+    longitude: float,
+    heading: float,
+    offsets: np.ndarray,
+) -> np.ndarray:
+    """
+    Rotate body frame offsets to the heading (degrees from north) and move the
+    anchor point by each of them along a great circle. Returns an (n, 2) array
+    of latitudes and longitudes in degrees.
+    """
+    heading_rad = math.radians(heading)
+    north = offsets[:, 0] * math.cos(heading_rad) - offsets[:, 1] * math.sin(
+        heading_rad
+    )
+    east = offsets[:, 0] * math.sin(heading_rad) + offsets[:, 1] * math.cos(heading_rad)
+
+    bearings = np.arctan2(east, north)
+    angular_distances = np.hypot(north, east) / EARTH_RADIUS
+
+    lat1 = math.radians(latitude)
+    lon1 = math.radians(longitude)
+    lat2 = np.arcsin(
+        math.sin(lat1) * np.cos(angular_distances)
+        + math.cos(lat1) * np.sin(angular_distances) * np.cos(bearings)
+    )
+    lon2 = lon1 + np.arctan2(
+        np.sin(bearings) * np.sin(angular_distances) * math.cos(lat1),
+        np.cos(angular_distances) - math.sin(lat1) * np.sin(lat2),
+    )
+
+    return np.column_stack((np.degrees(lat2), np.degrees(lon2)))
+
+
+def solve_assignment(cost: np.ndarray) -> np.ndarray:
+    """
+    Solve the linear assignment problem for an (n, m) cost matrix with n <= m
+    using the Hungarian algorithm with potentials, O(n^2 m). The inner column
+    scans are vectorised. Returns the column assigned to each row.
+    """
+    n, m = cost.shape
+    if n > m:
+        raise ValueError("Cannot assign more rows than columns")
+
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    # p[j] is the (1-based) row assigned to column j, column 0 is a sentinel
+    p = np.zeros(m + 1, dtype=np.int64)
+    way = np.zeros(m + 1, dtype=np.int64)
+
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            free = ~used[1:]
+
+            reduced = cost[i0 - 1] - u[i0] - v[1:]
+            improved = free & (reduced < minv[1:])
+            minv[1:][improved] = reduced[improved]
+            way[1:][improved] = j0
+
+            candidates = np.where(free, minv[1:], np.inf)
+            j1 = int(np.argmin(candidates)) + 1
+            delta = candidates[j1 - 1]
+
+            used_columns = np.flatnonzero(used)
+            u[p[used_columns]] += delta
+            v[used_columns] -= delta
+            minv[1:][free] -= delta
+
+            j0 = j1
+            if p[j0] == 0:
+                break
+
+        # Flip the augmenting path
+        while j0 != 0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+    assignment = np.zeros(n, dtype=np.int64)
+    for j in range(1, m + 1):
+        if p[j] != 0:
+            assignment[p[j] - 1] = j - 1
+    return assignment
+
+
+def plan_formation(
+    current_positions: np.ndarray,
+    latitude: float,
+    longitude: float,
+    altitude: float,
+    heading: float,
+    offsets: np.ndarray,
+) -> np.ndarray:
+    """
+    Work out the target of each vehicle in a formation.
+
+    Current positions are an (n, 2) array of latitudes and longitudes, one row
+    per vehicle. Vehicles are assigned to slots so the total distance travelled
+    is as small as possible. Returns an (n, 3) array of target latitude,
+    longitude and relative altitude for each vehicle.
+    """
+    if len(offsets) < len(current_positions):
+        raise ValueError(
+            f"Formation has {len(offsets)} slots but {len(current_positions)} vehicles"
+        )
+
+    slot_positions = offset_positions(latitude, longitude, heading, offsets)
+
+    vehicle_enu = project_to_enu(
+        current_positions[:, 0],
+        current_positions[:, 1],
+        np.zeros(len(current_positions)),
+        latitude,
+        longitude,
+    )
+    slot_enu = project_to_enu(
+        slot_positions[:, 0],
+        slot_positions[:, 1],
+        np.zeros(len(slot_positions)),
+        latitude,
+        longitude,
+    )
+    cost = np.linalg.norm(vehicle_enu[:, None, :2] - slot_enu[None, :, :2], axis=2)
+
+    slots = solve_assignment(cost)
+    return np.column_stack((slot_positions[slots], altitude + offsets[slots, 2]))
@@ -0,0 +1,321 @@
+import logging
+import socket
+import threading
+import time
+from queue import Empty, Full, Queue
+from typing import TYPE_CHECKING, Dict, FrozenSet, List, Optional, Tuple, Union
+
+from pymavlink import mavutil
+from typing_extensions import NotRequired, TypedDict
+
+from app.types import Response
+
+if TYPE_CHECKING:
+    from app.radio_link import RadioLink
+
+FORWARD_OUTPUT_TYPES = ["udpout", "udpin", "tcpout"]
+RECONNECT_INTERVAL = 2.0
+# Messages waiting to be written to a TCP output, if a GCS stops reading
+# anything more is dropped rather than holding up the radio link
+TCP_QUEUE_SIZE = 4096
+MAX_DATAGRAM_SIZE = 65535
+# Untargeted messages an output limited to some vehicles may still send, none
+# of them command a vehicle
+UNTARGETED_ALLOWED = frozenset(["HEARTBEAT"])
+
+
+class ForwardOutputSettings(TypedDict):
+    address: str
+    system_ids: NotRequired[Optional[List[int]]]
+
+
+def parse_output_address(address: str) -> Tuple[str, str, int]:
+    """
+    Split an output address like udpout:127.0.0.1:14550 into its type, host
+    and port.
+    """
+    parts = address.split(":")
+    if len(parts) != 3 or parts[0] not in FORWARD_OUTPUT_TYPES:
+        raise ValueError(
+            f"Output address {address} should be one of "
+            f"{', '.join(FORWARD_OUTPUT_TYPES)} followed by :host:port"
+        )
+    try:
+        return parts[0], parts[1], int(parts[2])
+    except ValueError:
+        raise ValueError(f"Invalid port in output address {address}")
+
+
+class ForwardOutput:
+    """
+    A secondary GCS the raw telemetry is forwarded to, and whose messages are
+    sent on to the vehicles:
+    - udpout sends to the address, replies come back to the same socket
+    - udpin listens on the address and sends to whoever last sent to it
+    - tcpout connects to the address, reconnecting if the connection drops
+
+    With system_ids set, only telemetry from those vehicles is forwarded, and
+    only messages targeting them are sent on. Broadcasts to every vehicle and
+    messages without a target (other than heartbeats) are dropped then, they
+    would reach vehicles the GCS isn't allowed to command.
+    """
+
+    def __init__(
+        self,
+        forwarder: "MavlinkForwarder",
+        address: str,
+        system_ids: Optional[List[int]] = None,
+    ):
+        self.logger = logging.getLogger("forwarding")
+
+        self.forwarder = forwarder
+        self.address = address
+        self.type, self.host, self.port = parse_output_address(address)
+        self.system_ids: Optional[FrozenSet[int]] = (
+            frozenset(system_ids) if system_ids is not None else None
+        )
+
+        # Only used to split what the GCS sends into messages for filtering,
+        # the bytes sent on are the ones it sent
+        self.parser = mavutil.mavlink.MAVLink(None)
+        self.parser.robust_parsing = True
+
+        self.is_open = threading.Event()
+        self.is_open.set()
+        self.sock: Optional[socket.socket] = None
+        self.peer: Optional[Tuple[str, int]] = None
+        self.write_queue: Queue = Queue(maxsize=TCP_QUEUE_SIZE)
+
+        self.packets_out: int = 0
+        self.bytes_out: int = 0
+        self.packets_in: int = 0
+        self.filtered_in: int = 0
+        self.dropped_out: int = 0
+
+        if self.type != "tcpout":
+            # UDP sockets are opened straight away so a bad address fails now
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.settimeout(1)
+            if self.type == "udpin":
+                self.sock.bind((self.host, self.port))
+            else:
+                self.sock.bind(("", 0))
+                self.peer = (self.host, self.port)
+
+        self.threads = [threading.Thread(target=self.receive, daemon=True)]
+        if self.type == "tcpout":
+            self.threads.append(threading.Thread(target=self.write, daemon=True))
+        for thread in self.threads:
+            thread.start()
+
+    def send(self, buffer: Union[bytes, bytearray]) -> None:
+        """Forward a message's raw bytes, called on the radio link's reader thread."""
+        if self.type == "tcpout":
+            try:
+                self.write_queue.put_nowait(buffer)
+            except Full:
+                self.dropped_out += 1
+            return
+
+        if self.sock is None or self.peer is None:
+            return
+        try:
+            self.sock.sendto(buffer, self.peer)
+        except OSError:
+            # Nothing listening yet or the socket buffer is full
+            self.dropped_out += 1
+            return
+        self.packets_out += 1
+        self.bytes_out += len(buffer)
+
+    def _connect(self) -> bool:
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout=1)
+        except OSError:
+            return False
+        sock.settimeout(1)
+        self.sock = sock
+        self.logger.info(f"Connected to forwarding output {self.address}")
+        return True
+
+    def _disconnect(self) -> None:
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+
+    def _handle_incoming(self, data: bytes) -> None:
+        try:
+            messages = self.parser.parse_buffer(data) or []
+        except mavutil.mavlink.MAVError:
+            return
+
+        outbound = self.forwarder.radio_link.outbound
+        for msg in messages:
+            if msg.get_type() == "BAD_DATA":
+                continue
+            self.packets_in += 1
+            if self.system_ids is not None and not self._is_allowed(
+                msg, self.system_ids
+            ):
+                self.filtered_in += 1
+                continue
+            outbound.write(bytes(msg.get_msgbuf()))
+
+    @staticmethod
+    def _is_allowed(
+        msg: mavutil.mavlink.MAVLink_message, system_ids: FrozenSet[int]
+    ) -> bool:
+        """Check a message from a GCS limited to system_ids only targets those."""
+        # MANUAL_CONTROL is the one message that calls its target field target
+        target_system = getattr(msg, "target_system", getattr(msg, "target", None))
+        if target_system is None:
+            return msg.get_type() in UNTARGETED_ALLOWED
+        return target_system in system_ids
+
+    def receive(self) -> None:
+        while self.is_open.is_set() and self.forwarder.radio_link.is_active.is_set():
+            if self.sock is None:
+                if not self._connect():
+                    time.sleep(RECONNECT_INTERVAL)
+                continue
+
+            try:
+                if self.type == "tcpout":
+                    data = self.sock.recv(MAX_DATAGRAM_SIZE)
+                    if not data:
+                        raise ConnectionResetError("Connection closed")
+                else:
+                    data, sender = self.sock.recvfrom(MAX_DATAGRAM_SIZE)
+                    if self.type == "udpin":
+                        self.peer = sender
+            except socket.timeout:
+                continue
+            except OSError as e:
+                if not self.is_open.is_set():
+                    break
+                if self.type == "tcpout":
+                    self.logger.warning(
+                        f"Lost connection to forwarding output {self.address}: {e}"
+                    )
+                    self._disconnect()
+                continue
+            self._handle_incoming(data)
+
+    def write(self) -> None:
+        """Write queued messages to a TCP output, in one go where possible."""
+        while self.is_open.is_set() and self.forwarder.radio_link.is_active.is_set():
+            try:
+                buffers = [self.write_queue.get(timeout=1)]
+            except Empty:
+                continue
+            while True:
+                try:
+                    buffers.append(self.write_queue.get_nowait())
+                except Empty:
+                    break
+
+            sock = self.sock
+            if sock is None:
+                self.dropped_out += len(buffers)
+                continue
+            data = b"".join(buffers)
+            try:
+                sock.sendall(data)
+            except OSError:
+                # The receive thread notices and reconnects
+                self.dropped_out += len(buffers)
+                continue
+            self.packets_out += len(buffers)
+            self.bytes_out += len(data)
+
+    def close(self) -> None:
+        self.is_open.clear()
+        for thread in self.threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout=3)
+        self._disconnect()
+
+    def get_status(self) -> dict:
+        return {
+            "address": self.address,
+            "system_ids": sorted(self.system_ids)
+            if self.system_ids is not None
+            else None,
+            "connected": self.sock is not None
+            and (self.type == "tcpout" or self.peer is not None),
+            "packets_out": self.packets_out,
+            "bytes_out": self.bytes_out,
+            "dropped_out": self.dropped_out,
+            "packets_in": self.packets_in,
+            "filtered_in": self.filtered_in,
+        }
+
+
+class MavlinkForwarder:
+    """
+    Forwards every message received on the radio link to other ground
+    stations, as the raw bytes it arrived as so nothing is decoded or packed
+    again, and sends what they send back out through the outbound writer.
+    This does the job of running mavproxy in front of the radio link just to
+    share the stream, without the extra hop.
+    """
+
+    def __init__(self, radio_link: "RadioLink"):
+        self.logger = logging.getLogger("forwarding")
+
+        self.radio_link = radio_link
+        self.lock = threading.Lock()
+        # Replaced rather than changed, so forward() can loop over it without
+        # taking the lock
+        self.outputs: Tuple[ForwardOutput, ...] = ()
+
+    def forward(self, system_id: int, buffer: Union[bytes, bytearray]) -> None:
+        for output in self.outputs:
+            if output.system_ids is None or system_id in output.system_ids:
+                output.send(buffer)
+
+    def add_output(
+        self, address: str, system_ids: Optional[List[int]] = None
+    ) -> Response:
+        with self.lock:
+            if any(output.address == address for output in self.outputs):
+                return {
+                    "success": False,
+                    "message": f"Already forwarding to {address}",
+                }
+            try:
+                output = ForwardOutput(self, address, system_ids)
+            except (ValueError, OSError) as e:
+                return {
+                    "success": False,
+                    "message": f"Could not forward to {address}: {e}",
+                }
+            self.outputs = self.outputs + (output,)
+
+        self.logger.info(f"Forwarding to {address}")
+        return {"success": True, "message": f"Forwarding to {address}"}
+
+    def remove_output(self, address: str) -> Response:
+        with self.lock:
+            removed = [output for output in self.outputs if output.address == address]
+            self.outputs = tuple(
+                output for output in self.outputs if output.address != address
+            )
+        if not removed:
+            return {"success": False, "message": f"Not forwarding to {address}"}
+
+        for output in removed:
+            output.close()
+        return {"success": True, "message": f"Stopped forwarding to {address}"}
+
+    def close(self) -> None:
+        with self.lock:
+            outputs, self.outputs = self.outputs, ()
+        for output in outputs:
+            output.close()
+
+    def get_status(self) -> List[Dict]:
+        return [output.get_status() for output in self.outputs]
@@ -0,0 +1,123 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.archive import SYSTEM_ID_COLUMN, TIMESTAMP_COLUMN, ArchivedSession
+from app.downsample import lttb, min_max_buckets
+
+DOWNSAMPLE_METHODS = ["lttb", "minmax"]
+MAX_WIDTH = 10000
+
+# Array fields are picked out with an index, like voltages[0]
+FIELD_PATTERN = re.compile(r"^(\w+)(?:\[(\d+)\])?$")
+
+
+def parse_field(field: str) -> Tuple[str, Optional[int]]:
+    match = FIELD_PATTERN.match(field)
+    if match is None:
+        raise ValueError(f"Invalid field {field}")
+    return match.group(1), int(match.group(2)) if match.group(2) else None
+
+
+def downsample(
+    timestamps: np.ndarray, values: np.ndarray, width: int, method: str
+) -> np.ndarray:
+    """Get the indices of the points to keep to draw a line width pixels wide."""
+    if method == "minmax":
+        return min_max_buckets(values, width)
+    return lttb(timestamps, values, width)
+
+
+def query_history(
+    session: ArchivedSession,
+    message_type: str,
+    field: str,
+    system_ids: Optional[List[int]] = None,
+    start_time: Optional[float] = None,
+    end_time: Optional[float] = None,
+    width: int = 1000,
+    method: str = "lttb",
+) -> dict:
+    """
+    Get a field's time series for each vehicle from an archived session,
+    downsampled to at most width points per vehicle. Timestamps are returned
+    as seconds from start_time to keep the response small.
+    """
+    if method not in DOWNSAMPLE_METHODS:
+        raise ValueError(f"Unknown downsampling method {method}")
+    if message_type not in session.tables:
+        raise ValueError(f"No {message_type} messages in session {session.session_id}")
+    width = max(3, min(width, MAX_WIDTH))
+
+    column_name, index = parse_field(field)
+    column = session.get_column_info(message_type, column_name)
+    if column.dtype.kind == "S":
+        raise ValueError(f"{field} is not a numeric field")
+    if column.length and (index is None or index >= column.length):
+        raise ValueError(f"{field} needs an index below {column.length}")
+
+    # Work a chunk at a time so only the rows in the time range and for the
+    # wanted vehicles are read, rather than copying whole columns into memory
+    vehicle_chunks: Dict[int, List[Tuple[np.ndarray, np.ndarray]]] = {}
+    if system_ids is not None:
+        vehicle_chunks = {int(system_id): [] for system_id in system_ids}
+    first_timestamp: Optional[float] = None
+    for timestamps, sources, values in session.iter_chunks(
+        message_type, [TIMESTAMP_COLUMN, SYSTEM_ID_COLUMN, column_name]
+    ):
+        # Rows are in arrival order, so the time range is a slice
+        first = (
+            0 if start_time is None else int(np.searchsorted(timestamps, start_time))
+        )
+        last = (
+            len(timestamps)
+            if end_time is None
+            else int(np.searchsorted(timestamps, end_time, side="right"))
+        )
+        if first >= last:
+            continue
+        timestamps = timestamps[first:last]
+        sources = sources[first:last]
+        values = values[first:last] if index is None else values[first:last, index]
+        if first_timestamp is None:
+            first_timestamp = float(timestamps[0])
+
+        chunk_system_ids = (
+            vehicle_chunks.keys() if system_ids is not None else np.unique(sources)
+        )
+        for system_id in list(chunk_system_ids):
+            mask = sources == system_id
+            if mask.any():
+                vehicle_chunks.setdefault(int(system_id), []).append(
+                    (timestamps[mask], values[mask].astype(np.float64))
+                )
+
+    if start_time is None:
+        start_time = (
+            first_timestamp if first_timestamp is not None else session.start_time
+        )
+
+    vehicles: Dict[int, dict] = {}
+    for system_id, chunks in vehicle_chunks.items():
+        vehicle_timestamps = np.concatenate(
+            [np.empty(0, np.float64)] + [chunk[0] for chunk in chunks]
+        )
+        vehicle_values = np.concatenate(
+            [np.empty(0, np.float64)] + [chunk[1] for chunk in chunks]
+        )
+
+        selected = downsample(vehicle_timestamps, vehicle_values, width, method)
+        vehicles[system_id] = {
+            "t": np.round(vehicle_timestamps[selected] - start_time, 3).tolist(),
+            "v": np.round(vehicle_values[selected], 6).tolist(),
+            "count": int(len(vehicle_values)),
+        }
+
+    return {
+        "session_id": session.session_id,
+        "message_type": message_type,
+        "field": field,
+        "start_time": start_time,
+        "vehicles": vehicles,
+    }
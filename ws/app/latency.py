@@ -0,0 +1,150 @@
+import logging
+import time
+from collections import deque
+from typing import TYPE_CHECKING, Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+from pymavlink.mavutil import mavlink
+
+if TYPE_CHECKING:
+    from app.radio_link import RadioLink
+
+# The offset is taken from the exchange with the shortest round trip out of
+# the last few, it has the least queueing delay to make the estimate wrong
+CLOCK_SYNC_WINDOW = 16
+LATENCY_SAMPLES = 1000
+
+
+def get_percentiles(samples: Deque[float]) -> Optional[Dict[str, float]]:
+    """Get the p50, p95 and p99 of latency samples in seconds, in milliseconds."""
+    if not samples:
+        return None
+    p50, p95, p99 = np.percentile(np.array(list(samples)) * 1000, [50, 95, 99])
+    return {
+        "p50": round(float(p50), 1),
+        "p95": round(float(p95), 1),
+        "p99": round(float(p99), 1),
+    }
+
+
+class ClockSync:
+    """
+    Estimates the offset between a vehicle's clock and ours from TIMESYNC
+    exchanges. The vehicle stamps our request with its own time, so assuming
+    the request and reply take as long as each other, its clock read tc1 half
+    way through the round trip.
+    """
+
+    def __init__(self, window: int = CLOCK_SYNC_WINDOW):
+        # (round trip, offset) in nanoseconds
+        self.exchanges: Deque[Tuple[int, int]] = deque(maxlen=window)
+        self.offset_ns: Optional[int] = None
+        self.round_trip_ns: Optional[int] = None
+
+    def add_exchange(self, sent_ns: int, vehicle_ns: int, received_ns: int) -> None:
+        round_trip_ns = received_ns - sent_ns
+        if round_trip_ns < 0:
+            return
+        self.exchanges.append(
+            (round_trip_ns, vehicle_ns - (sent_ns + received_ns) // 2)
+        )
+        self.round_trip_ns, self.offset_ns = min(self.exchanges)
+
+    def to_local_time(self, vehicle_ns: int) -> Optional[float]:
+        """Convert a time on the vehicle's clock to our time.time()."""
+        if self.offset_ns is None:
+            return None
+        return (vehicle_ns - self.offset_ns) / 1e9
+
+
+class LatencyStats:
+    """The latest latency samples of each vehicle."""
+
+    def __init__(self, max_samples: int = LATENCY_SAMPLES):
+        self.max_samples = max_samples
+        self.samples: Dict[int, Deque[float]] = {}
+
+    def add(self, system_id: int, latency: float) -> None:
+        samples = self.samples.get(system_id)
+        if samples is None:
+            samples = self.samples[system_id] = deque(maxlen=self.max_samples)
+        samples.append(latency)
+
+    def get(self, system_id: int) -> Optional[Dict[str, float]]:
+        return get_percentiles(self.samples.get(system_id, deque()))
+
+
+class LatencyMonitor:
+    """
+    Measures how old telemetry is when it arrives. TIMESYNC requests are
+    broadcast every interval to keep an estimate of each vehicle's clock
+    offset, which turns the time_boot_ms of a message into the time it was
+    sent on our clock.
+    """
+
+    def __init__(self, radio_link: "RadioLink", interval: float = 1.0):
+        self.logger = logging.getLogger("latency_monitor")
+
+        self.radio_link = radio_link
+        self.interval = interval
+
+        self.clocks: Dict[int, ClockSync] = {}
+        self.link_latency = LatencyStats()
+        # Replies to another ground station's requests are ignored
+        self.sent_timestamps: Deque[int] = deque(maxlen=CLOCK_SYNC_WINDOW)
+
+    def run(self) -> None:
+        while self.radio_link.is_active.is_set():
+            if self.radio_link.master is not None:
+                sent_ns = time.time_ns()
+                self.sent_timestamps.append(sent_ns)
+                try:
+                    self.radio_link.master.mav.timesync_send(0, sent_ns)
+                except Exception:
+                    self.logger.error("Could not send TIMESYNC", exc_info=True)
+            time.sleep(self.interval)
+
+    def handle_timesync(
+        self, system_id: int, timesync: mavlink.MAVLink_timesync_message
+    ) -> None:
+        """Handle a vehicle's reply to one of our TIMESYNC requests."""
+        if timesync.ts1 not in self.sent_timestamps:
+            return
+        clock = self.clocks.get(system_id)
+        if clock is None:
+            clock = self.clocks[system_id] = ClockSync()
+        clock.add_exchange(timesync.ts1, timesync.tc1, int(timesync._timestamp * 1e9))
+
+    def record_message(
+        self, system_id: int, message: mavlink.MAVLink_message
+    ) -> Optional[float]:
+        """
+        Get how long a message took to arrive from when the vehicle stamped
+        it, if it has a time_boot_ms and the vehicle's clock is known.
+        """
+        time_boot_ms = getattr(message, "time_boot_ms", None)
+        clock = self.clocks.get(system_id)
+        if time_boot_ms is None or clock is None:
+            return None
+
+        sent_time = clock.to_local_time(time_boot_ms * 1_000_000)
+        if sent_time is None:
+            return None
+        latency = message._timestamp - sent_time
+        self.link_latency.add(system_id, latency)
+        return latency
+
+    def get_stats(self, system_ids: Optional[List[int]] = None) -> Dict[int, dict]:
+        stats = {}
+        for system_id in system_ids or list(self.radio_link.vehicles.keys()):
+            clock = self.clocks.get(system_id)
+            stats[system_id] = {
+                "clock_offset_ms": clock.offset_ns / 1e6
+                if clock is not None and clock.offset_ns is not None
+                else None,
+                "round_trip_ms": clock.round_trip_ns / 1e6
+                if clock is not None and clock.round_trip_ns is not None
+                else None,
+                "link": self.link_latency.get(system_id),
+            }
+        return stats
@@ -0,0 +1,526 @@
+import json
+import logging
+import math
+import multiprocessing
+import queue
+import threading
+import time
+from multiprocessing.connection import Connection
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from pymavlink.mavutil import mavlink
+
+from app.alerts import AlertEngine
+from app.archive import DEFAULT_ARCHIVE_DIR
+from app.blocking import wait_for_read
+from app.endurance import EnduranceMonitor
+from app.forwarding import ForwardOutputSettings, MavlinkForwarder
+from app.latency import LatencyMonitor
+from app.logs import setup_logging
+from app.outbound import OutboundWriter
+from app.radio_link import RadioLink
+from app.setpoints import SetpointStreamer
+from app.shared_ring import SharedRing
+from app.snapshot import TELEMETRY_MESSAGES, FleetSnapshot
+from app.spatial_index import SpatialIndex
+from app.stream_rates import StreamRateManager
+
+RING_SLOT_COUNT = 8192
+RING_SLOT_SIZE = 1024
+
+# Parts of the radio link whose methods can be called from the web server
+REMOTE_COMPONENTS: Dict[str, type] = {
+    "alert_engine": AlertEngine,
+    "endurance_monitor": EnduranceMonitor,
+    "fleet_snapshot": FleetSnapshot,
+    "forwarder": MavlinkForwarder,
+    "latency_monitor": LatencyMonitor,
+    "outbound": OutboundWriter,
+    "setpoint_streamer": SetpointStreamer,
+    "spatial_index": SpatialIndex,
+    "stream_rate_manager": StreamRateManager,
+}
+
+
+class RemoteCallError(RuntimeError):
+    """A call to the radio link in the link process failed."""
+
+
+class CallbackArgument:
+    """Stands in for a callback argument of a call made in the link process."""
+
+    def __init__(self, index: int):
+        self.index = index
+
+
+class ArchiveInfo:
+    def __init__(self, session_id: str, archive_dir: str):
+        self.session_id = session_id
+        self.archive_dir = archive_dir
+
+
+class SharedMessage:
+    """
+    A telemetry message read from the shared ring. Looks enough like a
+    pymavlink message for the telemetry listeners, the JSON is only decoded if
+    a listener asks for the fields.
+    """
+
+    def __init__(
+        self,
+        system_id: int,
+        message_type: str,
+        payload: bytes,
+        received_time: float,
+        link_latency: Optional[float],
+    ):
+        self.system_id = system_id
+        self.message_type = message_type
+        self.payload = payload
+        # Named like the attributes the radio link sets on pymavlink messages
+        self._timestamp = received_time
+        self._link_latency = link_latency
+
+    def get_srcSystem(self) -> int:
+        return self.system_id
+
+    def get_type(self) -> str:
+        return self.message_type
+
+    def to_dict(self) -> dict:
+        return json.loads(self.payload)
+
+
+class RemoteAttribute:
+    """A method of the radio link in the link process, call it to use it."""
+
+    def __init__(self, radio_link_process: "RadioLinkProcess", path: Tuple[str, ...]):
+        self.radio_link_process = radio_link_process
+        self.path = path
+
+    def __call__(self, *args: Any, **kwargs: Any) -> Any:
+        return self.radio_link_process.call(self.path, args, kwargs)
+
+
+class RemoteComponent:
+    """
+    A part of the radio link in the link process. Only its methods can be
+    used, anything else lives in the other process and can't be read here.
+    """
+
+    def __init__(
+        self, radio_link_process: "RadioLinkProcess", name: str, component_class: type
+    ):
+        self.radio_link_process = radio_link_process
+        self.name = name
+        self.component_class = component_class
+
+    def __getattr__(self, name: str) -> RemoteAttribute:
+        if name.startswith("_") or not callable(
+            getattr(self.component_class, name, None)
+        ):
+            raise AttributeError(
+                f"{self.name}.{name} is in the link process, call a method to get it"
+            )
+        return RemoteAttribute(self.radio_link_process, (self.name, name))
+
+
+class RadioLinkProcess:
+    """
+    Runs the radio link in its own process so packet parsing and the radio
+    link threads don't compete with the web server for the GIL.
+
+    The link process writes each telemetry message, already serialised, into
+    a ring buffer in shared memory, and this process reads them straight out
+    of it and passes them to the message listeners. Everything else on the
+    radio link, like commands and queries, is called over a pipe by accessing
+    it on this object as if it was the RadioLink.
+    """
+
+    def __init__(
+        self,
+        port: str,
+        baud: int = 57600,
+        initial_heartbeat_update_callback: Optional[Callable] = None,
+        link_capacity: Optional[int] = None,
+        proximity_alert_callback: Optional[Callable] = None,
+        archive_dir: Optional[str] = DEFAULT_ARCHIVE_DIR,
+        link_lost_callback: Optional[Callable] = None,
+        link_restored_callback: Optional[Callable] = None,
+        alert_callback: Optional[Callable] = None,
+        endurance_callback: Optional[Callable] = None,
+        control_address: Optional[Union[int, str]] = None,
+        forward_outputs: Optional[List[ForwardOutputSettings]] = None,
+        poll_interval: float = 0.005,
+    ):
+        self.logger = logging.getLogger("radio_link_process")
+
+        self.port = port
+        self.baud = baud
+        # Events the link process passes on, by name
+        self.event_callbacks: Dict[str, Optional[Callable]] = {
+            "initial_heartbeat_update": initial_heartbeat_update_callback,
+            "proximity_alert": proximity_alert_callback,
+            "link_lost": link_lost_callback,
+            "link_restored": link_restored_callback,
+            "fleet_alert": alert_callback,
+            "fleet_endurance": endurance_callback,
+        }
+        self.poll_interval = poll_interval
+
+        self.master: Optional[str] = None
+        self.archive: Optional[ArchiveInfo] = None
+        self.message_listeners: Dict[str, Callable] = {}
+        self.is_active = threading.Event()
+        self.is_active.set()
+
+        self.send_lock = threading.Lock()
+        self.calls_lock = threading.Lock()
+        self.next_call_id = 0
+        self.calls: Dict[int, queue.Queue] = {}
+        self.started = threading.Event()
+        self.forward_telemetry_thread: Optional[threading.Thread] = None
+
+        self.ring = SharedRing.create(RING_SLOT_COUNT, RING_SLOT_SIZE)
+        # A fresh interpreter, forking a process with running threads or a
+        # gevent hub isn't safe
+        context = multiprocessing.get_context("spawn")
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(
+            target=run_link_process,
+            args=(
+                child_connection,
+                self.ring.name,
+                port,
+                baud,
+                link_capacity,
+                archive_dir,
+                control_address,
+                forward_outputs,
+                logging.getLogger().getEffectiveLevel(),
+            ),
+            daemon=True,
+        )
+        self.process.start()
+        child_connection.close()
+
+        self.receive_thread = threading.Thread(target=self._receive, daemon=True)
+        self.receive_thread.start()
+        self.started.wait()
+
+        if self.master is None:
+            self.close()
+            return
+
+        self.forward_telemetry_thread = threading.Thread(
+            target=self._forward_telemetry, daemon=True
+        )
+        self.forward_telemetry_thread.start()
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        component_class = REMOTE_COMPONENTS.get(name)
+        if component_class is not None:
+            return RemoteComponent(self, name, component_class)
+        if callable(getattr(RadioLink, name, None)):
+            return RemoteAttribute(self, (name,))
+        raise AttributeError(
+            f"{name} is in the link process, call a method of the radio link to get it"
+        )
+
+    @property
+    def vehicles(self) -> Dict[int, dict]:
+        """The vehicles on the link now, fetched from the link process."""
+        return {
+            vehicle["system_id"]: vehicle
+            for vehicle in self.call(("get_vehicles",), (), {})
+        }
+
+    def _send(self, message: tuple) -> None:
+        with self.send_lock:
+            self.connection.send(message)
+
+    def _handle_event(self, event: str, message: dict) -> None:
+        callback = self.event_callbacks.get(event)
+        if callback is not None:
+            callback(message)
+
+    def _receive(self) -> None:
+        while True:
+            try:
+                wait_for_read(self.connection.fileno())
+                message = self.connection.recv()
+            except (EOFError, OSError):
+                break
+
+            kind = message[0]
+            if kind == "started":
+                info = message[1]
+                if info is not None:
+                    self.master = self.port
+                    if info["archive"] is not None:
+                        self.archive = ArchiveInfo(*info["archive"])
+                self.started.set()
+            elif kind == "event":
+                self._handle_event(message[1], message[2])
+            elif kind in ["result", "callback"]:
+                # Hand it to the thread waiting on the call, callbacks run
+                # there too so they keep its request context
+                with self.calls_lock:
+                    call_queue = self.calls.get(message[1])
+                if call_queue is not None:
+                    call_queue.put(message)
+
+        # The link process has exited
+        self.is_active.clear()
+        self.started.set()
+        with self.calls_lock:
+            for call_queue in self.calls.values():
+                call_queue.put(("result", None, False, "Radio link process exited"))
+
+    def _forward_telemetry(self) -> None:
+        cursor = self.ring.get_write_count()
+        while self.is_active.is_set():
+            cursor, records = self.ring.read(cursor)
+            if not records:
+                time.sleep(self.poll_interval)
+                continue
+
+            for record in records:
+                message_type = TELEMETRY_MESSAGES[record.message_type_index]
+                listener = self.message_listeners.get(message_type)
+                if listener is None:
+                    continue
+
+                message = SharedMessage(
+                    record.system_id,
+                    message_type,
+                    bytes(record.payload),
+                    record.received_time,
+                    None if math.isnan(record.link_latency) else record.link_latency,
+                )
+                # The writer may have lapped us while copying
+                if not self.ring.is_current(record.sequence):
+                    continue
+                try:
+                    listener(message)
+                except Exception:
+                    self.logger.error(
+                        f"Could not execute message listener for {message_type}",
+                        exc_info=True,
+                    )
+
+    def call(self, path: Tuple[str, ...], args: tuple, kwargs: dict) -> Any:
+        """Call a method of the radio link in the link process."""
+        if not self.is_active.is_set():
+            raise RemoteCallError("Radio link process is not running")
+
+        callbacks: List[Callable] = []
+
+        def replace_callback(value: Any) -> Any:
+            if callable(value):
+                callbacks.append(value)
+                return CallbackArgument(len(callbacks) - 1)
+            return value
+
+        call_queue: queue.Queue = queue.Queue()
+        with self.calls_lock:
+            call_id = self.next_call_id
+            self.next_call_id += 1
+            self.calls[call_id] = call_queue
+
+        try:
+            self._send(
+                (
+                    "call",
+                    call_id,
+                    path,
+                    tuple(replace_callback(value) for value in args),
+                    {key: replace_callback(value) for key, value in kwargs.items()},
+                )
+            )
+            while True:
+                message = call_queue.get()
+                if message[0] == "callback":
+                    callbacks[message[2]](*message[3])
+                    continue
+
+                _, _, success, value = message
+                if not success:
+                    raise RemoteCallError(f"{'.'.join(path)} failed: {value}")
+                return value
+        finally:
+            with self.calls_lock:
+                del self.calls[call_id]
+
+    def add_message_listener(self, message_id: str, callback: Callable) -> bool:
+        if message_id not in TELEMETRY_MESSAGES:
+            self.logger.warning(f"{message_id} is not shared by the link process")
+            return False
+        if message_id not in self.message_listeners:
+            self.message_listeners[message_id] = callback
+            return True
+        return False
+
+    def remove_message_listener(self, message_id: str) -> bool:
+        if message_id in self.message_listeners:
+            del self.message_listeners[message_id]
+            return True
+        return False
+
+    def clear_message_listeners(self) -> None:
+        self.message_listeners.clear()
+
+    def close(self) -> None:
+        self.clear_message_listeners()
+        if self.process.is_alive():
+            try:
+                self._send(("close",))
+            except OSError:
+                pass
+            self.process.join(timeout=10)
+            if self.process.is_alive():
+                self.process.terminate()
+
+        self.is_active.clear()
+        if (
+            self.forward_telemetry_thread is not None
+            and self.forward_telemetry_thread is not threading.current_thread()
+        ):
+            self.forward_telemetry_thread.join()
+        self.connection.close()
+        self.ring.close()
+
+        self.logger.info("Radio link process closed")
+
+
+def run_link_process(
+    connection: Connection,
+    ring_name: str,
+    port: str,
+    baud: int,
+    link_capacity: Optional[int],
+    archive_dir: Optional[str],
+    control_address: Optional[Union[int, str]],
+    forward_outputs: Optional[List[ForwardOutputSettings]],
+    log_level: int,
+) -> None:
+    """The link process, runs the radio link until told to close."""
+    setup_logging(log_level)
+    logger = logging.getLogger("radio_link_process")
+
+    ring = SharedRing.attach(ring_name, RING_SLOT_COUNT, RING_SLOT_SIZE)
+    send_lock = threading.Lock()
+
+    def send(message: tuple) -> None:
+        with send_lock:
+            connection.send(message)
+
+    radio_link = RadioLink(
+        port,
+        baud,
+        lambda message: send(("event", "initial_heartbeat_update", message)),
+        link_capacity=link_capacity,
+        proximity_alert_callback=lambda message: send(
+            ("event", "proximity_alert", message)
+        ),
+        archive_dir=archive_dir,
+        link_lost_callback=lambda message: send(("event", "link_lost", message)),
+        link_restored_callback=lambda message: send(
+            ("event", "link_restored", message)
+        ),
+        alert_callback=lambda message: send(("event", "fleet_alert", message)),
+        endurance_callback=lambda message: send(("event", "fleet_endurance", message)),
+        control_address=control_address,
+        forward_outputs=forward_outputs,
+    )
+    if radio_link.master is None:
+        send(("started", None))
+        ring.close()
+        return
+
+    # Only the link process writes to the ring, listeners all run on the one
+    # message listener thread
+    message_type_indexes = {
+        message_type: index for index, message_type in enumerate(TELEMETRY_MESSAGES)
+    }
+
+    def write_to_ring(message: mavlink.MAVLink_message) -> None:
+        message_type = message.get_type()
+        payload = json.dumps(message.to_dict()).encode()
+        link_latency = getattr(message, "_link_latency", None)
+        if not ring.write(
+            message.get_srcSystem(),
+            message_type_indexes[message_type],
+            payload,
+            message._timestamp,
+            math.nan if link_latency is None else link_latency,
+        ):
+            logger.warning(f"{message_type} is too big for the ring, dropped")
+
+    for message_type in TELEMETRY_MESSAGES:
+        radio_link.add_message_listener(message_type, write_to_ring)
+
+    send(
+        (
+            "started",
+            {
+                "archive": (
+                    radio_link.archive.session_id,
+                    radio_link.archive.archive_dir,
+                )
+                if radio_link.archive is not None
+                else None,
+            },
+        )
+    )
+
+    def handle_call(
+        call_id: int, path: Tuple[str, ...], args: tuple, kwargs: dict
+    ) -> None:
+        def replace_callback_argument(value: Any) -> Any:
+            if isinstance(value, CallbackArgument):
+                index = value.index
+                return lambda *callback_args: send(
+                    ("callback", call_id, index, callback_args)
+                )
+            return value
+
+        try:
+            target: Any = radio_link
+            for name in path:
+                target = getattr(target, name)
+            result = target(
+                *[replace_callback_argument(value) for value in args],
+                **{
+                    key: replace_callback_argument(value)
+                    for key, value in kwargs.items()
+                },
+            )
+        except Exception as e:
+            logger.error(f"Call to {'.'.join(path)} failed", exc_info=True)
+            send(("result", call_id, False, str(e)))
+            return
+
+        try:
+            send(("result", call_id, True, result))
+        except Exception as e:
+            # The result couldn't be pickled
+            send(("result", call_id, False, str(e)))
+
+    while True:
+        try:
+            wait_for_read(connection.fileno())
+            message = connection.recv()
+        except (EOFError, OSError):
+            break
+        if message[0] == "close":
+            break
+        # Commands wait on acknowledgements, run each on its own thread like
+        # the web server does
+        threading.Thread(target=handle_call, args=message[1:], daemon=True).start()
+
+    radio_link.close()
+    ring.close()
+    connection.close()
@@ -0,0 +1,65 @@
+import logging
+import threading
+from typing import Callable, Optional, Set
+
+LINK_IDLE_TIMEOUT = 30.0
+
+
+class LinkSessions:
+    """
+    Keeps track of the clients sharing the radio link so the link outlives any
+    one of them. The client that opened the link owns it, and once the last
+    client has gone the idle callback runs after a grace period, long enough
+    for a page reload to reconnect first.
+    """
+
+    def __init__(self, idle_timeout: float = LINK_IDLE_TIMEOUT):
+        self.logger = logging.getLogger("link_sessions")
+
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        self.clients: Set[str] = set()
+        self.owner: Optional[str] = None
+        self.idle_timer: Optional[threading.Timer] = None
+
+    def add(self, client_id: str) -> int:
+        with self.lock:
+            self.clients.add(client_id)
+            if self.idle_timer is not None:
+                self.idle_timer.cancel()
+                self.idle_timer = None
+            return len(self.clients)
+
+    def remove(self, client_id: str, on_idle: Callable[[], None]) -> int:
+        """Remove a client, starting the idle timer if it was the last one."""
+        with self.lock:
+            self.clients.discard(client_id)
+            if self.owner == client_id:
+                self.owner = None
+
+            if not self.clients and self.idle_timer is None:
+                self.logger.debug(
+                    f"No clients left, closing the link in {self.idle_timeout}s"
+                )
+                self.idle_timer = threading.Timer(
+                    self.idle_timeout, self._handle_idle, args=(on_idle,)
+                )
+                self.idle_timer.daemon = True
+                self.idle_timer.start()
+            return len(self.clients)
+
+    def _handle_idle(self, on_idle: Callable[[], None]) -> None:
+        with self.lock:
+            self.idle_timer = None
+            if self.clients:
+                return
+        on_idle()
+
+    def can_close(self, client_id: str) -> bool:
+        """Anyone can close the link once its owner has gone, or if they're alone."""
+        with self.lock:
+            return (
+                self.owner is None
+                or self.owner == client_id
+                or self.clients <= {client_id}
+            )
@@ -0,0 +1,102 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Hashable, Optional, TextIO, Tuple, Union
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+listener: Optional[QueueListener] = None
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets through at most burst records from each logging call site per
+    interval and drops the rest, so a flood of STATUSTEXT or retry warnings
+    can't back up the log queue. The first record let through after some were
+    dropped says how many. A call site can split its budget by passing a
+    rate_limit_key in extra, like STATUSTEXT does per vehicle.
+    """
+
+    def __init__(self, burst: int = 20, interval: float = 1.0):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+
+        self.lock = threading.Lock()
+        # (Call site, rate limit key) -> (window start time, records in window,
+        # records dropped)
+        self.windows: Dict[Tuple[str, int, Hashable], Tuple[float, int, int]] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = (record.pathname, record.lineno, getattr(record, "rate_limit_key", None))
+        now = time.monotonic()
+        with self.lock:
+            window_start, count, dropped = self.windows.get(key, (now, 0, 0))
+            if now - window_start >= self.interval:
+                window_start, count = now, 0
+
+            if count >= self.burst:
+                self.windows[key] = (window_start, count, dropped + 1)
+                return False
+            self.windows[key] = (window_start, count + 1, 0)
+
+        if dropped:
+            record.msg = f"{record.msg} ({dropped} similar messages dropped)"
+        return True
+
+
+class BackgroundQueueHandler(QueueHandler):
+    """
+    Puts records on the log queue as they are. The standard QueueHandler
+    formats each record before queueing it so it can be pickled, which isn't
+    needed for a queue in the same process and would put the formatting cost
+    back on the thread that logged.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def setup_logging(
+    level: Union[int, str] = logging.INFO,
+    rate_limit_burst: Optional[int] = 20,
+    rate_limit_interval: float = 1.0,
+    stream: Optional[TextIO] = None,
+) -> QueueListener:
+    """
+    Send all logging through a queue to a background thread that formats and
+    writes the records, so logging from the radio link threads never waits on
+    I/O. Replaces logging.basicConfig, logging to stderr unless given a stream.
+    """
+    stream_handler = logging.StreamHandler(stream)
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = BackgroundQueueHandler(log_queue)
+    if rate_limit_burst is not None:
+        queue_handler.addFilter(RateLimitFilter(rate_limit_burst, rate_limit_interval))
+
+    stop_logging()
+
+    root_logger = logging.getLogger()
+    for handler in root_logger.handlers[:]:
+        root_logger.removeHandler(handler)
+    root_logger.addHandler(queue_handler)
+    root_logger.setLevel(level)
+
+    global listener
+    listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+@atexit.register
+def stop_logging() -> None:
+    """Stop the background thread once it has written out everything queued."""
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
@@ -0,0 +1,276 @@
+import logging
+import math
+import time
+from queue import Empty
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional
+
+from pymavlink.mavutil import mavlink
+from typing_extensions import NotRequired, TypedDict
+
+from app.types import Response
+
+if TYPE_CHECKING:
+    from app.radio_link import RadioLink
+
+MISSION_MESSAGES = ["MISSION_REQUEST_INT", "MISSION_REQUEST", "MISSION_ACK"]
+PROGRESS_INTERVAL = 0.25
+
+
+class MissionItem(TypedDict):
+    command: int
+    latitude: float
+    longitude: float
+    altitude: float
+    frame: NotRequired[int]
+    param1: NotRequired[float]
+    param2: NotRequired[float]
+    param3: NotRequired[float]
+    param4: NotRequired[float]
+    autocontinue: NotRequired[int]
+
+
+def is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def is_integer(value: Any, maximum: int) -> bool:
+    return (
+        isinstance(value, int) and not isinstance(value, bool) and 0 <= value <= maximum
+    )
+
+
+def check_mission(items: Any) -> None:
+    """
+    Check a mission's items can be sent before anything is uploaded, raising
+    a ValueError saying which item is wrong. Params may be NaN, which some
+    commands use to mean "leave unchanged".
+    """
+    if not isinstance(items, list) or not items:
+        raise ValueError("Mission has no items")
+
+    for seq, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise ValueError(f"Item {seq} is not a mission item")
+        if not is_integer(item.get("command"), 0xFFFF):
+            raise ValueError(f"Item {seq} has an invalid command")
+        for key in ["latitude", "longitude", "altitude"]:
+            if not is_number(item.get(key)) or not math.isfinite(item[key]):
+                raise ValueError(f"Item {seq} has an invalid {key}")
+        if abs(item["latitude"]) > 90 or abs(item["longitude"]) > 180:
+            raise ValueError(f"Item {seq} is outside the valid coordinates")
+        for key in ["frame", "autocontinue"]:
+            if key in item and not is_integer(item[key], 0xFF):
+                raise ValueError(f"Item {seq} has an invalid {key}")
+        for key in ["param1", "param2", "param3", "param4"]:
+            if key in item and not is_number(item[key]):
+                raise ValueError(f"Item {seq} has an invalid {key}")
+
+
+class VehicleUpload:
+    def __init__(self, system_id: int, items: List[MissionItem]):
+        self.system_id = system_id
+        self.items = items
+
+        self.items_sent: int = 0
+        self.last_sent_seq: Optional[int] = None
+        self.last_activity_time: float = time.time()
+        self.last_progress_time: float = 0.0
+        self.retries: int = 0
+
+        self.result: Optional[Response] = None
+
+
+class MissionUploader:
+    """
+    Uploads missions to many vehicles at once with the MAVLink mission
+    protocol. One loop serves every vehicle, each MISSION_REQUEST is answered
+    as soon as it arrives so all the uploads are pipelined over the link.
+    """
+
+    def __init__(
+        self,
+        radio_link: "RadioLink",
+        progress_callback: Optional[Callable] = None,
+        item_timeout: float = 1.5,
+        max_retries: int = 5,
+    ):
+        self.logger = logging.getLogger("mission_uploader")
+
+        self.radio_link = radio_link
+        self.progress_callback = progress_callback
+        self.item_timeout = item_timeout
+        self.max_retries = max_retries
+        self.controller_id = "mission_uploader"
+
+    def _send_count(self, upload: VehicleUpload) -> None:
+        if self.radio_link.master is None:
+            return
+
+        self.radio_link.master.mav.mission_count_send(
+            upload.system_id,
+            mavlink.MAV_COMP_ID_AUTOPILOT1,
+            len(upload.items),
+            mavlink.MAV_MISSION_TYPE_MISSION,
+        )
+
+    def _send_item(self, upload: VehicleUpload, seq: int) -> None:
+        if self.radio_link.master is None:
+            return
+
+        item = upload.items[seq]
+        self.radio_link.master.mav.mission_item_int_send(
+            upload.system_id,
+            mavlink.MAV_COMP_ID_AUTOPILOT1,
+            seq,
+            item.get("frame", mavlink.MAV_FRAME_GLOBAL_RELATIVE_ALT_INT),
+            item["command"],
+            0,  # current
+            item.get("autocontinue", 1),
+            item.get("param1", 0),
+            item.get("param2", 0),
+            item.get("param3", 0),
+            item.get("param4", 0),
+            int(item["latitude"] * 1e7),
+            int(item["longitude"] * 1e7),
+            item["altitude"],
+            mavlink.MAV_MISSION_TYPE_MISSION,
+        )
+
+        upload.last_sent_seq = seq
+        upload.items_sent = max(upload.items_sent, seq + 1)
+
+    def _report_progress(self, upload: VehicleUpload, force: bool = False) -> None:
+        now = time.time()
+        if self.progress_callback is None or (
+            not force and now - upload.last_progress_time < PROGRESS_INTERVAL
+        ):
+            return
+
+        upload.last_progress_time = now
+        progress: dict = {
+            "system_id": upload.system_id,
+            "items_sent": upload.items_sent,
+            "total_items": len(upload.items),
+        }
+        if upload.result is not None:
+            progress["success"] = upload.result["success"]
+            progress["message"] = upload.result.get("message", "")
+        self.progress_callback({"success": True, "data": progress})
+
+    def _finish(self, upload: VehicleUpload, success: bool, message: str) -> None:
+        upload.result = {"success": success, "message": message}
+        if success:
+            self.logger.info(f"[{upload.system_id}] {message}")
+        else:
+            self.logger.warning(f"[{upload.system_id}] {message}")
+        self._report_progress(upload, force=True)
+
+    def _handle_message(self, upload: VehicleUpload, msg_type: str, msg) -> None:
+        upload.last_activity_time = time.time()
+        upload.retries = 0
+
+        if msg_type in ("MISSION_REQUEST_INT", "MISSION_REQUEST"):
+            if msg.seq >= len(upload.items):
+                self._finish(upload, False, f"Vehicle requested invalid item {msg.seq}")
+                return
+            self._send_item(upload, msg.seq)
+            self._report_progress(upload)
+        elif msg_type == "MISSION_ACK":
+            if msg.type == mavlink.MAV_MISSION_ACCEPTED:
+                upload.items_sent = len(upload.items)
+                self._finish(
+                    upload, True, f"Uploaded {len(upload.items)} mission items"
+                )
+            else:
+                self._finish(upload, False, f"Mission rejected, result: {msg.type}")
+
+    def _check_timeouts(self, uploads: Dict[int, VehicleUpload]) -> None:
+        now = time.time()
+        for upload in uploads.values():
+            if upload.result is not None:
+                continue
+            if now - upload.last_activity_time < self.item_timeout:
+                continue
+
+            upload.retries += 1
+            upload.last_activity_time = now
+            if upload.retries > self.max_retries:
+                self._finish(upload, False, "Mission upload timed out")
+                continue
+
+            # Repeat whatever was sent last, if the vehicle's request was lost
+            # instead it will request the item again on its own timeout
+            self.logger.debug(
+                f"[{upload.system_id}] Mission upload timeout, retry {upload.retries}"
+            )
+            if upload.last_sent_seq is None:
+                self._send_count(upload)
+            else:
+                self._send_item(upload, upload.last_sent_seq)
+
+    def upload(self, missions: Dict[int, List[MissionItem]]) -> Dict[int, Response]:
+        """Upload a mission to each vehicle, returns the result for each vehicle."""
+        uploads = {
+            system_id: VehicleUpload(system_id, items)
+            for system_id, items in missions.items()
+        }
+
+        reserved: List[str] = []
+        for message_id in MISSION_MESSAGES:
+            if not self.radio_link.reserve_message_type(message_id, self.controller_id):
+                for reserved_message_id in reserved:
+                    self.radio_link.release_message_type(
+                        reserved_message_id, self.controller_id
+                    )
+                return {
+                    system_id: {
+                        "success": False,
+                        "message": f"Could not reserve {message_id} messages",
+                    }
+                    for system_id in uploads
+                }
+            reserved.append(message_id)
+
+        try:
+            queue = self.radio_link.controller_queues[self.controller_id]
+
+            for upload in uploads.values():
+                if not upload.items:
+                    self._finish(upload, False, "Mission has no items")
+                else:
+                    self._send_count(upload)
+
+            while any(upload.result is None for upload in uploads.values()):
+                if not self.radio_link.is_active.is_set():
+                    break
+
+                try:
+                    msg_type, msg = queue.get(timeout=0.05)
+                except Empty:
+                    self._check_timeouts(uploads)
+                    continue
+
+                vehicle_upload = uploads.get(msg.get_srcSystem())
+                if vehicle_upload is None or vehicle_upload.result is not None:
+                    continue
+                mission_type = getattr(
+                    msg, "mission_type", mavlink.MAV_MISSION_TYPE_MISSION
+                )
+                if mission_type != mavlink.MAV_MISSION_TYPE_MISSION:
+                    continue
+
+                self._handle_message(vehicle_upload, msg_type, msg)
+                self._check_timeouts(uploads)
+        finally:
+            for message_id in reserved:
+                self.radio_link.release_message_type(message_id, self.controller_id)
+
+        for upload in uploads.values():
+            if upload.result is None:
+                self._finish(upload, False, "Radio link closed during mission upload")
+
+        return {
+            system_id: upload.result
+            for system_id, upload in uploads.items()
+            if upload.result is not None
+        }
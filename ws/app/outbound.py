@@ -0,0 +1,116 @@
+import logging
+import threading
+import time
+from collections import deque
+from queue import Empty, Queue
+from typing import TYPE_CHECKING, Any, Deque, Optional, Tuple
+
+from pymavlink.mavutil import mavlink
+
+from app.latency import get_percentiles
+
+if TYPE_CHECKING:
+    from app.radio_link import RadioLink
+
+# Packets queued together are written as one, up to what fits in a single
+# UDP datagram on an Ethernet link
+MAX_WRITE_SIZE = 1400
+QUEUE_DELAY_SAMPLES = 1000
+
+
+class OutboundWriter:
+    """
+    The only thing that writes to the radio link's port. It replaces the
+    pymavlink connection's send and file, so every *_send helper packs its
+    message under a lock (keeping sequence numbers in order) and queues the
+    bytes, and a background thread writes out whatever has queued up since the
+    last write in one go.
+    """
+
+    def __init__(self, radio_link: "RadioLink", max_write_size: int = MAX_WRITE_SIZE):
+        self.logger = logging.getLogger("outbound_writer")
+
+        self.radio_link = radio_link
+        self.max_write_size = max_write_size
+
+        self.queue: Queue = Queue()
+        self.send_lock = threading.Lock()
+
+        self.port: Optional[Any] = None
+        self.packets_sent: int = 0
+        self.packets_dropped: int = 0
+        self.writes: int = 0
+        self.bytes_sent: int = 0
+        self.queue_delays: Deque[float] = deque(maxlen=QUEUE_DELAY_SAMPLES)
+
+    def install(self, mav: mavlink.MAVLink) -> None:
+        with self.send_lock:
+            self.port = mav.file
+            self._mav_send = mav.send
+            mav.file = self
+            mav.send = self.send  # type: ignore[method-assign]
+
+    def disconnect(self) -> None:
+        """Drop packets until a new connection is installed."""
+        self.port = None
+
+    def send(
+        self, message: mavlink.MAVLink_message, force_mavlink1: bool = False
+    ) -> None:
+        with self.send_lock:
+            self._mav_send(message, force_mavlink1=force_mavlink1)
+
+    def write(self, buffer: bytes) -> None:
+        """Called by pymavlink with each packed message."""
+        self.queue.put((time.monotonic(), buffer))
+
+    def _write_batch(self, batch: Deque[Tuple[float, bytes]]) -> None:
+        if self.port is None:
+            self.packets_dropped += len(batch)
+            return
+
+        data = b"".join(buffer for _, buffer in batch)
+        try:
+            self.port.write(data)
+        except Exception:
+            self.logger.error(f"Could not write {len(batch)} packets", exc_info=True)
+            return
+
+        now = time.monotonic()
+        for queued_time, _ in batch:
+            self.queue_delays.append(now - queued_time)
+        self.packets_sent += len(batch)
+        self.writes += 1
+        self.bytes_sent += len(data)
+
+    def run(self) -> None:
+        while self.radio_link.is_active.is_set():
+            try:
+                item = self.queue.get(timeout=1)
+            except Empty:
+                continue
+
+            batch: Deque[Tuple[float, bytes]] = deque([item])
+            size = len(item[1])
+            while True:
+                try:
+                    item = self.queue.get_nowait()
+                except Empty:
+                    break
+                if size + len(item[1]) > self.max_write_size:
+                    self._write_batch(batch)
+                    batch.clear()
+                    size = 0
+                batch.append(item)
+                size += len(item[1])
+            self._write_batch(batch)
+
+    def get_status(self) -> dict:
+        return {
+            "packets_sent": self.packets_sent,
+            "packets_dropped": self.packets_dropped,
+            "writes": self.writes,
+            "bytes_sent": self.bytes_sent,
+            "queued": self.queue.qsize(),
+            "queue_delay": get_percentiles(self.queue_delays),
+        }
@@ -0,0 +1,563 @@
+import json
+import logging
+import math
+import os
+import struct
+import time
+from queue import Empty, Queue
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Set
+
+from pymavlink.mavutil import mavlink
+from typing_extensions import TypedDict
+
+from app.blocking import run_blocking
+from app.types import Response
+
+if TYPE_CHECKING:
+    from app.radio_link import RadioLink
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".multicontrol", "params")
+HASH_CHECK_PARAM = "_HASH_CHECK"
+PROGRESS_INTERVAL = 0.5
+
+
+class Param(TypedDict):
+    value: float
+    type: int
+    index: int
+
+
+def decode_param_hash(value: float) -> int:
+    """The parameter hash is sent as the raw bits of a float."""
+    return struct.unpack("<I", struct.pack("<f", value))[0]
+
+
+def params_match(first: float, second: float) -> bool:
+    """Compare parameter values the way they come back from the vehicle, as float32."""
+    if math.isnan(first) or math.isnan(second):
+        return math.isnan(first) and math.isnan(second)
+    return struct.pack("<f", first) == struct.pack("<f", second)
+
+
+class ParamCache:
+    """
+    On-disk cache of each vehicle's parameters, one file per system ID. An
+    entry is only trusted if the firmware and the parameter hash reported by
+    the vehicle both match what was stored with it.
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR):
+        self.logger = logging.getLogger("param_cache")
+        self.cache_dir = cache_dir
+
+    def _get_path(self, system_id: int) -> str:
+        return os.path.join(self.cache_dir, f"{system_id}.json")
+
+    def load(
+        self, system_id: int, firmware: Optional[str], param_hash: Optional[int]
+    ) -> Optional[Dict[str, Param]]:
+        if param_hash is None:
+            return None
+
+        try:
+            with open(self._get_path(system_id)) as cache_file:
+                entry = json.load(cache_file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            self.logger.warning(f"Could not read param cache for {system_id}")
+            return None
+
+        if entry.get("firmware") != firmware or entry.get("hash") != param_hash:
+            return None
+        return entry.get("params")
+
+    def save(
+        self,
+        system_id: int,
+        firmware: Optional[str],
+        param_hash: Optional[int],
+        params: Dict[str, Param],
+    ) -> None:
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = self._get_path(system_id)
+            # Write to a temporary file first so a crash can't leave a torn entry
+            with open(f"{path}.tmp", "w") as cache_file:
+                json.dump(
+                    {"firmware": firmware, "hash": param_hash, "params": params},
+                    cache_file,
+                )
+            os.replace(f"{path}.tmp", path)
+        except OSError:
+            self.logger.warning(
+                f"Could not write param cache for {system_id}", exc_info=True
+            )
+
+
+class VehicleParamDownload:
+    def __init__(self, system_id: int):
+        self.system_id = system_id
+
+        self.param_count: Optional[int] = None
+        self.params_by_index: Dict[int, tuple] = {}
+        self.last_received_time: float = time.time()
+        self.last_progress_time: float = 0.0
+        self.requested: Set[int] = set()
+        self.request_cursor: int = 0
+        self.stalled_rounds: int = 0
+        self.done: bool = False
+
+    def is_complete(self) -> bool:
+        return (
+            self.param_count is not None
+            and len(self.params_by_index) >= self.param_count
+        )
+
+    def get_missing_indices(self) -> List[int]:
+        if self.param_count is None:
+            return []
+        return [
+            index
+            for index in range(self.param_count)
+            if index not in self.params_by_index
+        ]
+
+
+class ParamManager:
+    """
+    Reads and writes parameters on many vehicles at once. Full downloads only
+    re-request the indices that went missing, and known vehicles are loaded
+    from the disk cache after a quick hash check.
+    """
+
+    def __init__(
+        self,
+        radio_link: "RadioLink",
+        cache_dir: str = DEFAULT_CACHE_DIR,
+        idle_timeout: float = 1.0,
+        max_stalled_rounds: int = 5,
+        rerequest_batch_size: int = 20,
+    ):
+        self.logger = logging.getLogger("param_manager")
+
+        self.radio_link = radio_link
+        self.cache = ParamCache(cache_dir)
+        self.idle_timeout = idle_timeout
+        self.max_stalled_rounds = max_stalled_rounds
+        self.rerequest_batch_size = rerequest_batch_size
+        self.controller_id = "param_manager"
+
+        self.params: Dict[int, Dict[str, Param]] = {}
+        self.firmware: Dict[int, Optional[str]] = {}
+        self.param_hashes: Dict[int, Optional[int]] = {}
+
+    def _reserve(self, message_ids: List[str]) -> Optional[Queue]:
+        reserved: List[str] = []
+        for message_id in message_ids:
+            if not self.radio_link.reserve_message_type(message_id, self.controller_id):
+                self._release(reserved)
+                return None
+            reserved.append(message_id)
+        return self.radio_link.controller_queues[self.controller_id]
+
+    def _release(self, message_ids: List[str]) -> None:
+        for message_id in message_ids:
+            self.radio_link.release_message_type(message_id, self.controller_id)
+
+    def _request_param_by_name(self, system_id: int, param_id: str) -> None:
+        if self.radio_link.master is None:
+            return
+        self.radio_link.master.mav.param_request_read_send(
+            system_id, mavlink.MAV_COMP_ID_AUTOPILOT1, param_id.encode(), -1
+        )
+
+    def _request_param_by_index(self, system_id: int, index: int) -> None:
+        if self.radio_link.master is None:
+            return
+        self.radio_link.master.mav.param_request_read_send(
+            system_id, mavlink.MAV_COMP_ID_AUTOPILOT1, b"", index
+        )
+
+    def _check_vehicles(
+        self, system_ids: List[int], timeout: float = 2.0, retry_interval: float = 0.4
+    ) -> None:
+        """
+        Ask every vehicle for its firmware version and parameter hash at once,
+        repeating the requests that go unanswered. Vehicles that don't support
+        the hash check are left with no hash and always get a full download.
+        """
+        queue = self._reserve(["PARAM_VALUE", "AUTOPILOT_VERSION"])
+        if queue is None:
+            return
+
+        pending_hash: Set[int] = set(system_ids)
+        pending_firmware: Set[int] = set(system_ids)
+        for system_id in system_ids:
+            self.param_hashes[system_id] = None
+            self.firmware[system_id] = None
+
+        try:
+            start_time = time.time()
+            last_request_time = 0.0
+            while (pending_hash or pending_firmware) and (
+                time.time() - start_time < timeout
+            ):
+                if time.time() - last_request_time > retry_interval:
+                    last_request_time = time.time()
+                    for system_id in pending_firmware:
+                        self.radio_link.send_command_to_vehicle(
+                            system_id,
+                            mavlink.MAV_CMD_REQUEST_MESSAGE,
+                            param1=mavlink.MAVLINK_MSG_ID_AUTOPILOT_VERSION,
+                        )
+                    for system_id in pending_hash:
+                        self._request_param_by_name(system_id, HASH_CHECK_PARAM)
+
+                try:
+                    msg_type, msg = queue.get(timeout=0.05)
+                except Empty:
+                    continue
+
+                system_id = msg.get_srcSystem()
+                if msg_type == "AUTOPILOT_VERSION" and system_id in pending_firmware:
+                    pending_firmware.discard(system_id)
+                    self.firmware[system_id] = (
+                        f"{msg.flight_sw_version:08x}-"
+                        f"{bytes(msg.flight_custom_version).hex()}"
+                    )
+                elif (
+                    msg_type == "PARAM_VALUE"
+                    and msg.param_id == HASH_CHECK_PARAM
+                    and system_id in pending_hash
+                ):
+                    pending_hash.discard(system_id)
+                    self.param_hashes[system_id] = decode_param_hash(msg.param_value)
+        finally:
+            self._release(["PARAM_VALUE", "AUTOPILOT_VERSION"])
+
+    def _report_progress(
+        self,
+        download: VehicleParamDownload,
+        progress_callback: Optional[Callable],
+        force: bool = False,
+    ) -> None:
+        now = time.time()
+        if progress_callback is None or (
+            not force and now - download.last_progress_time < PROGRESS_INTERVAL
+        ):
+            return
+
+        download.last_progress_time = now
+        progress_callback(
+            {
+                "success": True,
+                "data": {
+                    "system_id": download.system_id,
+                    "received": len(download.params_by_index),
+                    "total": download.param_count,
+                    "done": download.done,
+                },
+            }
+        )
+
+    def _request_next_missing(self, download: VehicleParamDownload) -> None:
+        """
+        Keep a window of re-requested indices in flight, each answer lets the
+        next missing index be requested.
+        """
+        if download.param_count is None:
+            return
+
+        while (
+            len(download.requested) < self.rerequest_batch_size
+            and download.request_cursor < download.param_count
+        ):
+            index = download.request_cursor
+            download.request_cursor += 1
+            if index in download.params_by_index or index in download.requested:
+                continue
+            download.requested.add(index)
+            self._request_param_by_index(download.system_id, index)
+
+    def _rerequest_missing(self, download: VehicleParamDownload) -> None:
+        download.last_received_time = time.time()
+
+        if download.param_count is None:
+            # Never heard back from the list request, ask again
+            if self.radio_link.master is not None:
+                self.radio_link.master.mav.param_request_list_send(
+                    download.system_id, mavlink.MAV_COMP_ID_AUTOPILOT1
+                )
+            return
+
+        self.logger.debug(
+            f"[{download.system_id}] Re-requesting "
+            f"{download.param_count - len(download.params_by_index)} missing params"
+        )
+        # Anything still in flight from the last pass was lost, start again
+        download.requested.clear()
+        download.request_cursor = 0
+        self._request_next_missing(download)
+
+    def _handle_param_value(
+        self,
+        download: VehicleParamDownload,
+        msg,
+        progress_callback: Optional[Callable],
+    ) -> None:
+        download.param_count = msg.param_count
+        download.last_received_time = time.time()
+
+        if 0 <= msg.param_index < msg.param_count:
+            if msg.param_index not in download.params_by_index:
+                download.stalled_rounds = 0
+            download.params_by_index[msg.param_index] = (
+                msg.param_id,
+                msg.param_value,
+                msg.param_type,
+            )
+
+        if download.is_complete():
+            download.done = True
+            self._report_progress(download, progress_callback, force=True)
+            return
+
+        self._report_progress(download, progress_callback)
+        if msg.param_index in download.requested:
+            download.requested.discard(msg.param_index)
+            self._request_next_missing(download)
+
+    def _download(
+        self, system_ids: List[int], progress_callback: Optional[Callable]
+    ) -> Dict[int, Response]:
+        downloads = {
+            system_id: VehicleParamDownload(system_id) for system_id in system_ids
+        }
+
+        queue = self._reserve(["PARAM_VALUE"])
+        if queue is None:
+            return {
+                system_id: {
+                    "success": False,
+                    "message": "Could not reserve PARAM_VALUE messages",
+                }
+                for system_id in system_ids
+            }
+
+        try:
+            for system_id in system_ids:
+                if self.radio_link.master is not None:
+                    self.radio_link.master.mav.param_request_list_send(
+                        system_id, mavlink.MAV_COMP_ID_AUTOPILOT1
+                    )
+
+            while not all(download.done for download in downloads.values()):
+                if not self.radio_link.is_active.is_set():
+                    break
+
+                try:
+                    _, msg = queue.get(timeout=0.05)
+                except Empty:
+                    msg = None
+
+                if msg is not None and msg.param_id != HASH_CHECK_PARAM:
+                    download = downloads.get(msg.get_srcSystem())
+                    if download is not None and not download.done:
+                        self._handle_param_value(download, msg, progress_callback)
+
+                now = time.time()
+                for download in downloads.values():
+                    if download.done:
+                        continue
+                    if now - download.last_received_time < self.idle_timeout:
+                        continue
+                    download.stalled_rounds += 1
+                    if download.stalled_rounds > self.max_stalled_rounds:
+                        download.done = True
+                        self._report_progress(download, progress_callback, force=True)
+                        continue
+                    self._rerequest_missing(download)
+        finally:
+            self._release(["PARAM_VALUE"])
+
+        results: Dict[int, Response] = {}
+        for system_id, download in downloads.items():
+            missing = download.get_missing_indices()
+            if download.param_count is None or missing:
+                results[system_id] = {
+                    "success": False,
+                    "message": f"Could not download params, {len(missing)} missing",
+                }
+                continue
+
+            self.params[system_id] = {
+                name: {"value": value, "type": param_type, "index": index}
+                for index, (name, value, param_type) in download.params_by_index.items()
+            }
+            run_blocking(
+                self.cache.save,
+                system_id,
+                self.firmware.get(system_id),
+                self.param_hashes.get(system_id),
+                self.params[system_id],
+            )
+            results[system_id] = {
+                "success": True,
+                "message": f"Downloaded {download.param_count} params",
+            }
+        return results
+
+    def fetch(
+        self,
+        system_ids: List[int],
+        use_cache: bool = True,
+        progress_callback: Optional[Callable] = None,
+    ) -> Dict[int, Response]:
+        """
+        Get the parameters of every vehicle, from the disk cache where the
+        vehicle's parameter hash shows nothing has changed, otherwise with a
+        concurrent download from all the remaining vehicles.
+        """
+        results: Dict[int, Response] = {}
+
+        # The hash is needed to store the download in the cache even when the
+        # cache isn't being read from
+        self._check_vehicles(system_ids)
+
+        to_download = list(system_ids)
+        if use_cache:
+            to_download = []
+            for system_id in system_ids:
+                cached_params = run_blocking(
+                    self.cache.load,
+                    system_id,
+                    self.firmware.get(system_id),
+                    self.param_hashes.get(system_id),
+                )
+                if cached_params is None:
+                    to_download.append(system_id)
+                    continue
+
+                self.params[system_id] = cached_params
+                results[system_id] = {
+                    "success": True,
+                    "message": f"Loaded {len(cached_params)} params from cache",
+                }
+                if progress_callback:
+                    progress_callback(
+                        {
+                            "success": True,
+                            "data": {
+                                "system_id": system_id,
+                                "received": len(cached_params),
+                                "total": len(cached_params),
+                                "done": True,
+                            },
+                        }
+                    )
+
+        if to_download:
+            results.update(self._download(to_download, progress_callback))
+
+        return results
+
+    def set(
+        self,
+        system_ids: List[int],
+        params: Dict[str, float],
+        timeout: float = 1.0,
+        max_retries: int = 3,
+    ) -> Dict[int, Response]:
+        """
+        Set the same parameters on every vehicle and verify each one from the
+        PARAM_VALUE the vehicle sends back, resending any that aren't confirmed.
+        """
+        queue = self._reserve(["PARAM_VALUE"])
+        if queue is None:
+            return {
+                system_id: {
+                    "success": False,
+                    "message": "Could not reserve PARAM_VALUE messages",
+                }
+                for system_id in system_ids
+            }
+
+        unverified = {
+            system_id: {name: 0 for name in params} for system_id in system_ids
+        }
+        rejected: Dict[int, List[str]] = {system_id: [] for system_id in system_ids}
+
+        def send_param(system_id: int, name: str) -> None:
+            if self.radio_link.master is None:
+                return
+            known_param = self.params.get(system_id, {}).get(name)
+            self.radio_link.master.mav.param_set_send(
+                system_id,
+                mavlink.MAV_COMP_ID_AUTOPILOT1,
+                name.encode(),
+                params[name],
+                known_param["type"] if known_param else mavlink.MAV_PARAM_TYPE_REAL32,
+            )
+            unverified[system_id][name] += 1
+
+        try:
+            for system_id in system_ids:
+                for name in params:
+                    send_param(system_id, name)
+
+            last_send_time = time.time()
+            while any(unverified.values()):
+                try:
+                    _, msg = queue.get(timeout=0.05)
+                except Empty:
+                    msg = None
+
+                if msg is not None:
+                    system_id = msg.get_srcSystem()
+                    name = msg.param_id
+                    if name in unverified.get(system_id, {}):
+                        del unverified[system_id][name]
+                        if not params_match(msg.param_value, params[name]):
+                            rejected[system_id].append(name)
+                        elif system_id in self.params:
+                            self.params[system_id][name] = {
+                                "value": msg.param_value,
+                                "type": msg.param_type,
+                                "index": msg.param_index,
+                            }
+
+                if time.time() - last_send_time > timeout:
+                    last_send_time = time.time()
+                    for system_id, pending in unverified.items():
+                        for name, attempts in list(pending.items()):
+                            if attempts > max_retries:
+                                del pending[name]
+                                rejected[system_id].append(name)
+                            else:
+                                send_param(system_id, name)
+        finally:
+            self._release(["PARAM_VALUE"])
+
+        results: Dict[int, Response] = {}
+        for system_id in system_ids:
+            if rejected[system_id]:
+                results[system_id] = {
+                    "success": False,
+                    "message": f"Could not set {', '.join(rejected[system_id])}",
+                }
+            else:
+                results[system_id] = {
+                    "success": True,
+                    "message": f"Set {len(params)} params",
+                }
+                # The vehicle's hash has changed, the next fetch re-checks it
+                if system_id in self.params:
+                    run_blocking(
+                        self.cache.save,
+                        system_id,
+                        self.firmware.get(system_id),
+                        None,
+                        self.params[system_id],
+                    )
+        return results
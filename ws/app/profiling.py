@@ -0,0 +1,234 @@
+import _thread
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from types import CodeType, FrameType
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app import async_mode
+from app.blocking import run_blocking
+
+DEFAULT_SAMPLE_INTERVAL = 0.01
+MAX_PROFILE_DURATION = 120.0
+MEMORY_STATISTICS_GROUPS = ["lineno", "filename", "traceback"]
+
+WS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Only one profile runs at a time, the samples would be shared otherwise
+profile_lock = threading.Lock()
+last_memory_snapshot: Optional[tracemalloc.Snapshot] = None
+
+
+def get_native_thread_functions() -> Tuple[Callable, Callable, Callable]:
+    """
+    Get start_new_thread, get_ident and sleep for a real thread. Under gevent
+    the patched ones make greenlets, which only run when the event loop is
+    idle and so would never see what is keeping it busy.
+    """
+    if async_mode == "gevent":
+        from gevent import monkey
+
+        return (
+            monkey.get_original("_thread", "start_new_thread"),
+            monkey.get_original("_thread", "get_ident"),
+            monkey.get_original("time", "sleep"),
+        )
+    return _thread.start_new_thread, _thread.get_ident, time.sleep
+
+
+def get_frame_label(code: CodeType) -> str:
+    filename = code.co_filename
+    if filename.startswith(WS_DIR):
+        filename = os.path.relpath(filename, WS_DIR)
+    else:
+        filename = os.path.join(*filename.split(os.sep)[-2:])
+    # Semicolons separate frames in the collapsed format
+    return f"{code.co_qualname} ({filename}:{code.co_firstlineno})".replace(";", ":")
+
+
+class StackSampler:
+    """
+    Samples the stack of every thread at an interval from a thread of its own,
+    and counts each distinct stack in the collapsed format flamegraph.pl and
+    speedscope read. Nothing is installed in the threads being sampled, so
+    there is no cost outside of a profile.
+
+    Under gevent every greenlet shares the main thread, and each sample is of
+    whichever greenlet was running at the time.
+    """
+
+    def __init__(self, interval: float = DEFAULT_SAMPLE_INTERVAL):
+        self.interval = interval
+
+        self.stacks: Counter = Counter()
+        self.samples: int = 0
+        self.finished: bool = False
+        self.labels: Dict[CodeType, str] = {}
+        # Made on the thread running the event loop under gevent
+        _, get_ident, _ = get_native_thread_functions()
+        self.creator_ident: int = get_ident()
+
+    def _get_thread_names(self) -> Dict[int, str]:
+        if async_mode == "gevent":
+            # Thread objects are greenlets, their locks can't be taken from here
+            return {self.creator_ident: "MainThread"}
+        return {
+            thread.ident: thread.name
+            for thread in threading.enumerate()
+            if thread.ident is not None
+        }
+
+    def sample(self, own_ident: int) -> None:
+        thread_names = self._get_thread_names()
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+
+            stack: List[str] = []
+            current_frame: Optional[FrameType] = frame
+            while current_frame is not None:
+                code = current_frame.f_code
+                label = self.labels.get(code)
+                if label is None:
+                    label = self.labels[code] = get_frame_label(code)
+                stack.append(label)
+                current_frame = current_frame.f_back
+            stack.append(thread_names.get(ident, f"thread-{ident}"))
+            self.stacks[";".join(reversed(stack))] += 1
+        self.samples += 1
+
+    def run(self, duration: float) -> None:
+        _, get_ident, sleep = get_native_thread_functions()
+        own_ident = get_ident()
+        end_time = time.monotonic() + duration
+        try:
+            while time.monotonic() < end_time:
+                self.sample(own_ident)
+                sleep(self.interval)
+        finally:
+            self.finished = True
+
+    def get_collapsed(self) -> str:
+        return "\n".join(
+            f"{stack} {count}" for stack, count in self.stacks.most_common()
+        )
+
+
+def profile_threads(
+    duration: float, interval: float = DEFAULT_SAMPLE_INTERVAL
+) -> Optional[dict]:
+    """
+    Sample every thread for a while, get the collapsed stacks. None if a
+    profile is already running.
+    """
+    if not profile_lock.acquire(blocking=False):
+        return None
+    try:
+        duration = min(max(duration, interval), MAX_PROFILE_DURATION)
+        sampler = StackSampler(interval)
+        start_new_thread, _, _ = get_native_thread_functions()
+        start_new_thread(sampler.run, (duration,))
+        # A plain flag rather than an Event, which under gevent can't be set
+        # from a real thread
+        while not sampler.finished:
+            time.sleep(0.05)
+    finally:
+        profile_lock.release()
+
+    return {
+        "duration": duration,
+        "interval": interval,
+        "samples": sampler.samples,
+        "collapsed": sampler.get_collapsed(),
+    }
+
+
+def start_memory_tracing(frames: int = 1) -> bool:
+    """Start tracing allocations with tracemalloc, False if already tracing."""
+    if tracemalloc.is_tracing():
+        return False
+    tracemalloc.start(frames)
+    return True
+
+
+def stop_memory_tracing() -> bool:
+    global last_memory_snapshot
+
+    if not tracemalloc.is_tracing():
+        return False
+    tracemalloc.stop()
+    last_memory_snapshot = None
+    return True
+
+
+def format_statistic(statistic: tracemalloc.Statistic) -> dict:
+    return {
+        "location": [str(frame) for frame in statistic.traceback],
+        "size": statistic.size,
+        "count": statistic.count,
+    }
+
+
+def format_statistic_diff(statistic: tracemalloc.StatisticDiff) -> dict:
+    return {
+        **format_statistic(statistic),  # type: ignore[arg-type]
+        "size_diff": statistic.size_diff,
+        "count_diff": statistic.count_diff,
+    }
+
+
+def get_memory_statistics(
+    snapshot: tracemalloc.Snapshot,
+    previous_snapshot: Optional[tracemalloc.Snapshot],
+    group_by: str,
+    limit: int,
+) -> dict:
+    """
+    Get where the most memory still allocated since tracing started was
+    allocated, and what has grown the most since the previous snapshot.
+    """
+    snapshot = snapshot.filter_traces(
+        [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        ]
+    )
+    statistics = snapshot.statistics(group_by)
+    growth = (
+        snapshot.compare_to(previous_snapshot, group_by)
+        if previous_snapshot is not None
+        else []
+    )
+    return {
+        "top": [format_statistic(statistic) for statistic in statistics[:limit]],
+        "growth": [
+            format_statistic_diff(statistic)
+            for statistic in growth
+            if statistic.size_diff > 0
+        ][:limit],
+    }
+
+
+def take_memory_snapshot(group_by: str = "lineno", limit: int = 20) -> Optional[dict]:
+    """Snapshot the traced allocations, None if tracing hasn't been started."""
+    global last_memory_snapshot
+
+    if not tracemalloc.is_tracing():
+        return None
+    if group_by not in MEMORY_STATISTICS_GROUPS:
+        raise ValueError(f"Statistics can be grouped by {MEMORY_STATISTICS_GROUPS}")
+
+    snapshot = tracemalloc.take_snapshot()
+    previous_snapshot, last_memory_snapshot = last_memory_snapshot, snapshot
+    current, peak = tracemalloc.get_traced_memory()
+    return {
+        "traced_memory": current,
+        "peak_traced_memory": peak,
+        # Grouping a big snapshot takes a while, keep it off the event loop
+        **run_blocking(
+            get_memory_statistics, snapshot, previous_snapshot, group_by, limit
+        ),
+    }
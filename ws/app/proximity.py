@@ -0,0 +1,278 @@
+import logging
+import time
+from typing import TYPE_CHECKING, Callable, Dict, FrozenSet, List, Optional, Tuple
+
+import numpy as np
+
+from app.blocking import run_blocking
+
+if TYPE_CHECKING:
+    from app.radio_link import RadioLink
+
+EARTH_RADIUS = 6378137.0
+
+# Above this many vehicles the pairwise distance matrix is replaced with a
+# uniform grid spatial hash so only vehicles in neighbouring cells are compared
+SPATIAL_HASH_THRESHOLD = 100
+
+POSITION_TIMEOUT = 3.0
+ALERT_REPEAT_INTERVAL = 1.0
+
+# Neighbouring cells to compare against, only half of the 3x3 neighbourhood is
+# needed as every pair of cells is then visited exactly once
+_HALF_NEIGHBOURHOOD = [(0, 0), (1, -1), (1, 0), (1, 1), (0, 1)]
+
+
+class ProximityPairs:
+    def __init__(
+        self,
+        first: np.ndarray,
+        second: np.ndarray,
+        horizontal: np.ndarray,
+        vertical: np.ndarray,
+        closing_rate: np.ndarray,
+    ):
+        self.first = first
+        self.second = second
+        self.horizontal = horizontal
+        self.vertical = vertical
+        self.closing_rate = closing_rate
+
+    def __len__(self) -> int:
+        return len(self.first)
+
+
+def project_to_enu(
+    latitudes: np.ndarray,
+    longitudes: np.ndarray,
+    altitudes: np.ndarray,
+    origin_latitude: float,
+    origin_longitude: float,
+) -> np.ndarray:
+    """
+    Project geodetic positions onto a local east, north, up plane centred on
+    the origin. Accurate to well under a metre over the few kilometres a fleet
+    is spread across.
+    """
+    origin_lat_rad = np.radians(origin_latitude)
+    east = EARTH_RADIUS * np.radians(longitudes - origin_longitude)
+    east *= np.cos(origin_lat_rad)
+    north = EARTH_RADIUS * np.radians(latitudes - origin_latitude)
+    return np.column_stack((east, north, altitudes))
+
+
+def _candidate_pairs_brute_force(
+    positions: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray]:
+    return np.triu_indices(len(positions), k=1)
+
+
+def _candidate_pairs_spatial_hash(
+    positions: np.ndarray, cell_size: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Get every pair of vehicles in the same or neighbouring grid cells. Cells are
+    keyed into a sorted array so each neighbour lookup is a vectorised
+    searchsorted rather than a Python dictionary walk.
+    """
+    cells = np.floor(positions[:, :2] / cell_size).astype(np.int64)
+    cells -= cells.min(axis=0) - 1
+    stride = int(cells[:, 1].max()) + 2
+    keys = cells[:, 0] * stride + cells[:, 1]
+
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+
+    firsts: List[np.ndarray] = []
+    seconds: List[np.ndarray] = []
+    for dx, dy in _HALF_NEIGHBOURHOOD:
+        neighbour_keys = sorted_keys + dx * stride + dy
+        starts = np.searchsorted(sorted_keys, neighbour_keys, side="left")
+        ends = np.searchsorted(sorted_keys, neighbour_keys, side="right")
+
+        if dx == 0 and dy == 0:
+            # Only pair each vehicle with the ones after it in the same cell
+            starts = np.maximum(starts, np.arange(len(sorted_keys)) + 1)
+
+        counts = np.maximum(ends - starts, 0)
+        total = int(counts.sum())
+        if total == 0:
+            continue
+
+        first = np.repeat(np.arange(len(sorted_keys)), counts)
+        offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        second = np.repeat(starts, counts) + offsets
+
+        firsts.append(order[first])
+        seconds.append(order[second])
+
+    if not firsts:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+
+    return np.concatenate(firsts), np.concatenate(seconds)
+
+
+def find_close_pairs(
+    positions: np.ndarray,
+    velocities: np.ndarray,
+    horizontal_separation: float,
+    vertical_separation: float,
+    use_spatial_hash: Optional[bool] = None,
+) -> ProximityPairs:
+    """
+    Find every pair of vehicles closer than the given separations.
+
+    Positions and velocities are (n, 3) arrays in a local east, north, up frame.
+    The closing rate is positive when the vehicles are getting closer together.
+    """
+    if use_spatial_hash is None:
+        use_spatial_hash = len(positions) > SPATIAL_HASH_THRESHOLD
+
+    if use_spatial_hash:
+        first, second = _candidate_pairs_spatial_hash(positions, horizontal_separation)
+    else:
+        first, second = _candidate_pairs_brute_force(positions)
+
+    offsets = positions[second] - positions[first]
+    horizontal = np.hypot(offsets[:, 0], offsets[:, 1])
+    vertical = np.abs(offsets[:, 2])
+
+    close = (horizontal < horizontal_separation) & (vertical < vertical_separation)
+    first, second, offsets = first[close], second[close], offsets[close]
+    horizontal, vertical = horizontal[close], vertical[close]
+
+    relative_velocities = velocities[second] - velocities[first]
+    distances = np.maximum(np.linalg.norm(offsets, axis=1), 1e-6)
+    closing_rate = -np.einsum("ij,ij->i", offsets, relative_velocities) / distances
+
+    return ProximityPairs(first, second, horizontal, vertical, closing_rate)
+
+
+class ProximityMonitor:
+    def __init__(
+        self,
+        radio_link: "RadioLink",
+        alert_callback: Optional[Callable] = None,
+        horizontal_separation: float = 10.0,
+        vertical_separation: float = 5.0,
+        rate: float = 10.0,
+    ):
+        self.logger = logging.getLogger("proximity")
+
+        self.radio_link = radio_link
+        self.alert_callback = alert_callback
+        self.horizontal_separation = horizontal_separation
+        self.vertical_separation = vertical_separation
+        self.rate = rate
+
+        self.active_conflicts: Dict[FrozenSet[int], dict] = {}
+        self._last_alert_time = 0.0
+
+    def _get_fleet_state(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        now = time.time()
+        vehicles = [
+            vehicle
+            for vehicle in list(self.radio_link.vehicles.values())
+            if vehicle.last_position_time is not None
+            and now - vehicle.last_position_time < POSITION_TIMEOUT
+        ]
+
+        system_ids = np.fromiter(
+            (vehicle.system_id for vehicle in vehicles), dtype=np.int64
+        )
+        state = np.array(
+            [
+                (
+                    vehicle.latitude,
+                    vehicle.longitude,
+                    # Relative altitudes are from each vehicle's own home,
+                    # which can be at different heights
+                    vehicle.msl_altitude,
+                    vehicle.velocity_east,
+                    vehicle.velocity_north,
+                    -vehicle.velocity_down,
+                )
+                for vehicle in vehicles
+            ],
+            dtype=np.float64,
+        ).reshape(-1, 6)
+
+        if len(state) == 0:
+            return system_ids, np.empty((0, 3)), np.empty((0, 3))
+
+        positions = project_to_enu(
+            state[:, 0],
+            state[:, 1],
+            state[:, 2],
+            float(state[:, 0].mean()),
+            float(state[:, 1].mean()),
+        )
+        return system_ids, positions, state[:, 3:]
+
+    def check(self) -> List[dict]:
+        """Run one proximity check over the fleet and return the current conflicts."""
+        system_ids, positions, velocities = self._get_fleet_state()
+        if len(system_ids) < 2:
+            return []
+
+        pairs = run_blocking(
+            find_close_pairs,
+            positions,
+            velocities,
+            self.horizontal_separation,
+            self.vertical_separation,
+        )
+
+        return [
+            {
+                "system_ids": sorted(
+                    (int(system_ids[pairs.first[i]]), int(system_ids[pairs.second[i]]))
+                ),
+                "horizontal_separation": round(float(pairs.horizontal[i]), 2),
+                "vertical_separation": round(float(pairs.vertical[i]), 2),
+                "closing_rate": round(float(pairs.closing_rate[i]), 2),
+            }
+            for i in range(len(pairs))
+        ]
+
+    def _update_alerts(self, conflicts: List[dict]) -> None:
+        conflicts_by_pair = {
+            frozenset(conflict["system_ids"]): conflict for conflict in conflicts
+        }
+        cleared = [
+            sorted(pair)
+            for pair in self.active_conflicts
+            if pair not in conflicts_by_pair
+        ]
+        changed = cleared or any(
+            pair not in self.active_conflicts for pair in conflicts_by_pair
+        )
+        self.active_conflicts = conflicts_by_pair
+
+        now = time.time()
+        repeat_due = conflicts and now - self._last_alert_time > ALERT_REPEAT_INTERVAL
+        if not (changed or repeat_due):
+            return
+
+        self._last_alert_time = now
+        if conflicts and changed:
+            self.logger.warning(
+                f"Proximity conflicts: {[conflict['system_ids'] for conflict in conflicts]}"
+            )
+
+        if self.alert_callback:
+            self.alert_callback(
+                {"success": True, "data": {"conflicts": conflicts, "cleared": cleared}}
+            )
+
+    def run(self) -> None:
+        interval = 1 / self.rate
+        while self.radio_link.is_active.is_set():
+            start_time = time.time()
+            try:
+                self._update_alerts(self.check())
+            except Exception:
+                self.logger.exception("Failed to run proximity check")
+
+            time.sleep(max(interval - (time.time() - start_time), 0))
@@ -3,16 +3,36 @@ import threading
 import time
 import traceback
 from queue import Empty, Queue
-from typing import Callable, Dict, Optional, Set
+from typing import Callable, Dict, List, Optional, Sequence, Set, Union
 
+import numpy as np
 import serial
 from pymavlink import mavutil
 from pymavlink.mavutil import mavlink
 
+from app.alerts import AlertEngine
+from app.archive import DEFAULT_ARCHIVE_DIR, TelemetryArchive
+from app.blocking import run_blocking
+from app.control import ControlIngress
+from app.endurance import EnduranceMonitor
+from app.formation import FormationShape, get_formation_offsets, plan_formation
+from app.forwarding import ForwardOutputSettings, MavlinkForwarder
+from app.latency import LatencyMonitor
+from app.mission import MissionItem, MissionUploader, check_mission
+from app.outbound import OutboundWriter
+from app.params import ParamManager
+from app.proximity import POSITION_TIMEOUT, ProximityMonitor
+from app.setpoints import SETPOINT_LINK_SHARE, SetpointStreamer
+from app.snapshot import FleetSnapshot
+from app.spatial_index import SpatialIndex
+from app.stream_rates import VEHICLE_TIMEOUT, StreamRateManager
 from app.types import Response, VehicleType
 from app.utils import command_accepted, get_vehicle_type_from_heartbeat
 from app.vehicle import Vehicle
 
+RECONNECT_INITIAL_DELAY = 0.5
+RECONNECT_MAX_DELAY = 10.0
+
 
 class RadioLink:
     def __init__(
@@ -20,28 +40,28 @@ class RadioLink:
         port: str,
         baud: int = 57600,
         initial_heartbeat_update_callback: Optional[Callable] = None,
+        link_capacity: Optional[int] = None,
+        proximity_alert_callback: Optional[Callable] = None,
+        archive_dir: Optional[str] = DEFAULT_ARCHIVE_DIR,
+        link_lost_callback: Optional[Callable] = None,
+        link_restored_callback: Optional[Callable] = None,
+        alert_callback: Optional[Callable] = None,
+        endurance_callback: Optional[Callable] = None,
+        control_address: Optional[Union[int, str]] = None,
+        forward_outputs: Optional[List[ForwardOutputSettings]] = None,
     ):
         self.logger = logging.getLogger("radio_link")
 
         self.port = port
         self.baud = baud
         self.initial_heartbeat_update_callback = initial_heartbeat_update_callback
+        self.link_lost_callback = link_lost_callback
+        self.link_restored_callback = link_restored_callback
 
         self.logger.info(f"Initialising radio link on {self.port}:{self.baud}")
 
-        self.master: Optional[mavutil.mavserial] = None
-        try:
-            self.master = mavutil.mavlink_connection(
-                self.port,
-                baud=self.baud,
-                source_system=255,
-                source_component=mavlink.MAV_COMP_ID_MISSIONPLANNER,
-            )
-        except Exception:
-            self.logger.exception(traceback.format_exc())
-            if self.master:
-                self.master.close()
-            self.master = None
+        self.master: Optional[mavutil.mavserial] = self._open_connection()
+        if self.master is None:
             return
 
         self.vehicles: Dict = {}
@@ -56,17 +76,61 @@ class RadioLink:
         self.message_listeners: Dict[str, Callable] = {}
         self.message_queue: Queue = Queue()
 
-        self.sending_command_lock: threading.Lock = threading.Lock()
-        self.sending_command_queue: Queue = Queue()
+        # Every write to the port goes through the outbound writer's thread
+        self.outbound = OutboundWriter(self)
+        self.outbound.install(self.master.mav)
 
         self.reserved_messages: Set[str] = set()
+        self.reservation_owners: Dict[str, str] = {}
         self.controller_queues: Dict[str, Queue] = {}
         self.reservation_lock = threading.Lock()
         self.controller_id = f"radio_link_{threading.current_thread().ident}"
 
+        self.bytes_received: int = 0
+        self.spatial_index = SpatialIndex()
+        self.fleet_snapshot = FleetSnapshot(self)
+        self.latency_monitor = LatencyMonitor(self)
+        self.archive = (
+            TelemetryArchive(self, archive_dir) if archive_dir is not None else None
+        )
+
+        # Serial radios carry roughly baud / 10 bytes per second once start and
+        # stop bits are taken into account
+        if link_capacity is None:
+            link_capacity = self.baud // 10
+        self.stream_rate_manager = StreamRateManager(self, link_capacity)
+        self.setpoint_streamer = SetpointStreamer(
+            self, link_capacity * SETPOINT_LINK_SHARE
+        )
+        self.proximity_monitor = ProximityMonitor(self, proximity_alert_callback)
+        self.alert_engine = AlertEngine(self, alert_callback)
+        self.endurance_monitor = EnduranceMonitor(self, endurance_callback)
+        self.param_manager = ParamManager(self)
+
+        # A UDP port on the loopback interface or a Unix socket path for
+        # controllers on this machine to send setpoints and commands to
+        self.control_ingress: Optional[ControlIngress] = None
+        if control_address is not None:
+            try:
+                self.control_ingress = ControlIngress(self, control_address)
+            except (OSError, ValueError):
+                self.logger.error(
+                    f"Could not open control ingress on {control_address}",
+                    exc_info=True,
+                )
+
         self.is_active: threading.Event = threading.Event()
         self.is_active.set()
 
+        # Other ground stations sharing the link, instead of mavproxy
+        self.forwarder = MavlinkForwarder(self)
+        for output in forward_outputs or []:
+            result = self.forwarder.add_output(
+                output["address"], output.get("system_ids")
+            )
+            if not result["success"]:
+                self.logger.error(result["message"])
+
         self.handle_incoming_messages_thread = threading.Thread(
             target=self._handle_incoming_messages, daemon=True
         )
@@ -76,8 +140,102 @@ class RadioLink:
         self.execute_message_listeners_thread = threading.Thread(
             target=self._execute_message_listeners, daemon=True
         )
+        self.manage_stream_rates_thread = threading.Thread(
+            target=self.stream_rate_manager.run, daemon=True
+        )
+        self.monitor_proximity_thread = threading.Thread(
+            target=self.proximity_monitor.run, daemon=True
+        )
+        self.write_outbound_thread = threading.Thread(
+            target=self.outbound.run, daemon=True
+        )
+        self.monitor_latency_thread = threading.Thread(
+            target=self.latency_monitor.run, daemon=True
+        )
+        self.monitor_alerts_thread = threading.Thread(
+            target=self.alert_engine.run, daemon=True
+        )
+        self.monitor_endurance_thread = threading.Thread(
+            target=self.endurance_monitor.run, daemon=True
+        )
+        self.stream_setpoints_thread = threading.Thread(
+            target=self.setpoint_streamer.run, daemon=True
+        )
+        self.control_ingress_thread = (
+            threading.Thread(target=self.control_ingress.run, daemon=True)
+            if self.control_ingress is not None
+            else None
+        )
+        self.run_control_commands_thread = (
+            threading.Thread(target=self.control_ingress.run_commands, daemon=True)
+            if self.control_ingress is not None
+            else None
+        )
+        self.write_archive_thread = (
+            threading.Thread(target=self.archive.run, daemon=True)
+            if self.archive is not None
+            else None
+        )
         self._start_threads()
 
+    def _open_connection(self) -> Optional[mavutil.mavserial]:
+        try:
+            return mavutil.mavlink_connection(
+                self.port,
+                baud=self.baud,
+                source_system=255,
+                source_component=mavlink.MAV_COMP_ID_MISSIONPLANNER,
+            )
+        except Exception:
+            self.logger.exception(traceback.format_exc())
+            return None
+
+    def _wait_while_active(self, timeout: float) -> None:
+        end_time = time.monotonic() + timeout
+        while self.is_active.is_set() and time.monotonic() < end_time:
+            time.sleep(min(0.1, end_time - time.monotonic()))
+
+    def _reconnect(self) -> bool:
+        """
+        Reopen the port after it has failed, backing off between attempts.
+        The vehicles, listeners and everything else on the link are kept, so
+        telemetry picks up where it left off once the port is back.
+        """
+        lost_time = time.time()
+        self.outbound.disconnect()
+        if self.master is not None:
+            try:
+                self.master.close()
+            except Exception:
+                pass
+        if self.link_lost_callback:
+            self.link_lost_callback({"port": self.port, "time": lost_time})
+
+        delay = RECONNECT_INITIAL_DELAY
+        attempt = 0
+        while self.is_active.is_set():
+            self._wait_while_active(delay)
+            if not self.is_active.is_set():
+                break
+
+            attempt += 1
+            self.logger.info(f"Reconnecting to {self.port}, attempt {attempt}")
+            master = self._open_connection()
+            if master is None:
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+                continue
+
+            self.master = master
+            self.outbound.install(master.mav)
+            downtime = time.time() - lost_time
+            self.logger.info(f"Reconnected to {self.port} after {downtime:.1f}s")
+            if self.link_restored_callback:
+                self.link_restored_callback(
+                    {"port": self.port, "attempts": attempt, "downtime": downtime}
+                )
+            return True
+        return False
+
     def _listen_for_initial_heartbeats(self, timeout: int) -> bool:
         self.logger.info(f"Listening for initial heartbeats for {timeout} seconds")
         start_time = time.time()
@@ -137,8 +295,21 @@ class RadioLink:
 
     def _start_threads(self) -> None:
         self.handle_incoming_messages_thread.start()
+        self.write_outbound_thread.start()
         self.send_heartbeats_out_thread.start()
         self.execute_message_listeners_thread.start()
+        self.manage_stream_rates_thread.start()
+        self.monitor_proximity_thread.start()
+        self.monitor_latency_thread.start()
+        self.monitor_alerts_thread.start()
+        self.monitor_endurance_thread.start()
+        self.stream_setpoints_thread.start()
+        if self.write_archive_thread is not None:
+            self.write_archive_thread.start()
+        if self.control_ingress_thread is not None:
+            self.control_ingress_thread.start()
+        if self.run_control_commands_thread is not None:
+            self.run_control_commands_thread.start()
 
     def add_message_listener(self, message_id: str, callback: Callable) -> bool:
         if message_id not in self.message_listeners:
@@ -162,9 +333,14 @@ class RadioLink:
                 msg = self.master.recv_match(blocking=True)
             except KeyboardInterrupt:
                 break
-            except (serial.serialutil.SerialException, ConnectionAbortedError):
+            except (serial.serialutil.SerialException, OSError):
+                if not self.is_active.is_set():
+                    # The port was closed under us by close()
+                    break
                 self.logger.error("Radio link disconnected", exc_info=True)
-                break
+                if not self._reconnect():
+                    break
+                continue
             except Exception:
                 self.logger.exception(traceback.format_exc())
                 continue
@@ -172,7 +348,12 @@ class RadioLink:
             if msg is None:
                 continue
 
+            buffer = msg.get_msgbuf()
+            self.bytes_received += len(buffer)
+
             msg_src_system = msg.get_srcSystem()
+            if self.forwarder.outputs and msg.get_type() != "BAD_DATA":
+                self.forwarder.forward(msg_src_system, buffer)
             # msg_src_component = msg.get_srcComponent()
 
             if msg_src_system not in self.vehicles:
@@ -181,23 +362,61 @@ class RadioLink:
             vehicle = self.vehicles[msg_src_system]
 
             msg_name = msg.get_type()
+            # Kept on the message so the telemetry sent out can say how old it is
+            msg._link_latency = self.latency_monitor.record_message(msg_src_system, msg)
+            self.fleet_snapshot.update(msg_src_system, msg_name, msg)
+            self.alert_engine.update(msg_src_system, msg_name, msg)
+            if self.archive is not None:
+                self.archive.append(msg_src_system, msg_name, msg)
 
             if msg_name == "TIMESYNC":
-                component_timestamp = msg.ts1
-                local_timestamp = time.time_ns()
-                self.master.mav.timesync_send(local_timestamp, component_timestamp)
+                if msg.tc1 == 0:
+                    # A request from the vehicle, stamp it with our time
+                    self.master.mav.timesync_send(time.time_ns(), msg.ts1)
+                else:
+                    self.latency_monitor.handle_timesync(msg_src_system, msg)
                 continue
             elif msg_name == "STATUSTEXT":
-                self.logger.info(f"{msg_src_system}: {msg.text}")
+                # Skip building the string at all when it would be filtered out
+                if self.logger.isEnabledFor(logging.INFO):
+                    # Rate limited per vehicle so one chatty vehicle can't
+                    # drown out the rest
+                    self.logger.info(
+                        f"{msg_src_system}: {msg.text}",
+                        extra={"rate_limit_key": msg_src_system},
+                    )
             elif msg_name == "HEARTBEAT":
                 vehicle.handle_heartbeat(msg)
             elif msg_name == "VFR_HUD":
                 vehicle.handle_vfr_hud(msg)
+            elif msg_name == "GLOBAL_POSITION_INT":
+                vehicle.handle_global_position_int(msg)
+                # 0,0 until the vehicle has a fix
+                if msg.lat != 0 or msg.lon != 0:
+                    self.spatial_index.update(
+                        msg_src_system, vehicle.latitude, vehicle.longitude
+                    )
+            elif msg_name == "SYS_STATUS":
+                vehicle.handle_sys_status(msg)
+                self.endurance_monitor.record(vehicle)
+            elif msg_name == "BATTERY_STATUS":
+                vehicle.handle_battery_status(msg)
+                self.endurance_monitor.record(vehicle)
+            elif msg_name == "HOME_POSITION":
+                vehicle.handle_home_position(msg)
+            elif (
+                msg_name == "COMMAND_ACK"
+                and msg.command == mavlink.MAV_CMD_SET_MESSAGE_INTERVAL
+            ):
+                self.stream_rate_manager.handle_command_ack(msg_src_system, msg)
 
             with self.reservation_lock:
                 if msg_name in self.reserved_messages:
-                    # Route to controller queues
-                    for controller_id, queue in self.controller_queues.items():
+                    # Route to the queue of the controller that reserved it
+                    queue = self.controller_queues.get(
+                        self.reservation_owners[msg_name]
+                    )
+                    if queue is not None:
                         try:
                             queue.put((msg_name, msg), block=False)
                         except Exception:
@@ -220,8 +439,20 @@ class RadioLink:
                 )
             except Exception as e:
                 self.logger.error(f"Failed to send heartbeat: {e}", exc_info=True)
+            self._remove_lost_vehicles_from_index()
             time.sleep(1)
 
+    def _remove_lost_vehicles_from_index(self) -> None:
+        """
+        Take vehicles whose heartbeat has timed out out of the spatial index,
+        so queries don't keep finding them where they were last seen.
+        """
+        now = time.time()
+        for system_id in list(self.spatial_index.positions):
+            vehicle = self.vehicles.get(system_id)
+            if vehicle is None or now - vehicle.last_heartbeat_time >= VEHICLE_TIMEOUT:
+                self.spatial_index.remove(system_id)
+
     def _execute_message_listeners(self) -> None:
         while self.is_active.is_set():
             try:
@@ -239,6 +470,16 @@ class RadioLink:
             getattr(self, "handle_incoming_messages_thread", None),
             getattr(self, "send_heartbeats_out_thread", None),
             getattr(self, "execute_message_listeners_thread", None),
+            getattr(self, "manage_stream_rates_thread", None),
+            getattr(self, "monitor_proximity_thread", None),
+            getattr(self, "monitor_latency_thread", None),
+            getattr(self, "monitor_alerts_thread", None),
+            getattr(self, "monitor_endurance_thread", None),
+            getattr(self, "stream_setpoints_thread", None),
+            getattr(self, "write_outbound_thread", None),
+            getattr(self, "write_archive_thread", None),
+            getattr(self, "control_ingress_thread", None),
+            getattr(self, "run_control_commands_thread", None),
         ]:
             if thread is not None and thread.is_alive() and thread is not this_thread:
                 thread.join(timeout=3)
@@ -249,6 +490,7 @@ class RadioLink:
                 return False
 
             self.reserved_messages.add(message_id)
+            self.reservation_owners[message_id] = controller_id
             if controller_id not in self.controller_queues:
                 self.controller_queues[controller_id] = Queue()
 
@@ -257,6 +499,7 @@ class RadioLink:
     def release_message_type(self, message_id: str, controller_id: str) -> None:
         with self.reservation_lock:
             self.reserved_messages.discard(message_id)
+            self.reservation_owners.pop(message_id, None)
 
             # Clear any remaining messages in the controllers queue for this type,
             # easiest way is just to create a new, empty queue
@@ -296,6 +539,12 @@ class RadioLink:
         )
         return None
 
+    def get_control_status(self) -> Optional[dict]:
+        """Get the control ingress's status, None if it isn't open."""
+        if self.control_ingress is None:
+            return None
+        return self.control_ingress.get_status()
+
     def get_vehicles(self) -> list:
         return [vehicle.serialize() for vehicle in self.vehicles.values()]
 
@@ -363,13 +612,16 @@ class RadioLink:
                 response, mavutil.mavlink.MAV_CMD_COMPONENT_ARM_DISARM, self.logger
             ):
                 # Wait for the vehicle to be armed fully after the command has been accepted
-                self.logger.debug(f"[{system_id}] Waiting for arm")
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    self.logger.debug(f"[{system_id}] Waiting for arm")
                 while not self.vehicles[system_id].armed:
                     time.sleep(0.05)
-                self.logger.debug(f"[{system_id}] ARMED")
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    self.logger.debug(f"[{system_id}] ARMED")
                 return {"success": True, "message": "Armed successfully"}
             else:
-                self.logger.debug(f"[{system_id}] Arming failed")
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    self.logger.debug(f"[{system_id}] Arming failed")
                 return {
                     "success": False,
                     "message": "Could not arm, command not accepted",
@@ -441,13 +693,16 @@ class RadioLink:
                 response, mavutil.mavlink.MAV_CMD_COMPONENT_ARM_DISARM, self.logger
             ):
                 # Wait for the vehicle to be disarmed fully after the command has been accepted
-                self.logger.debug(f"[{system_id}] Waiting for disarm")
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    self.logger.debug(f"[{system_id}] Waiting for disarm")
                 while self.vehicles[system_id].armed:
                     time.sleep(0.05)
-                self.logger.debug(f"[{system_id}] DISARMED")
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    self.logger.debug(f"[{system_id}] DISARMED")
                 return {"success": True, "message": "Disarmed successfully"}
             else:
-                self.logger.debug(f"[{system_id}] Disarming failed")
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    self.logger.debug(f"[{system_id}] Disarming failed")
                 return {
                     "success": False,
                     "message": "Could not disarm, command not accepted",
@@ -539,13 +794,15 @@ class RadioLink:
             if command_accepted(
                 response, mavutil.mavlink.MAV_CMD_NAV_TAKEOFF, self.logger
             ):
-                self.logger.debug(f"[{system_id}] Copter takeoff command accepted")
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    self.logger.debug(f"[{system_id}] Copter takeoff command accepted")
                 return {
                     "success": True,
                     "message": "Copter takeoff command sent successfully",
                 }
             else:
-                self.logger.debug(f"[{system_id}] Copter takeoff command failed")
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    self.logger.debug(f"[{system_id}] Copter takeoff command failed")
                 return {
                     "success": False,
                     "message": "Could not takeoff copter, command not accepted",
@@ -560,6 +817,60 @@ class RadioLink:
         finally:
             self.release_message_type("COMMAND_ACK", self.controller_id)
 
+    def _get_guided_mode_number(self, vehicle: Vehicle) -> Optional[int]:
+        return next(
+            (key for key, val in vehicle.flight_mode_map.items() if val == "GUIDED"),
+            None,
+        )
+
+    def _send_position_target(
+        self, vehicle: Vehicle, latitude: float, longitude: float, altitude: float
+    ) -> None:
+        if self.master is None:
+            return
+
+        # Convert lat/lon from degrees to degrees * 1e7 (int32)
+        lat_int = int(latitude * 1e7)
+        lon_int = int(longitude * 1e7)
+
+        if vehicle.vehicle_type == VehicleType.PLANE:
+            self.master.mav.mission_item_int_send(
+                vehicle.system_id,
+                mavlink.MAV_COMP_ID_AUTOPILOT1,
+                0,  # seq
+                mavutil.mavlink.MAV_FRAME_GLOBAL_RELATIVE_ALT_INT,
+                mavutil.mavlink.MAV_CMD_NAV_WAYPOINT,
+                2,  # current=2 means guided mode target, doesn't overwrite mission
+                1,  # Autocontinue to next waypoint. 0: false, 1: true.
+                0,  # param1 (hold time)
+                0,  # param2 (acceptance radius)
+                0,  # param3 (pass through waypoint)
+                float("nan"),  # param4 (desired yaw angle)
+                lat_int,
+                lon_int,
+                altitude,  # altitude in meters
+                mavutil.mavlink.MAV_MISSION_TYPE_MISSION,
+            )
+        else:
+            self.master.mav.set_position_target_global_int_send(
+                0,  # time_boot_ms (not used)
+                vehicle.system_id,  # target system
+                mavlink.MAV_COMP_ID_AUTOPILOT1,  # target component
+                mavlink.MAV_FRAME_GLOBAL_RELATIVE_ALT_INT,  # coordinate frame
+                65016,  # type mask, ignore all values except x, y, z
+                lat_int,  # latitude (degrees * 1e7)
+                lon_int,  # longitude (degrees * 1e7)
+                altitude,  # altitude (meters, relative)
+                0,  # vx (not used)
+                0,  # vy (not used)
+                0,  # vz (not used)
+                0,  # afx (not used)
+                0,  # afy (not used)
+                0,  # afz (not used)
+                0,  # yaw (not used)
+                0,  # yaw_rate (not used)
+            )
+
     def goto_position(
         self, system_id: int, latitude: float, longitude: float, altitude: float
     ) -> Response:
@@ -584,14 +895,7 @@ class RadioLink:
                 }
 
             # Set vehicle to guided mode
-            guided_mode_number = next(
-                (
-                    key
-                    for key, val in target_vehicle.flight_mode_map.items()
-                    if val == "GUIDED"
-                ),
-                None,
-            )
+            guided_mode_number = self._get_guided_mode_number(target_vehicle)
 
             if guided_mode_number is None:
                 return {
@@ -599,70 +903,199 @@ class RadioLink:
                     "message": f"Could not find GUIDED mode for vehicle {system_id}",
                 }
 
-            set_guided_mode_res = self.set_vehicle_flight_mode(
-                system_id, guided_mode_number
-            )
+            if target_vehicle.flight_mode != guided_mode_number:
+                set_guided_mode_res = self.set_vehicle_flight_mode(
+                    system_id, guided_mode_number
+                )
 
-            if not set_guided_mode_res.get("success"):
-                return set_guided_mode_res
+                if not set_guided_mode_res.get("success"):
+                    return set_guided_mode_res
+
+            self._send_position_target(target_vehicle, latitude, longitude, altitude)
+
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug(
+                    f"[{system_id}] Sent goto position command: "
+                    f"lat={latitude}, lon={longitude}, alt={altitude}m (relative)"
+                )
 
-            # Convert lat/lon from degrees to degrees * 1e7 (int32)
-            lat_int = int(latitude * 1e7)
-            lon_int = int(longitude * 1e7)
+            return {
+                "success": True,
+                "message": f"Set guided position target for vehicle {system_id}",
+            }
 
-            if target_vehicle.vehicle_type == VehicleType.PLANE:
-                self.master.mav.mission_item_int_send(
+        except Exception as e:
+            self.logger.error(e, exc_info=True)
+            return {
+                "success": False,
+                "message": f"Could not set guided position target: {str(e)}",
+            }
+
+    def _set_vehicles_to_guided_mode(
+        self, system_ids: List[int], timeout: float = 3.0
+    ) -> List[int]:
+        """
+        Put a group of vehicles into GUIDED mode, skipping any that are already
+        in it. The mode commands are all sent before waiting for any ACKs so
+        the wait is one round trip rather than one per vehicle. Returns the
+        system IDs of the vehicles that could not be switched.
+        """
+        pending: Dict[int, int] = {}
+        failed_vehicles = []
+        for system_id in system_ids:
+            vehicle = self.vehicles[system_id]
+            guided_mode_number = self._get_guided_mode_number(vehicle)
+            if guided_mode_number is None:
+                failed_vehicles.append(system_id)
+            elif vehicle.flight_mode != guided_mode_number:
+                pending[system_id] = guided_mode_number
+
+        if not pending:
+            return failed_vehicles
+
+        if not self.reserve_message_type("COMMAND_ACK", self.controller_id):
+            return failed_vehicles + list(pending.keys())
+
+        try:
+            for system_id, guided_mode_number in pending.items():
+                self.send_command_to_vehicle(
                     system_id,
-                    mavlink.MAV_COMP_ID_AUTOPILOT1,
-                    0,  # seq
-                    mavutil.mavlink.MAV_FRAME_GLOBAL_RELATIVE_ALT_INT,
-                    mavutil.mavlink.MAV_CMD_NAV_WAYPOINT,
-                    2,  # current=2 means guided mode target, doesn't overwrite mission
-                    1,  # Autocontinue to next waypoint. 0: false, 1: true.
-                    0,  # param1 (hold time)
-                    0,  # param2 (acceptance radius)
-                    0,  # param3 (pass through waypoint)
-                    float("nan"),  # param4 (desired yaw angle)
-                    lat_int,
-                    lon_int,
-                    altitude,  # altitude in meters
-                    mavutil.mavlink.MAV_MISSION_TYPE_MISSION,
+                    mavlink.MAV_CMD_DO_SET_MODE,
+                    param1=1,
+                    param2=guided_mode_number,
                 )
-            else:
-                self.master.mav.set_position_target_global_int_send(
-                    0,  # time_boot_ms (not used)
-                    system_id,  # target system
-                    mavlink.MAV_COMP_ID_AUTOPILOT1,  # target component
-                    mavlink.MAV_FRAME_GLOBAL_RELATIVE_ALT_INT,  # coordinate frame
-                    65016,  # type mask, ignore all values except x, y, z
-                    lat_int,  # latitude (degrees * 1e7)
-                    lon_int,  # longitude (degrees * 1e7)
-                    altitude,  # altitude (meters, relative)
-                    0,  # vx (not used)
-                    0,  # vy (not used)
-                    0,  # vz (not used)
-                    0,  # afx (not used)
-                    0,  # afy (not used)
-                    0,  # afz (not used)
-                    0,  # yaw (not used)
-                    0,  # yaw_rate (not used)
+
+            start_time = time.time()
+            while pending and time.time() - start_time < timeout:
+                response = self.wait_for_message(
+                    "COMMAND_ACK",
+                    self.controller_id,
+                    timeout=timeout - (time.time() - start_time),
+                    conditional_func=lambda msg: (msg.get_srcSystem() in pending)
+                    and (msg.command == mavutil.mavlink.MAV_CMD_DO_SET_MODE),
+                )
+                if response is None:
+                    break
+
+                system_id = response.get_srcSystem()
+                del pending[system_id]
+                if not command_accepted(
+                    response, mavutil.mavlink.MAV_CMD_DO_SET_MODE, self.logger
+                ):
+                    failed_vehicles.append(system_id)
+        finally:
+            self.release_message_type("COMMAND_ACK", self.controller_id)
+
+        return failed_vehicles + list(pending.keys())
+
+    def formation_goto(
+        self,
+        system_ids: List[int],
+        latitude: float,
+        longitude: float,
+        altitude: float,
+        heading: float,
+        shape: FormationShape,
+        spacing: float,
+        custom_offsets: Optional[Sequence[Sequence[float]]] = None,
+    ) -> Response:
+        """
+        Send a group of vehicles into a formation around an anchor point.
+        Every vehicle's slot is worked out in one go, vehicles are assigned to
+        slots to minimise the total distance travelled, then all the position
+        targets are sent in one pass.
+        """
+        try:
+            if self.master is None:
+                return {
+                    "success": False,
+                    "message": "Not connected to radio link",
+                }
+            if not system_ids:
+                return {"success": False, "message": "No vehicles given for formation"}
+            # A vehicle listed twice would get two slots
+            system_ids = list(dict.fromkeys(system_ids))
+
+            # Vehicles without a fix, or that lost it, have no position to
+            # plan from
+            now = time.time()
+            missing_vehicles = [
+                system_id
+                for system_id in system_ids
+                if system_id not in self.vehicles
+                or self.vehicles[system_id].last_position_time is None
+                or now - self.vehicles[system_id].last_position_time >= POSITION_TIMEOUT
+            ]
+            if missing_vehicles:
+                return {
+                    "success": False,
+                    "message": f"No position known for vehicles {missing_vehicles}",
+                }
+
+            offsets = get_formation_offsets(
+                shape, len(system_ids), spacing, custom_offsets
+            )
+            current_positions = np.array(
+                [
+                    (
+                        self.vehicles[system_id].latitude,
+                        self.vehicles[system_id].longitude,
+                    )
+                    for system_id in system_ids
+                ]
+            ).reshape(-1, 2)
+            targets = run_blocking(
+                plan_formation,
+                current_positions,
+                latitude,
+                longitude,
+                altitude,
+                heading,
+                offsets,
+            )
+
+            failed_vehicles = self._set_vehicles_to_guided_mode(system_ids)
+
+            assignments = []
+            for system_id, (target_lat, target_lon, target_alt) in zip(
+                system_ids, targets.tolist()
+            ):
+                if system_id in failed_vehicles:
+                    continue
+                self._send_position_target(
+                    self.vehicles[system_id], target_lat, target_lon, target_alt
+                )
+                assignments.append(
+                    {
+                        "system_id": system_id,
+                        "latitude": target_lat,
+                        "longitude": target_lon,
+                        "altitude": target_alt,
+                    }
                 )
 
             self.logger.debug(
-                f"[{system_id}] Sent goto position command: "
-                f"lat={latitude}, lon={longitude}, alt={altitude}m (relative)"
+                f"Sent {shape.value} formation targets to {len(assignments)} vehicles"
             )
 
+            if failed_vehicles:
+                return {
+                    "success": False,
+                    "message": f"Could not set GUIDED mode on {len(failed_vehicles)} vehicles",
+                    "data": {"targets": assignments},
+                }
+
             return {
                 "success": True,
-                "message": f"Set guided position target for vehicle {system_id}",
+                "message": f"Sent formation targets to {len(assignments)} vehicles",
+                "data": {"targets": assignments},
             }
 
         except Exception as e:
             self.logger.error(e, exc_info=True)
             return {
                 "success": False,
-                "message": f"Could not set guided position target: {str(e)}",
+                "message": f"Could not send formation targets: {str(e)}",
             }
 
     def set_vehicle_flight_mode(self, system_id: int, new_flight_mode: int) -> Response:
@@ -707,17 +1140,19 @@ class RadioLink:
             if command_accepted(
                 response, mavutil.mavlink.MAV_CMD_DO_SET_MODE, self.logger
             ):
-                self.logger.debug(
-                    f"[{system_id}] Flight mode set to {new_flight_mode_string}"
-                )
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    self.logger.debug(
+                        f"[{system_id}] Flight mode set to {new_flight_mode_string}"
+                    )
                 return {
                     "success": True,
                     "message": f"Flight mode set successfully to {new_flight_mode_string}",
                 }
             else:
-                self.logger.debug(
-                    f"[{system_id}] Could not set flight mode to {new_flight_mode_string}"
-                )
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    self.logger.debug(
+                        f"[{system_id}] Could not set flight mode to {new_flight_mode_string}"
+                    )
                 return {
                     "success": False,
                     "message": f"Could not set flight mode to {new_flight_mode_string}, command not accepted",
@@ -769,12 +1204,167 @@ class RadioLink:
                 "message": f"Could not set flight mode to {new_flight_mode_str} on all vehicles, {e}",
             }
 
+    def upload_missions(
+        self,
+        missions: Dict[int, List[MissionItem]],
+        progress_callback: Optional[Callable] = None,
+    ) -> Response:
+        """
+        Upload a mission to each of the given vehicles at the same time. For
+        ArduPilot the first item of each mission is the home position.
+        """
+        unknown_vehicles = [
+            system_id for system_id in missions if system_id not in self.vehicles
+        ]
+        if unknown_vehicles:
+            return {
+                "success": False,
+                "message": f"Vehicles not found: {unknown_vehicles}",
+            }
+
+        # Check every mission first, so one bad item doesn't leave some
+        # vehicles with a new mission and the rest with their old one
+        for system_id, items in missions.items():
+            try:
+                check_mission(items)
+            except ValueError as e:
+                return {
+                    "success": False,
+                    "message": f"Invalid mission for vehicle {system_id}, {e}",
+                }
+
+        try:
+            results = MissionUploader(self, progress_callback).upload(missions)
+        except Exception as e:
+            self.logger.error(e, exc_info=True)
+            return {
+                "success": False,
+                "message": f"Could not upload missions, {e}",
+            }
+
+        failed_vehicles = [
+            system_id for system_id, result in results.items() if not result["success"]
+        ]
+        if not failed_vehicles:
+            return {
+                "success": True,
+                "message": f"Uploaded missions to {len(results)} vehicles successfully",
+                "data": results,
+            }
+        return {
+            "success": False,
+            "message": f"Could not upload missions to {len(failed_vehicles)} vehicles",
+            "data": results,
+        }
+
+    def fetch_params(
+        self,
+        system_ids: List[int],
+        use_cache: bool = True,
+        progress_callback: Optional[Callable] = None,
+    ) -> Response:
+        """
+        Get the parameters of the given vehicles, downloading from all of them
+        at once. Vehicles whose parameters haven't changed since they were last
+        downloaded are loaded from the disk cache instead.
+        """
+        unknown_vehicles = [
+            system_id for system_id in system_ids if system_id not in self.vehicles
+        ]
+        if unknown_vehicles:
+            return {
+                "success": False,
+                "message": f"Vehicles not found: {unknown_vehicles}",
+            }
+
+        try:
+            results = self.param_manager.fetch(system_ids, use_cache, progress_callback)
+        except Exception as e:
+            self.logger.error(e, exc_info=True)
+            return {
+                "success": False,
+                "message": f"Could not fetch params, {e}",
+            }
+
+        failed_vehicles = [
+            system_id for system_id, result in results.items() if not result["success"]
+        ]
+        if not failed_vehicles:
+            return {
+                "success": True,
+                "message": f"Fetched params from {len(results)} vehicles successfully",
+                "data": results,
+            }
+        return {
+            "success": False,
+            "message": f"Could not fetch params from {len(failed_vehicles)} vehicles",
+            "data": results,
+        }
+
+    def get_params(self, system_id: int) -> Response:
+        if system_id not in self.param_manager.params:
+            return {
+                "success": False,
+                "message": f"Params have not been fetched from vehicle {system_id}",
+            }
+
+        return {
+            "success": True,
+            "data": self.param_manager.params[system_id],
+        }
+
+    def set_params(self, system_ids: List[int], params: Dict[str, float]) -> Response:
+        """
+        Set the same parameters on each of the given vehicles, each value is
+        checked against what the vehicle reports back.
+        """
+        unknown_vehicles = [
+            system_id for system_id in system_ids if system_id not in self.vehicles
+        ]
+        if unknown_vehicles:
+            return {
+                "success": False,
+                "message": f"Vehicles not found: {unknown_vehicles}",
+            }
+
+        try:
+            results = self.param_manager.set(system_ids, params)
+        except Exception as e:
+            self.logger.error(e, exc_info=True)
+            return {
+                "success": False,
+                "message": f"Could not set params, {e}",
+            }
+
+        failed_vehicles = [
+            system_id for system_id, result in results.items() if not result["success"]
+        ]
+        if not failed_vehicles:
+            return {
+                "success": True,
+                "message": f"Set params on {len(results)} vehicles successfully",
+                "data": results,
+            }
+        return {
+            "success": False,
+            "message": f"Could not set params on {len(failed_vehicles)} vehicles",
+            "data": results,
+        }
+
     def close(self) -> None:
         self.clear_message_listeners()
         self.is_active.clear()
 
         self._stop_all_threads()
 
+        forwarder = getattr(self, "forwarder", None)
+        if forwarder is not None:
+            forwarder.close()
+
+        control_ingress = getattr(self, "control_ingress", None)
+        if control_ingress is not None:
+            control_ingress.close()
+
         if self.master is not None:
             self.master.close()
 
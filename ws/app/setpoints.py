@@ -0,0 +1,368 @@
+import logging
+import math
+import threading
+import time
+from collections import deque
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Deque,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from pymavlink.mavutil import mavlink
+
+from app.latency import get_percentiles
+from app.stream_rates import get_message_size
+from app.types import Response, VehicleType
+
+if TYPE_CHECKING:
+    from app.radio_link import RadioLink
+
+# Changed setpoints go out at the streaming rate, unchanged ones are repeated
+# at the keepalive rate so the vehicle doesn't give up on the guided target
+DEFAULT_SETPOINT_RATE = 10.0
+MAX_SETPOINT_RATE = 50.0
+KEEPALIVE_RATE = 2.0
+
+# Fraction of the link capacity setpoints may use, taken out of the headroom
+# the stream rate manager leaves free
+SETPOINT_LINK_SHARE = 0.15
+
+# A velocity setpoint the client stops updating is dropped after this long,
+# ArduCopter then stops the vehicle itself once GUID_TIMEOUT runs out. Moving
+# at the last velocity forever because a client went away would be worse.
+VELOCITY_TIMEOUT = 1.0
+
+# Ignore everything in SET_POSITION_TARGET_GLOBAL_INT except vx, vy and vz
+VELOCITY_TYPE_MASK = (
+    mavlink.POSITION_TARGET_TYPEMASK_X_IGNORE
+    | mavlink.POSITION_TARGET_TYPEMASK_Y_IGNORE
+    | mavlink.POSITION_TARGET_TYPEMASK_Z_IGNORE
+    | mavlink.POSITION_TARGET_TYPEMASK_AX_IGNORE
+    | mavlink.POSITION_TARGET_TYPEMASK_AY_IGNORE
+    | mavlink.POSITION_TARGET_TYPEMASK_AZ_IGNORE
+    | mavlink.POSITION_TARGET_TYPEMASK_YAW_IGNORE
+    | mavlink.POSITION_TARGET_TYPEMASK_YAW_RATE_IGNORE
+)
+STALENESS_SAMPLES = 1000
+
+POSITION_FIELDS = ("latitude", "longitude", "altitude")
+VELOCITY_FIELDS = ("vx", "vy", "vz")
+
+
+class Setpoint:
+    """The latest target for a vehicle, either a position or a NED velocity."""
+
+    def __init__(self, kind: str, values: Tuple[float, ...], now: float):
+        self.kind = kind
+        self.values = values
+        self.updated_time = now
+        self.sent_time: Optional[float] = None
+        self.changed = True
+
+
+class SetpointStreamer:
+    """
+    Streams guided setpoints to vehicles at a fixed rate. Clients can update a
+    vehicle's target as often as they like, only the latest one is kept and
+    any update replaced before it was sent is dropped, so what goes out is set
+    by the rate and the link budget rather than by how fast clients push.
+
+    Each tick changed setpoints are sent first, then unchanged ones due a
+    keepalive, both oldest sent first so no vehicle is starved. Whatever
+    doesn't fit in the byte budget waits for the next tick, still holding the
+    latest target.
+    """
+
+    def __init__(
+        self,
+        radio_link: "RadioLink",
+        budget: float,
+        rate: float = DEFAULT_SETPOINT_RATE,
+        keepalive_rate: float = KEEPALIVE_RATE,
+    ):
+        self.logger = logging.getLogger("setpoints")
+
+        self.radio_link = radio_link
+        self.budget = budget
+        self.rate = rate
+        self.keepalive_rate = keepalive_rate
+
+        self.lock = threading.Lock()
+        self.setpoints: Dict[int, Setpoint] = {}
+        # Bytes that can be sent, refilled at the budget each tick
+        self.allowance: float = 0.0
+        self.position_size = get_message_size("SET_POSITION_TARGET_GLOBAL_INT")
+        self.plane_position_size = get_message_size("MISSION_ITEM_INT")
+        self.is_starving = False
+
+        self.updates: int = 0
+        self.coalesced: int = 0
+        self.sent: int = 0
+        self.keepalives: int = 0
+        self.deferred: int = 0
+        # Keepalives that went out late or not at all because the budget ran
+        # out, vehicles might give up on their guided target
+        self.starved: int = 0
+        self.expired: int = 0
+        # Time from a client's update to the setpoint being sent
+        self.staleness: Deque[float] = deque(maxlen=STALENESS_SAMPLES)
+
+    def _parse_setpoint(
+        self, setpoint: Mapping[str, Any]
+    ) -> Tuple[int, str, Tuple[float, ...]]:
+        system_id: Any = setpoint.get("system_id")
+        if all(setpoint.get(field) is not None for field in POSITION_FIELDS):
+            kind, fields = "position", POSITION_FIELDS
+        elif all(setpoint.get(field) is not None for field in VELOCITY_FIELDS):
+            kind, fields = "velocity", VELOCITY_FIELDS
+        else:
+            raise ValueError(
+                f"Setpoint for vehicle {system_id} needs either "
+                f"{', '.join(POSITION_FIELDS)} or {', '.join(VELOCITY_FIELDS)}"
+            )
+
+        try:
+            system_id = int(system_id)
+            values = tuple(float(setpoint[field]) for field in fields)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid setpoint for vehicle {system_id}")
+        return system_id, kind, values
+
+    def set_targets(
+        self, targets: Iterable[Tuple[int, str, Tuple[float, ...]]]
+    ) -> List[str]:
+        """
+        Replace the targets of some vehicles with (system_id, kind, values)
+        tuples, kind being "position" or "velocity". Returns why any targets
+        were rejected.
+        """
+        errors = []
+        now = time.monotonic()
+        with self.lock:
+            for system_id, kind, values in targets:
+                vehicle = self.radio_link.vehicles.get(system_id)
+                if vehicle is None:
+                    errors.append(f"Vehicle {system_id} not found")
+                    continue
+                # NaN and inf would otherwise be sent to the vehicle every tick
+                if not all(math.isfinite(value) for value in values):
+                    errors.append(f"Invalid setpoint for vehicle {system_id}")
+                    continue
+                if kind == "velocity" and vehicle.vehicle_type == VehicleType.PLANE:
+                    errors.append(f"Vehicle {system_id} can't take velocity setpoints")
+                    continue
+
+                self.updates += 1
+                existing = self.setpoints.get(system_id)
+                if existing is None:
+                    self.setpoints[system_id] = Setpoint(kind, values, now)
+                    continue
+                if existing.changed:
+                    self.coalesced += 1
+                if existing.kind != kind or existing.values != values:
+                    existing.kind = kind
+                    existing.values = values
+                    existing.changed = True
+                existing.updated_time = now
+        return errors
+
+    def update_setpoints(self, setpoints: Sequence[Mapping[str, Any]]) -> Response:
+        """
+        Replace the targets of some vehicles. Each setpoint has a system_id and
+        either latitude, longitude and altitude (relative, in m) or vx, vy and
+        vz (north, east, down, in m/s). Valid setpoints are kept even if others
+        in the same update are rejected.
+        """
+        parsed = []
+        errors = []
+        for setpoint in setpoints:
+            try:
+                parsed.append(self._parse_setpoint(setpoint))
+            except ValueError as e:
+                errors.append(str(e))
+        errors += self.set_targets(parsed)
+
+        if errors:
+            return {
+                "success": False,
+                "message": f"Rejected {len(errors)} setpoints: {'; '.join(errors)}",
+            }
+        return {"success": True, "message": f"Updated {len(parsed)} setpoints"}
+
+    def clear_setpoints(self, system_ids: Optional[List[int]] = None) -> Response:
+        """
+        Stop streaming to some vehicles, or all of them. They keep flying to
+        their last position target, or stop after a velocity one.
+        """
+        with self.lock:
+            if system_ids is None:
+                count = len(self.setpoints)
+                self.setpoints.clear()
+            else:
+                count = sum(
+                    self.setpoints.pop(system_id, None) is not None
+                    for system_id in system_ids
+                )
+        return {"success": True, "message": f"Stopped streaming to {count} vehicles"}
+
+    def set_rate(self, rate: float) -> None:
+        # NaN gets through min and max, and would stop the streaming thread
+        if not math.isfinite(rate):
+            raise ValueError(f"Invalid setpoint rate {rate}")
+        self.rate = min(max(rate, self.keepalive_rate), MAX_SETPOINT_RATE)
+
+    def _get_size(self, system_id: int, setpoint: Setpoint) -> int:
+        if (
+            setpoint.kind == "position"
+            and self.radio_link.vehicles[system_id].vehicle_type == VehicleType.PLANE
+        ):
+            return self.plane_position_size
+        return self.position_size
+
+    def _select_due(self, now: float) -> List[Tuple[int, str, Tuple[float, ...]]]:
+        """
+        Pick the setpoints to send this tick within the byte allowance, and
+        mark them as sent.
+        """
+        keepalive_interval = 1 / self.keepalive_rate
+        changed = []
+        keepalive = []
+        with self.lock:
+            for system_id, setpoint in list(self.setpoints.items()):
+                if (
+                    setpoint.kind == "velocity"
+                    and now - setpoint.updated_time > VELOCITY_TIMEOUT
+                ):
+                    del self.setpoints[system_id]
+                    self.expired += 1
+                elif setpoint.changed:
+                    changed.append((setpoint.sent_time or 0.0, system_id))
+                elif now - (setpoint.sent_time or 0.0) >= keepalive_interval:
+                    keepalive.append((setpoint.sent_time or 0.0, system_id))
+
+            changed.sort()
+            keepalive.sort()
+            due = [(system_id, True) for _, system_id in changed]
+            due += [(system_id, False) for _, system_id in keepalive]
+
+            selected = []
+            starved = 0
+            for index, (system_id, is_changed) in enumerate(due):
+                setpoint = self.setpoints[system_id]
+                size = self._get_size(system_id, setpoint)
+                if size > self.allowance:
+                    self.deferred += len(due) - index
+                    # A keepalive is starved once it's a whole interval late
+                    starved = sum(
+                        now - (self.setpoints[deferred_id].sent_time or now)
+                        >= 2 * keepalive_interval
+                        for deferred_id, deferred_changed in due[index:]
+                        if not deferred_changed
+                    )
+                    break
+                self.allowance -= size
+
+                if is_changed:
+                    self.staleness.append(now - setpoint.updated_time)
+                else:
+                    self.keepalives += 1
+                setpoint.changed = False
+                setpoint.sent_time = now
+                selected.append((system_id, setpoint.kind, setpoint.values))
+
+        self.starved += starved
+        if starved and not self.is_starving:
+            self.logger.warning(
+                f"Setpoint budget of {self.budget:.0f} B/s is too small to keep "
+                f"every guided target alive at {self.keepalive_rate:.1f} Hz, "
+                f"{starved} keepalives are late"
+            )
+        self.is_starving = bool(starved)
+        return selected
+
+    def _send(self, system_id: int, kind: str, values: Tuple[float, ...]) -> None:
+        vehicle = self.radio_link.vehicles[system_id]
+        if kind == "position":
+            latitude, longitude, altitude = values
+            self.radio_link._send_position_target(
+                vehicle, latitude, longitude, altitude
+            )
+            return
+
+        if self.radio_link.master is None:
+            return
+        vx, vy, vz = values
+        self.radio_link.master.mav.set_position_target_global_int_send(
+            0,  # time_boot_ms (not used)
+            system_id,
+            mavlink.MAV_COMP_ID_AUTOPILOT1,
+            mavlink.MAV_FRAME_GLOBAL_RELATIVE_ALT_INT,
+            VELOCITY_TYPE_MASK,
+            0,  # lat_int (not used)
+            0,  # lon_int (not used)
+            0,  # alt (not used)
+            vx,
+            vy,
+            vz,
+            0,  # afx (not used)
+            0,  # afy (not used)
+            0,  # afz (not used)
+            0,  # yaw (not used)
+            0,  # yaw_rate (not used)
+        )
+
+    def tick(self) -> int:
+        """Send whatever is due this tick, returns the number of setpoints sent."""
+        interval = 1 / self.rate
+        # Unused budget carries over, otherwise a budget that isn't a whole
+        # number of messages a tick loses the remainder every tick. Only up to
+        # a tick's worth plus one message builds up, so an idle period can't
+        # turn into a burst bigger than the budget.
+        self.allowance = min(
+            self.allowance + self.budget * interval,
+            self.budget * interval + max(self.plane_position_size, self.position_size),
+        )
+
+        selected = self._select_due(time.monotonic())
+        for system_id, kind, values in selected:
+            try:
+                self._send(system_id, kind, values)
+            except Exception:
+                self.logger.exception(f"[{system_id}] Failed to send setpoint")
+        self.sent += len(selected)
+        return len(selected)
+
+    def run(self) -> None:
+        while self.radio_link.is_active.is_set():
+            start_time = time.monotonic()
+            if self.setpoints:
+                try:
+                    self.tick()
+                except Exception:
+                    self.logger.exception("Failed to send setpoints")
+
+            time.sleep(max(1 / self.rate - (time.monotonic() - start_time), 0))
+
+    def get_status(self) -> dict:
+        return {
+            "rate": self.rate,
+            "keepalive_rate": self.keepalive_rate,
+            "budget": self.budget,
+            "vehicles": sorted(list(self.setpoints)),
+            "updates": self.updates,
+            "coalesced": self.coalesced,
+            "sent": self.sent,
+            "keepalives": self.keepalives,
+            "deferred": self.deferred,
+            "starved": self.starved,
+            "expired": self.expired,
+            "staleness": get_percentiles(self.staleness),
+        }
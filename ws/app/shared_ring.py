@@ -0,0 +1,165 @@
+import math
+import struct
+from multiprocessing import shared_memory
+from typing import List, NamedTuple, Optional, Tuple
+
+# The header holds the number of records ever written
+HEADER_SIZE = 64
+WRITE_COUNT = struct.Struct("<Q")
+
+# Each slot starts with the record's sequence number plus one (0 while it's
+# being written), the payload length, system ID, message type index, the time
+# the message was received and its link latency (NaN if unknown)
+SLOT_HEADER = struct.Struct("<QHBBdd")
+SLOT_HEADER_SIZE = 32
+
+
+class RingRecord(NamedTuple):
+    sequence: int
+    system_id: int
+    message_type_index: int
+    received_time: float
+    link_latency: float
+    payload: memoryview
+
+
+class SharedRing:
+    """
+    A single writer, many reader ring buffer of telemetry records in shared
+    memory. The writer never waits for readers, a reader that falls more than
+    a lap behind skips ahead and loses the oldest records.
+
+    Readers get memoryviews straight into the shared memory and check the
+    record is still current after using one, since the writer may have reused
+    its slot in the meantime.
+    """
+
+    def __init__(
+        self,
+        shared_memory_block: shared_memory.SharedMemory,
+        slot_count: int,
+        slot_size: int,
+        owner: bool,
+    ):
+        self.shared_memory = shared_memory_block
+        self.slot_count = slot_count
+        self.slot_size = slot_size
+        self.owner = owner
+        self.buffer: Optional[memoryview] = shared_memory_block.buf
+
+    @classmethod
+    def create(cls, slot_count: int = 8192, slot_size: int = 1024) -> "SharedRing":
+        shared_memory_block = shared_memory.SharedMemory(
+            create=True, size=HEADER_SIZE + slot_count * slot_size
+        )
+        ring = cls(shared_memory_block, slot_count, slot_size, owner=True)
+        buffer = ring._get_buffer()
+        WRITE_COUNT.pack_into(buffer, 0, 0)
+        for slot in range(slot_count):
+            SLOT_HEADER.pack_into(
+                buffer, HEADER_SIZE + slot * slot_size, 0, 0, 0, 0, 0.0, 0.0
+            )
+        return ring
+
+    @classmethod
+    def attach(cls, name: str, slot_count: int, slot_size: int) -> "SharedRing":
+        # Only the creating process unlinks the block
+        shared_memory_block = shared_memory.SharedMemory(name=name)
+        return cls(shared_memory_block, slot_count, slot_size, owner=False)
+
+    @property
+    def name(self) -> str:
+        return self.shared_memory.name
+
+    @property
+    def max_payload_size(self) -> int:
+        return self.slot_size - SLOT_HEADER_SIZE
+
+    def _get_buffer(self) -> memoryview:
+        if self.buffer is None:
+            raise ValueError("Ring is closed")
+        return self.buffer
+
+    def get_write_count(self) -> int:
+        return WRITE_COUNT.unpack_from(self._get_buffer(), 0)[0]
+
+    def write(
+        self,
+        system_id: int,
+        message_type_index: int,
+        payload: bytes,
+        received_time: float = 0.0,
+        link_latency: float = math.nan,
+    ) -> bool:
+        """Add a record, returns False if it's too big for a slot."""
+        if len(payload) > self.max_payload_size:
+            return False
+
+        buffer = self._get_buffer()
+        sequence = WRITE_COUNT.unpack_from(buffer, 0)[0]
+        offset = HEADER_SIZE + (sequence % self.slot_count) * self.slot_size
+
+        # Mark the slot as being written so readers skip it
+        SLOT_HEADER.pack_into(buffer, offset, 0, 0, 0, 0, 0.0, 0.0)
+        payload_offset = offset + SLOT_HEADER_SIZE
+        buffer[payload_offset : payload_offset + len(payload)] = payload
+        SLOT_HEADER.pack_into(
+            buffer,
+            offset,
+            sequence + 1,
+            len(payload),
+            system_id,
+            message_type_index,
+            received_time,
+            link_latency,
+        )
+        WRITE_COUNT.pack_into(buffer, 0, sequence + 1)
+        return True
+
+    def read(self, cursor: int) -> Tuple[int, List[RingRecord]]:
+        """
+        Get the records written since cursor and the cursor to read from next
+        time.
+        """
+        buffer = self._get_buffer()
+        write_count = WRITE_COUNT.unpack_from(buffer, 0)[0]
+        # Skip anything that has already been overwritten
+        cursor = max(cursor, write_count - self.slot_count)
+
+        records = []
+        for sequence in range(cursor, write_count):
+            offset = HEADER_SIZE + (sequence % self.slot_count) * self.slot_size
+            (
+                slot_sequence,
+                length,
+                system_id,
+                message_type_index,
+                received_time,
+                link_latency,
+            ) = SLOT_HEADER.unpack_from(buffer, offset)
+            if slot_sequence != sequence + 1:
+                continue
+            payload_offset = offset + SLOT_HEADER_SIZE
+            records.append(
+                RingRecord(
+                    sequence,
+                    system_id,
+                    message_type_index,
+                    received_time,
+                    link_latency,
+                    buffer[payload_offset : payload_offset + length],
+                )
+            )
+        return write_count, records
+
+    def is_current(self, sequence: int) -> bool:
+        """Check a record's slot hasn't been reused since it was read."""
+        offset = HEADER_SIZE + (sequence % self.slot_count) * self.slot_size
+        return SLOT_HEADER.unpack_from(self._get_buffer(), offset)[0] == sequence + 1
+
+    def close(self) -> None:
+        # Readers have to let go of their record views before this
+        self.buffer = None
+        self.shared_memory.close()
+        if self.owner:
+            self.shared_memory.unlink()
@@ -1,5 +1,19 @@
-from typing import Optional
+import threading
+from typing import Optional, Union
 
+from app.latency import LatencyStats
+from app.link_process import RadioLinkProcess
+from app.link_sessions import LinkSessions
 from app.radio_link import RadioLink
+from app.subscriptions import TelemetrySubscriptions
 
-radio_link: Optional[RadioLink] = None
+radio_link: Optional[Union[RadioLink, RadioLinkProcess]] = None
+# Held while a radio link is being opened, which takes a few seconds, so two
+# clients connecting at once don't both open one
+connect_lock = threading.Lock()
+# Run the radio link in its own process, set by serve.py --link-process
+use_link_process: bool = False
+telemetry_subscriptions = TelemetrySubscriptions()
+link_sessions = LinkSessions()
+# Time from receiving telemetry to sending it to clients, per vehicle
+pipeline_latency = LatencyStats()
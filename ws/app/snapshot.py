@@ -0,0 +1,106 @@
+import threading
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from pymavlink.mavutil import mavlink
+
+if TYPE_CHECKING:
+    from app.radio_link import RadioLink
+
+TELEMETRY_MESSAGES = [
+    "HEARTBEAT",
+    "STATUSTEXT",
+    "VFR_HUD",
+    "GLOBAL_POSITION_INT",
+    "ATTITUDE",
+    "BATTERY_STATUS",
+    "SYS_STATUS",
+    "GPS_RAW_INT",
+    "VIBRATION",
+    "EKF_STATUS_REPORT",
+]
+
+
+def serialize_message(message: mavlink.MAVLink_message) -> dict:
+    message_dict = message.to_dict()
+    message_dict["system_id"] = message.get_srcSystem()
+    return message_dict
+
+
+class FleetSnapshot:
+    """
+    The latest message of each telemetry type from every vehicle, so a newly
+    connected client can draw the whole fleet straight away.
+
+    The reader thread only stores message objects and bumps the version. The
+    snapshot is built when asked for and cached against the version, and on a
+    rebuild only messages that have changed since the last build are
+    serialised again.
+    """
+
+    def __init__(
+        self, radio_link: "RadioLink", message_types: List[str] = TELEMETRY_MESSAGES
+    ):
+        self.radio_link = radio_link
+        self.message_types = set(message_types)
+
+        self.lock = threading.Lock()
+        self.version: int = 0
+        self.latest_messages: Dict[int, Dict[str, mavlink.MAVLink_message]] = {}
+
+        self.build_lock = threading.Lock()
+        self.serialized_messages: Dict[
+            Tuple[int, str], Tuple[mavlink.MAVLink_message, dict]
+        ] = {}
+        self.cached_snapshot: Optional[dict] = None
+
+    def update(
+        self, system_id: int, message_type: str, message: mavlink.MAVLink_message
+    ) -> None:
+        if message_type not in self.message_types:
+            return
+
+        with self.lock:
+            self.latest_messages.setdefault(system_id, {})[message_type] = message
+            self.version += 1
+
+    def _serialize(
+        self, system_id: int, message_type: str, message: mavlink.MAVLink_message
+    ) -> dict:
+        cached = self.serialized_messages.get((system_id, message_type))
+        if cached is not None and cached[0] is message:
+            return cached[1]
+
+        message_dict = serialize_message(message)
+        self.serialized_messages[(system_id, message_type)] = (message, message_dict)
+        return message_dict
+
+    def get(self) -> dict:
+        """Get the snapshot, only rebuilding it if a message has arrived since."""
+        # Clients reconnecting together queue up here and all but the first get
+        # the snapshot it built
+        with self.build_lock:
+            with self.lock:
+                version = self.version
+                if (
+                    self.cached_snapshot is not None
+                    and self.cached_snapshot["version"] == version
+                ):
+                    return self.cached_snapshot
+                latest_messages = {
+                    system_id: dict(messages)
+                    for system_id, messages in self.latest_messages.items()
+                }
+
+            vehicles = []
+            for system_id, vehicle in list(self.radio_link.vehicles.items()):
+                vehicle_snapshot = vehicle.serialize()
+                vehicle_snapshot["messages"] = {
+                    message_type: self._serialize(system_id, message_type, message)
+                    for message_type, message in latest_messages.get(
+                        system_id, {}
+                    ).items()
+                }
+                vehicles.append(vehicle_snapshot)
+
+            self.cached_snapshot = {"version": version, "vehicles": vehicles}
+            return self.cached_snapshot
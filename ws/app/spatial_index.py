@@ -0,0 +1,240 @@
+import math
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from app.proximity import EARTH_RADIUS
+
+# Grid cells are roughly 110m on a side at the equator, small enough that a
+# query only touches a handful of vehicles and large enough that a vehicle
+# doesn't change cell on every position update
+DEFAULT_CELL_SIZE_DEGREES = 0.001
+
+Cell = Tuple[int, int]
+
+
+def distances_to_point(
+    latitudes: np.ndarray, longitudes: np.ndarray, latitude: float, longitude: float
+) -> np.ndarray:
+    """Get the distances in metres from each position to a point."""
+    north = np.radians(latitudes - latitude)
+    east = np.radians(longitudes - longitude) * math.cos(math.radians(latitude))
+    return EARTH_RADIUS * np.hypot(north, east)
+
+
+def points_in_polygon(
+    latitudes: np.ndarray, longitudes: np.ndarray, polygon: np.ndarray
+) -> np.ndarray:
+    """
+    Get a mask of which positions lie inside the polygon using the even-odd
+    ray casting rule. The polygon is an (n, 2) array of latitude, longitude
+    vertices and is closed automatically.
+    """
+    inside = np.zeros(len(latitudes), dtype=bool)
+    vertex_lats, vertex_lons = polygon[:, 0], polygon[:, 1]
+    previous_lats, previous_lons = np.roll(vertex_lats, 1), np.roll(vertex_lons, 1)
+
+    for lat_a, lon_a, lat_b, lon_b in zip(
+        vertex_lats, vertex_lons, previous_lats, previous_lons
+    ):
+        if lat_a == lat_b:
+            continue
+        crosses = (lat_a > latitudes) != (lat_b > latitudes)
+        crossing_lons = lon_a + (latitudes - lat_a) * (lon_b - lon_a) / (lat_b - lat_a)
+        inside ^= crosses & (longitudes < crossing_lons)
+
+    return inside
+
+
+class SpatialIndex:
+    """
+    Uniform grid index over the latest position of each vehicle. Updates are
+    incremental, a vehicle is only moved between buckets when it crosses into
+    a new cell.
+    """
+
+    def __init__(self, cell_size: float = DEFAULT_CELL_SIZE_DEGREES):
+        self.cell_size = cell_size
+
+        self.positions: Dict[int, Tuple[float, float]] = {}
+        self.vehicle_cells: Dict[int, Cell] = {}
+        self.cells: Dict[Cell, Set[int]] = {}
+
+        self.lock = threading.Lock()
+
+    def _get_cell(self, latitude: float, longitude: float) -> Cell:
+        return (
+            math.floor(latitude / self.cell_size),
+            math.floor(longitude / self.cell_size),
+        )
+
+    def update(self, system_id: int, latitude: float, longitude: float) -> None:
+        cell = self._get_cell(latitude, longitude)
+
+        with self.lock:
+            self.positions[system_id] = (latitude, longitude)
+
+            previous_cell = self.vehicle_cells.get(system_id)
+            if previous_cell == cell:
+                return
+
+            if previous_cell is not None:
+                self._remove_from_cell(system_id, previous_cell)
+
+            self.vehicle_cells[system_id] = cell
+            self.cells.setdefault(cell, set()).add(system_id)
+
+    def remove(self, system_id: int) -> None:
+        with self.lock:
+            self.positions.pop(system_id, None)
+            cell = self.vehicle_cells.pop(system_id, None)
+            if cell is not None:
+                self._remove_from_cell(system_id, cell)
+
+    def _remove_from_cell(self, system_id: int, cell: Cell) -> None:
+        bucket = self.cells.get(cell)
+        if bucket is None:
+            return
+        bucket.discard(system_id)
+        if not bucket:
+            del self.cells[cell]
+
+    def _candidates_in_cell_range(
+        self, min_cell: Cell, max_cell: Cell
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Get every vehicle in the given range of cells, must be called with the
+        lock held. Walks whichever is smaller out of the cells in the range and
+        the occupied cells.
+        """
+        cell_count = (max_cell[0] - min_cell[0] + 1) * (max_cell[1] - min_cell[1] + 1)
+
+        system_ids: List[int] = []
+        if cell_count <= len(self.cells):
+            for lat_cell in range(min_cell[0], max_cell[0] + 1):
+                for lon_cell in range(min_cell[1], max_cell[1] + 1):
+                    system_ids.extend(self.cells.get((lat_cell, lon_cell), ()))
+        else:
+            for cell, bucket in self.cells.items():
+                if (
+                    min_cell[0] <= cell[0] <= max_cell[0]
+                    and min_cell[1] <= cell[1] <= max_cell[1]
+                ):
+                    system_ids.extend(bucket)
+
+        positions = np.array(
+            [self.positions[system_id] for system_id in system_ids], dtype=np.float64
+        ).reshape(-1, 2)
+        return np.array(system_ids, dtype=np.int64), positions[:, 0], positions[:, 1]
+
+    def _candidates_in_bbox(
+        self, min_lat: float, min_lon: float, max_lat: float, max_lon: float
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        return self._candidates_in_cell_range(
+            self._get_cell(min_lat, min_lon), self._get_cell(max_lat, max_lon)
+        )
+
+    def query_bbox(
+        self, min_lat: float, min_lon: float, max_lat: float, max_lon: float
+    ) -> List[int]:
+        with self.lock:
+            system_ids, lats, lons = self._candidates_in_bbox(
+                min_lat, min_lon, max_lat, max_lon
+            )
+
+        mask = (lats >= min_lat) & (lats <= max_lat) & (lons >= min_lon)
+        mask &= lons <= max_lon
+        return sorted(system_ids[mask].tolist())
+
+    def query_polygon(self, polygon: List[Tuple[float, float]]) -> List[int]:
+        vertices = np.asarray(polygon, dtype=np.float64).reshape(-1, 2)
+        if len(vertices) < 3:
+            return []
+
+        min_lat, min_lon = vertices.min(axis=0)
+        max_lat, max_lon = vertices.max(axis=0)
+        with self.lock:
+            system_ids, lats, lons = self._candidates_in_bbox(
+                min_lat, min_lon, max_lat, max_lon
+            )
+
+        return sorted(system_ids[points_in_polygon(lats, lons, vertices)].tolist())
+
+    def query_radius(
+        self, latitude: float, longitude: float, radius: float
+    ) -> List[Tuple[int, float]]:
+        """Get the vehicles within radius metres of a point, nearest first."""
+        lat_delta = math.degrees(radius / EARTH_RADIUS)
+        lon_delta = lat_delta / max(math.cos(math.radians(latitude)), 1e-6)
+
+        with self.lock:
+            system_ids, lats, lons = self._candidates_in_bbox(
+                latitude - lat_delta,
+                longitude - lon_delta,
+                latitude + lat_delta,
+                longitude + lon_delta,
+            )
+
+        distances = distances_to_point(lats, lons, latitude, longitude)
+        mask = distances <= radius
+        order = np.argsort(distances[mask])
+        return [
+            (int(system_id), float(distance))
+            for system_id, distance in zip(
+                system_ids[mask][order], distances[mask][order]
+            )
+        ]
+
+    def query_nearest(
+        self, latitude: float, longitude: float, k: int = 1
+    ) -> List[Tuple[int, float]]:
+        """
+        Get the k nearest vehicles to a point, nearest first. Searches rings of
+        cells outwards from the point until the k-th nearest vehicle found is
+        closer than any unsearched cell could be.
+        """
+        if k <= 0:
+            return []
+
+        center_cell = self._get_cell(latitude, longitude)
+        cell_height = math.radians(self.cell_size) * EARTH_RADIUS
+        cell_width = cell_height * max(math.cos(math.radians(latitude)), 1e-6)
+        min_cell_size = min(cell_height, cell_width)
+
+        with self.lock:
+            if not self.cells:
+                return []
+
+            lat_cells = [cell[0] for cell in self.cells]
+            lon_cells = [cell[1] for cell in self.cells]
+            max_ring = max(
+                abs(center_cell[0] - min(lat_cells)),
+                abs(center_cell[0] - max(lat_cells)),
+                abs(center_cell[1] - min(lon_cells)),
+                abs(center_cell[1] - max(lon_cells)),
+            )
+
+            ring = 0
+            while True:
+                system_ids, lats, lons = self._candidates_in_cell_range(
+                    (center_cell[0] - ring, center_cell[1] - ring),
+                    (center_cell[0] + ring, center_cell[1] + ring),
+                )
+                distances = distances_to_point(lats, lons, latitude, longitude)
+
+                # Anything outside the searched square is at least this far away
+                searched_distance = ring * min_cell_size
+                if ring >= max_ring or (
+                    len(distances) >= k
+                    and np.partition(distances, k - 1)[k - 1] <= searched_distance
+                ):
+                    break
+                ring = min(max(ring * 2, 1), max_ring)
+
+        order = np.argsort(distances)[:k]
+        return [(int(system_ids[i]), float(distances[i])) for i in order]
+
+    def get_position(self, system_id: int) -> Optional[Tuple[float, float]]:
+        with self.lock:
+            return self.positions.get(system_id)
@@ -0,0 +1,456 @@
+import logging
+import threading
+import time
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
+
+from pymavlink.mavutil import mavlink
+from typing_extensions import TypedDict
+
+if TYPE_CHECKING:
+    from app.radio_link import RadioLink
+
+
+class MessageRatePolicy(TypedDict):
+    message: str
+    min_hz: float
+    max_hz: float
+    weight: float
+
+
+# Ordered by priority, the first messages are the most critical and are given
+# their minimum rate first if the link can't fit every message's minimum rate
+DEFAULT_STREAM_PRIORITIES: List[MessageRatePolicy] = [
+    {"message": "GLOBAL_POSITION_INT", "min_hz": 1, "max_hz": 10, "weight": 4},
+    {"message": "ATTITUDE", "min_hz": 1, "max_hz": 10, "weight": 3},
+    {"message": "VFR_HUD", "min_hz": 0.5, "max_hz": 4, "weight": 2},
+    {"message": "SYS_STATUS", "min_hz": 0.5, "max_hz": 2, "weight": 1},
+    {"message": "BATTERY_STATUS", "min_hz": 0.2, "max_hz": 1, "weight": 1},
+    {"message": "GPS_RAW_INT", "min_hz": 0.2, "max_hz": 2, "weight": 1},
+    {"message": "EKF_STATUS_REPORT", "min_hz": 0.2, "max_hz": 1, "weight": 0.5},
+    {"message": "VIBRATION", "min_hz": 0.2, "max_hz": 1, "weight": 0.5},
+]
+
+# Messages ArduPilot streams by default that nothing here uses, they're turned
+# off so they don't eat into the budget
+DISABLED_STREAM_MESSAGES = [
+    "RAW_IMU",
+    "SCALED_IMU2",
+    "SCALED_IMU3",
+    "SCALED_PRESSURE",
+    "SCALED_PRESSURE2",
+    "SCALED_PRESSURE3",
+    "POWER_STATUS",
+    "MEMINFO",
+    "NAV_CONTROLLER_OUTPUT",
+    "POSITION_TARGET_GLOBAL_INT",
+    "LOCAL_POSITION_NED",
+    "SERVO_OUTPUT_RAW",
+    "RC_CHANNELS",
+    "SIMSTATE",
+    "AHRS",
+    "AHRS2",
+    "SYSTEM_TIME",
+    "WIND",
+    "RANGEFINDER",
+    "DISTANCE_SENSOR",
+]
+
+MIN_RATE_HZ = 0.1
+VEHICLE_TIMEOUT = 5.0
+MAVLINK2_OVERHEAD_BYTES = 12
+HEARTBEAT_RATE_HZ = 1.0
+
+# Fraction of the link capacity that telemetry streams are allowed to use, the
+# rest is left as headroom for commands, STATUSTEXT bursts and retries
+LINK_UTILISATION = 0.8
+
+# AIMD backoff applied to the budget when packet loss is measured
+LOSS_THRESHOLD_PERCENT = 5.0
+BACKOFF_DECREASE = 0.75
+BACKOFF_INCREASE = 0.05
+MIN_BACKOFF = 0.3
+
+# A rate is only sent again once it's this far off what the vehicle last
+# acknowledged, so each small AIMD step doesn't resend every message's rate
+RATE_HYSTERESIS = 0.2
+# SET_MESSAGE_INTERVAL commands are sent one at a time per vehicle, and resent
+# if not acknowledged in time
+COMMAND_ACK_TIMEOUT = 1.5
+MAX_COMMAND_ATTEMPTS = 3
+COMMAND_POLL_INTERVAL = 0.1
+# Fraction of the link capacity the commands may use, out of the headroom
+# left after telemetry and setpoints
+COMMAND_LINK_SHARE = 0.05
+
+
+def get_message_size(message_name: str) -> int:
+    """Get the size in bytes of a MAVLink2 message on the wire."""
+    message_id = getattr(mavlink, f"MAVLINK_MSG_ID_{message_name}")
+    message_class = mavlink.mavlink_map[message_id]
+    return message_class.unpacker.size + MAVLINK2_OVERHEAD_BYTES
+
+
+def allocate_stream_rates(
+    budget_bytes: float, priorities: List[MessageRatePolicy]
+) -> Dict[str, float]:
+    """
+    Split a per-vehicle byte budget between the messages in the priority list.
+    Minimum rates are granted in priority order, then whatever budget is left
+    is shared out proportionally to each message's weight up to its maximum rate.
+    """
+    sizes = {
+        policy["message"]: get_message_size(policy["message"]) for policy in priorities
+    }
+    rates: Dict[str, float] = {}
+
+    remaining = max(budget_bytes, 0.0)
+    for policy in priorities:
+        message = policy["message"]
+        min_cost = policy["min_hz"] * sizes[message]
+        if min_cost <= remaining:
+            rates[message] = policy["min_hz"]
+            remaining -= min_cost
+        else:
+            rate = max(remaining / sizes[message], MIN_RATE_HZ)
+            rates[message] = min(rate, policy["min_hz"])
+            remaining = max(remaining - rates[message] * sizes[message], 0.0)
+
+    # Water-fill the rest of the budget, messages that reach their maximum rate
+    # drop out and their share is redistributed to the others
+    unsaturated = [
+        policy for policy in priorities if rates[policy["message"]] < policy["max_hz"]
+    ]
+    while remaining > 1e-6 and unsaturated:
+        total_weight = sum(policy["weight"] for policy in unsaturated)
+        if total_weight <= 0:
+            break
+
+        still_unsaturated = []
+        spent = 0.0
+        for policy in unsaturated:
+            message = policy["message"]
+            share = remaining * policy["weight"] / total_weight
+            headroom = (policy["max_hz"] - rates[message]) * sizes[message]
+            if share >= headroom:
+                rates[message] = policy["max_hz"]
+                spent += headroom
+            else:
+                rates[message] += share / sizes[message]
+                spent += share
+                still_unsaturated.append(policy)
+
+        remaining -= spent
+        if len(still_unsaturated) == len(unsaturated):
+            break
+        unsaturated = still_unsaturated
+
+    return rates
+
+
+class VehicleStreams:
+    """What a vehicle has been told to stream, and what it has acknowledged."""
+
+    def __init__(self, reboots: int):
+        self.reboots = reboots
+        # Rates acknowledged by the vehicle, 0 for a message turned off
+        self.confirmed: Dict[str, float] = {}
+        # Messages the vehicle rejected or never acknowledged, not tried again
+        # until the vehicle rejoins
+        self.failed: Set[str] = set()
+        # The command waiting for an acknowledgement, (message, rate)
+        self.in_flight: Optional[Tuple[str, float]] = None
+        self.sent_time: float = 0.0
+        self.attempts: int = 0
+
+
+def needs_update(confirmed: Optional[float], rate: float) -> bool:
+    if confirmed is None:
+        return True
+    if rate == 0 or confirmed == 0:
+        return rate != confirmed
+    return abs(rate - confirmed) >= RATE_HYSTERESIS * confirmed
+
+
+class StreamRateManager:
+    """
+    Shares the link budget between the vehicles' telemetry streams and sets
+    them with SET_MESSAGE_INTERVAL. Commands are sent one at a time per
+    vehicle within a small byte budget, a rate only counts as set once the
+    vehicle acknowledges it, and anything unacknowledged is sent again. A
+    vehicle that goes quiet or reboots is set up from scratch when it's back.
+    """
+
+    def __init__(
+        self,
+        radio_link: "RadioLink",
+        link_capacity: int,
+        priorities: Optional[List[MessageRatePolicy]] = None,
+        rebalance_interval: float = 2.0,
+        disabled_messages: List[str] = DISABLED_STREAM_MESSAGES,
+    ):
+        self.logger = logging.getLogger("stream_rates")
+
+        self.radio_link = radio_link
+        self.link_capacity = link_capacity
+        self.priorities = priorities or DEFAULT_STREAM_PRIORITIES
+        self.rebalance_interval = rebalance_interval
+        self.disabled_messages = disabled_messages
+
+        self.backoff: float = 1.0
+        self.active_vehicles: List[int] = []
+        self.current_rates: Dict[str, float] = {}
+
+        # Taken by the reader thread handing over acknowledgements
+        self.lock = threading.Lock()
+        self.vehicle_streams: Dict[int, VehicleStreams] = {}
+        self.command_size = get_message_size("COMMAND_LONG")
+        self.command_allowance: float = 0.0
+        self.commands_sent: int = 0
+        self.commands_retried: int = 0
+        self.commands_failed: int = 0
+
+        self.inbound_bytes_per_second: float = 0.0
+        self.packet_loss_percent: float = 0.0
+
+        self._last_check_time = time.time()
+        self._last_bytes_received = 0
+        self._last_mav_count = 0
+        self._last_mav_loss = 0
+
+    def get_budget(self) -> float:
+        """Get the total number of bytes per second telemetry streams may use."""
+        return self.link_capacity * LINK_UTILISATION * self.backoff
+
+    def get_active_vehicles(self) -> List[int]:
+        now = time.time()
+        return sorted(
+            system_id
+            for system_id, vehicle in self.radio_link.vehicles.items()
+            if now - vehicle.last_heartbeat_time < VEHICLE_TIMEOUT
+        )
+
+    def _update_link_statistics(self) -> None:
+        master = self.radio_link.master
+        if master is None:
+            return
+
+        now = time.time()
+        elapsed = max(now - self._last_check_time, 1e-3)
+
+        bytes_received = self.radio_link.bytes_received
+        self.inbound_bytes_per_second = (
+            bytes_received - self._last_bytes_received
+        ) / elapsed
+
+        received = master.mav_count - self._last_mav_count
+        lost = master.mav_loss - self._last_mav_loss
+        if received + lost > 0:
+            self.packet_loss_percent = 100.0 * lost / (received + lost)
+        else:
+            self.packet_loss_percent = 0.0
+
+        self._last_check_time = now
+        self._last_bytes_received = bytes_received
+        self._last_mav_count = master.mav_count
+        self._last_mav_loss = master.mav_loss
+
+    def _update_backoff(self) -> bool:
+        """Adjust the budget backoff from the measured loss, returns True if it changed."""
+        previous_backoff = self.backoff
+
+        if (
+            self.packet_loss_percent > LOSS_THRESHOLD_PERCENT
+            or self.inbound_bytes_per_second > self.link_capacity
+        ):
+            self.backoff = max(self.backoff * BACKOFF_DECREASE, MIN_BACKOFF)
+        else:
+            self.backoff = min(self.backoff + BACKOFF_INCREASE, 1.0)
+
+        if self.backoff != previous_backoff:
+            self.logger.debug(
+                f"Stream budget backoff {self.backoff:.2f} "
+                f"(loss {self.packet_loss_percent:.1f}%, "
+                f"inbound {self.inbound_bytes_per_second:.0f} B/s)"
+            )
+            return True
+        return False
+
+    def rebalance(self) -> None:
+        """Work out the rates for the active vehicles, they're sent by run()."""
+        active_vehicles = self.get_active_vehicles()
+        self.active_vehicles = active_vehicles
+        if not active_vehicles:
+            return
+
+        heartbeat_cost = HEARTBEAT_RATE_HZ * get_message_size("HEARTBEAT")
+        per_vehicle_budget = self.get_budget() / len(active_vehicles) - heartbeat_cost
+
+        self.current_rates = allocate_stream_rates(per_vehicle_budget, self.priorities)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(
+                f"Stream rates for {len(active_vehicles)} vehicles set to "
+                f"{self.current_rates}"
+            )
+
+    def _forget_lost_vehicles(self, active_vehicles: List[int]) -> None:
+        """
+        Drop what vehicles that went quiet or rebooted were told, so they're
+        set up again when they're back. A rebooted vehicle has forgotten it.
+        """
+        active = set(active_vehicles)
+        with self.lock:
+            for system_id, streams in list(self.vehicle_streams.items()):
+                vehicle = self.radio_link.vehicles.get(system_id)
+                if (
+                    system_id not in active
+                    or vehicle is None
+                    or vehicle.reboots != streams.reboots
+                ):
+                    del self.vehicle_streams[system_id]
+
+    def _get_targets(self) -> List[Tuple[str, float]]:
+        """Every message's rate in the order they're set, turned off ones last."""
+        return list(self.current_rates.items()) + [
+            (message, 0.0) for message in self.disabled_messages
+        ]
+
+    def _next_command(
+        self, streams: VehicleStreams, targets: List[Tuple[str, float]], now: float
+    ) -> Optional[Tuple[str, float]]:
+        """Get the rate to send a vehicle next, must be called with the lock held."""
+        if streams.in_flight is not None:
+            if now - streams.sent_time < COMMAND_ACK_TIMEOUT:
+                return None
+            if streams.attempts < MAX_COMMAND_ATTEMPTS:
+                self.commands_retried += 1
+                return streams.in_flight
+            self.commands_failed += 1
+            streams.failed.add(streams.in_flight[0])
+            streams.in_flight = None
+
+        for message, rate in targets:
+            if message not in streams.failed and needs_update(
+                streams.confirmed.get(message), rate
+            ):
+                streams.attempts = 0
+                return message, rate
+        return None
+
+    def _send_commands(self, elapsed: float) -> None:
+        """Send the next SET_MESSAGE_INTERVAL to each vehicle within the budget."""
+        command_budget = self.link_capacity * COMMAND_LINK_SHARE
+        self.command_allowance = min(
+            self.command_allowance + command_budget * elapsed,
+            max(command_budget * COMMAND_POLL_INTERVAL, self.command_size),
+        )
+        if not self.current_rates:
+            return
+
+        now = time.monotonic()
+        targets = self._get_targets()
+        to_send = []
+        with self.lock:
+            for system_id in self.active_vehicles:
+                if system_id not in self.vehicle_streams:
+                    vehicle = self.radio_link.vehicles.get(system_id)
+                    if vehicle is None:
+                        continue
+                    self.vehicle_streams[system_id] = VehicleStreams(vehicle.reboots)
+
+            # The vehicles sent to least recently go first
+            for system_id, streams in sorted(
+                self.vehicle_streams.items(), key=lambda item: item[1].sent_time
+            ):
+                if self.command_allowance < self.command_size:
+                    break
+                command = self._next_command(streams, targets, now)
+                if command is None:
+                    continue
+                self.command_allowance -= self.command_size
+                streams.in_flight = command
+                streams.sent_time = now
+                streams.attempts += 1
+                to_send.append((system_id, command))
+
+        for system_id, (message, rate) in to_send:
+            message_id = getattr(mavlink, f"MAVLINK_MSG_ID_{message}")
+            self.radio_link.send_command_to_vehicle(
+                system_id,
+                mavlink.MAV_CMD_SET_MESSAGE_INTERVAL,
+                param1=message_id,
+                # Interval in microseconds, -1 turns the message off
+                param2=int(1e6 / rate) if rate > 0 else -1,
+            )
+            self.commands_sent += 1
+
+    def handle_command_ack(
+        self, system_id: int, command_ack: mavlink.MAVLink_command_ack_message
+    ) -> None:
+        """Called by the reader thread with a SET_MESSAGE_INTERVAL acknowledgement."""
+        if command_ack.result == mavlink.MAV_RESULT_IN_PROGRESS:
+            return
+        with self.lock:
+            streams = self.vehicle_streams.get(system_id)
+            if streams is None or streams.in_flight is None:
+                return
+            message, rate = streams.in_flight
+            streams.in_flight = None
+            if command_ack.result == mavlink.MAV_RESULT_ACCEPTED:
+                streams.confirmed[message] = rate
+                return
+            streams.failed.add(message)
+            self.commands_failed += 1
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(
+                f"[{system_id}] Rejected the interval for {message} "
+                f"(result {command_ack.result})"
+            )
+
+    def run(self) -> None:
+        last_rebalance_time = 0.0
+        last_send_time = time.monotonic()
+        while self.radio_link.is_active.is_set():
+            try:
+                now = time.monotonic()
+                if now - last_rebalance_time >= self.rebalance_interval:
+                    last_rebalance_time = now
+                    self._update_link_statistics()
+                    backoff_changed = self._update_backoff()
+
+                    active_vehicles = self.get_active_vehicles()
+                    self._forget_lost_vehicles(active_vehicles)
+                    if backoff_changed or active_vehicles != self.active_vehicles:
+                        self.rebalance()
+
+                self._send_commands(now - last_send_time)
+                last_send_time = now
+            except Exception:
+                self.logger.exception("Failed to rebalance stream rates")
+
+            time.sleep(COMMAND_POLL_INTERVAL)
+
+    def get_status(self) -> dict:
+        targets = self._get_targets()
+        with self.lock:
+            unconfirmed = sum(
+                any(
+                    message not in streams.failed
+                    and needs_update(streams.confirmed.get(message), rate)
+                    for message, rate in targets
+                )
+                for streams in self.vehicle_streams.values()
+            )
+        return {
+            "link_capacity": self.link_capacity,
+            "budget": self.get_budget(),
+            "backoff": self.backoff,
+            "inbound_bytes_per_second": self.inbound_bytes_per_second,
+            "packet_loss_percent": self.packet_loss_percent,
+            "active_vehicles": self.active_vehicles,
+            "rates": self.current_rates,
+            # Vehicles still being sent their rates
+            "unconfirmed_vehicles": unconfirmed,
+            "commands_sent": self.commands_sent,
+            "commands_retried": self.commands_retried,
+            "commands_failed": self.commands_failed,
+        }
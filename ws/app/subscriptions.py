@@ -0,0 +1,87 @@
+import threading
+from typing import Dict, Iterable, List, Optional, Set
+
+ALL = "*"
+
+
+def get_telemetry_room(system_id: object, message_type: str) -> str:
+    return f"telemetry:{system_id}:{message_type}"
+
+
+class TelemetrySubscriptions:
+    """
+    Keeps track of the telemetry rooms each client has joined. There is a room
+    per system ID and message type, with "*" standing for every vehicle or
+    every message type, so a message goes to at most four rooms and is only
+    serialised if one of them has someone in it.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.client_rooms: Dict[str, Set[str]] = {}
+        self.room_counts: Dict[str, int] = {}
+
+    @staticmethod
+    def get_rooms(
+        system_ids: Optional[Iterable[int]], message_types: Optional[Iterable[str]]
+    ) -> List[str]:
+        """Get the rooms covering the given vehicles and types, None means all."""
+        room_system_ids: List[object] = (
+            list(system_ids) if system_ids is not None else [ALL]
+        )
+        room_message_types = list(message_types) if message_types is not None else [ALL]
+        return [
+            get_telemetry_room(system_id, message_type)
+            for system_id in room_system_ids
+            for message_type in room_message_types
+        ]
+
+    def add(self, client_id: str, rooms: Iterable[str]) -> List[str]:
+        """Add rooms to a client, returns the rooms the client wasn't already in."""
+        added = []
+        with self.lock:
+            client_rooms = self.client_rooms.setdefault(client_id, set())
+            for room in rooms:
+                if room in client_rooms:
+                    continue
+                client_rooms.add(room)
+                self.room_counts[room] = self.room_counts.get(room, 0) + 1
+                added.append(room)
+        return added
+
+    def remove(
+        self, client_id: str, rooms: Optional[Iterable[str]] = None
+    ) -> List[str]:
+        """Remove rooms from a client, or all of its rooms if none are given."""
+        removed = []
+        with self.lock:
+            client_rooms = self.client_rooms.get(client_id, set())
+            for room in list(client_rooms if rooms is None else rooms):
+                if room not in client_rooms:
+                    continue
+                client_rooms.discard(room)
+                self.room_counts[room] -= 1
+                if self.room_counts[room] <= 0:
+                    del self.room_counts[room]
+                removed.append(room)
+            if not client_rooms:
+                self.client_rooms.pop(client_id, None)
+        return removed
+
+    def get_client_rooms(self, client_id: str) -> List[str]:
+        with self.lock:
+            return sorted(self.client_rooms.get(client_id, set()))
+
+    def get_active_rooms(self, system_id: int, message_type: str) -> List[str]:
+        """Get the rooms with at least one client that want this message."""
+        room_counts = self.room_counts
+        return [
+            room
+            for room in (
+                get_telemetry_room(system_id, message_type),
+                get_telemetry_room(system_id, ALL),
+                get_telemetry_room(ALL, message_type),
+                get_telemetry_room(ALL, ALL),
+            )
+            if room in room_counts
+        ]
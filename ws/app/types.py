@@ -1,5 +1,5 @@
 from enum import Enum
-from typing import NotRequired
+from typing import Any, NotRequired
 
 from typing_extensions import TypedDict
 
@@ -7,7 +7,7 @@ from typing_extensions import TypedDict
 class Response(TypedDict):
     success: bool
     message: NotRequired[str]
-    data: NotRequired[str]
+    data: NotRequired[Any]
 
 
 class VehicleType(Enum):
@@ -1,4 +1,6 @@
 import logging
+import time
+from typing import Optional
 
 from pymavlink import mavutil
 from pymavlink.mavutil import mavlink
@@ -33,17 +35,101 @@ class Vehicle:
         self.flight_mode: int = 0
         self.batt_volts: float = 0.0
         self.batt_curr: float = 0.0
+        self.battery_remaining: Optional[int] = None
+        self.last_heartbeat_time: float = time.time()
+
+        self.latitude: float = 0.0
+        self.longitude: float = 0.0
+        self.relative_altitude: float = 0.0
+        # Above mean sea level, comparable between vehicles with different homes
+        self.msl_altitude: float = 0.0
+        self.velocity_north: float = 0.0
+        self.velocity_east: float = 0.0
+        self.velocity_down: float = 0.0
+        self.last_position_time: Optional[float] = None
+        # Counts the times the vehicle's boot time went backwards
+        self.reboots: int = 0
+        self.time_boot_ms: Optional[int] = None
+
+        self.home_latitude: Optional[float] = None
+        self.home_longitude: Optional[float] = None
 
         self.flight_mode_map = mavutil.mode_mapping_bynumber(self.vehicle_type_int)
 
     def handle_heartbeat(self, heartbeat: mavlink.MAVLink_heartbeat_message):
-        self.armed = heartbeat.base_mode & mavlink.MAV_MODE_FLAG_SAFETY_ARMED != 0
+        armed = heartbeat.base_mode & mavlink.MAV_MODE_FLAG_SAFETY_ARMED != 0
+        if armed and not self.armed and self.last_position_time is not None:
+            # ArduPilot sets home where the vehicle arms, until a HOME_POSITION
+            # arrives that's the best guess of where it will return to
+            self.home_latitude = self.latitude
+            self.home_longitude = self.longitude
+        self.armed = armed
         self.flight_mode = heartbeat.custom_mode
+        self.last_heartbeat_time = time.time()
 
     def handle_vfr_hud(self, vfr_hud: mavlink.MAVLink_vfr_hud_message):
         self.ground_speed = vfr_hud.groundspeed
         self.altitude = vfr_hud.alt
 
+    def handle_global_position_int(
+        self, global_position_int: mavlink.MAVLink_global_position_int_message
+    ):
+        # Allow a little for messages arriving out of order
+        if (
+            self.time_boot_ms is not None
+            and global_position_int.time_boot_ms + 1000 < self.time_boot_ms
+        ):
+            self.reboots += 1
+        self.time_boot_ms = global_position_int.time_boot_ms
+
+        # 0,0 until the vehicle has a fix, keep the last position known rather
+        # than letting it look like a vehicle at 0,0
+        if global_position_int.lat == 0 and global_position_int.lon == 0:
+            return
+
+        self.latitude = global_position_int.lat / 1e7
+        self.longitude = global_position_int.lon / 1e7
+        self.relative_altitude = global_position_int.relative_alt / 1000
+        self.msl_altitude = global_position_int.alt / 1000
+        self.velocity_north = global_position_int.vx / 100
+        self.velocity_east = global_position_int.vy / 100
+        self.velocity_down = global_position_int.vz / 100
+        self.last_position_time = time.time()
+
+    def handle_home_position(
+        self, home_position: mavlink.MAVLink_home_position_message
+    ):
+        self.home_latitude = home_position.latitude / 1e7
+        self.home_longitude = home_position.longitude / 1e7
+
+    def _update_battery(self, volts: float, curr: int, remaining: int) -> None:
+        self.batt_volts = volts
+        # -1 when the autopilot doesn't measure it
+        self.batt_curr = curr / 100 if curr != -1 else 0.0
+        self.battery_remaining = remaining if remaining != -1 else None
+
+    def handle_sys_status(self, sys_status: mavlink.MAVLink_sys_status_message):
+        self._update_battery(
+            sys_status.voltage_battery / 1000,
+            sys_status.current_battery,
+            sys_status.battery_remaining,
+        )
+
+    def handle_battery_status(
+        self, battery_status: mavlink.MAVLink_battery_status_message
+    ):
+        # Only the primary battery, the same one SYS_STATUS reports
+        if battery_status.id != 0:
+            return
+        cell_voltages = [
+            voltage for voltage in battery_status.voltages if voltage != 65535
+        ]
+        self._update_battery(
+            sum(cell_voltages) / 1000,
+            battery_status.current_battery,
+            battery_status.battery_remaining,
+        )
+
     def serialize(self) -> dict:
         return {
             "system_id": self.system_id,
@@ -0,0 +1,122 @@
+"""
+Benchmark the fleet alert engine against evaluating every rule on every
+message, for a fleet where only some of the health messages change.
+
+Run from the ws directory with:
+    python -m benchmarks.alerts_benchmark --vehicles 500 --changed 0.05
+"""
+
+import argparse
+import threading
+import time
+from types import SimpleNamespace
+from typing import List, Tuple
+
+import numpy as np
+from pymavlink.dialects.v20 import ardupilotmega as mavlink2
+
+from app.alerts import DEFAULT_ALERT_RULES, AlertEngine
+
+
+def create_messages(
+    mav: mavlink2.MAVLink, rng: np.random.Generator, changed: bool
+) -> List[mavlink2.MAVLink_message]:
+    """One of each health message, with noisy values if they have changed."""
+    noise = rng.uniform(0, 1) if changed else 0.0
+    return [
+        mav.sys_status_encode(
+            0b111, 0b111, 0b111, 200, 12600, 1500, 80, 0, 0, 0, 0, 0, 0
+        ),
+        mav.battery_status_encode(
+            0,
+            mavlink2.MAV_BATTERY_FUNCTION_ALL,
+            mavlink2.MAV_BATTERY_TYPE_LIPO,
+            2500,
+            [12600] + [65535] * 9,
+            1500,
+            -1,
+            -1,
+            int(80 - noise * 70),
+        ),
+        mav.gps_raw_int_encode(
+            0, 3, 0, 0, 0, int(80 + noise * 150), 65535, 0, 0, int(14 - noise * 10)
+        ),
+        mav.ekf_status_report_encode(0b1111111, 0.1 + noise * 0.8, 0.1, 0.1, 0.1, 0.1),
+        mav.vibration_encode(0, 10 + noise * 50, 10, 10, 0, 0, 0),
+    ]
+
+
+def evaluate_all_rules(
+    messages: List[Tuple[int, mavlink2.MAVLink_message]], active: set
+) -> None:
+    """Check every rule on every message, the cost the alert engine avoids."""
+    for system_id, message in messages:
+        message_type = message.get_type()
+        for rule in DEFAULT_ALERT_RULES:
+            if rule.message_type != message_type:
+                continue
+            value = rule.value(tuple(getattr(message, field) for field in rule.fields))
+            key = (system_id, rule.name)
+            if value is None:
+                continue
+            if rule.is_triggered(value, key in active):
+                active.add(key)
+            else:
+                active.discard(key)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vehicles", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument(
+        "--changed", type=float, default=0.05, help="Fraction of vehicles changing"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    mav = mavlink2.MAVLink(None)
+    rounds = []
+    for round_index in range(args.rounds):
+        messages = []
+        for system_id in range(1, args.vehicles + 1):
+            changed = round_index == 0 or rng.uniform() < args.changed
+            for message in create_messages(mav, rng, changed):
+                messages.append((system_id, message))
+        rounds.append(messages)
+    message_count = sum(len(messages) for messages in rounds)
+
+    is_active = threading.Event()
+    is_active.set()
+    radio_link = SimpleNamespace(is_active=is_active)
+    engine = AlertEngine(radio_link)  # type: ignore[arg-type]
+
+    start_time = time.perf_counter()
+    alert_count = 0
+    for messages in rounds:
+        for system_id, message in messages:
+            alert_count += len(engine.check_message(system_id, message))
+    engine_time = time.perf_counter() - start_time
+
+    active: set = set()
+    start_time = time.perf_counter()
+    for messages in rounds:
+        evaluate_all_rules(messages, active)
+    full_time = time.perf_counter() - start_time
+
+    assert active == set(engine.active_alerts), "Alert engine and full check differ"
+
+    print(
+        f"{args.vehicles} vehicles, {message_count} messages, "
+        f"{args.changed:.0%} changing per round"
+    )
+    print(
+        f"Alert engine:  {engine_time * 1e6 / message_count:.2f}us per message, "
+        f"{engine.rules_evaluated} rules evaluated, {alert_count} alerts sent"
+    )
+    print(f"Every rule:    {full_time * 1e6 / message_count:.2f}us per message")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+"""
+Benchmark how long a swarm takes to carry out a sequence of commands, for a
+simulated fleet over a link with packet loss and delay.
+
+Each run arms every vehicle, puts them in GUIDED, takes them off to 10m and
+sends each one 20m north, using the RadioLink action methods the endpoints
+call. A vehicle has finished a step once its telemetry shows it (armed, in
+GUIDED, at altitude, at the target), and the time from the start of the step
+until then is recorded. The total is from the start of the run until the
+vehicle reached its target.
+
+Run from the ws directory with:
+    python -m benchmarks.command_benchmark --vehicles 4,16,64,128 --loss 0.02
+"""
+
+import argparse
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.radio_link import RadioLink
+from app.types import Response
+from app.vehicle import Vehicle
+from benchmarks.fake_fleet import COPTER_MODE_GUIDED, EARTH_RADIUS, FakeFleet
+
+TAKEOFF_ALTITUDE = 10.0
+GOTO_DISTANCE = 20.0
+ALTITUDE_TOLERANCE = 0.5
+POSITION_TOLERANCE = 1.5
+STEP_TIMEOUT = 30.0
+POLL_INTERVAL = 0.01
+
+
+class StepWatcher:
+    """Records when each vehicle's telemetry first shows it has finished a step."""
+
+    def __init__(
+        self,
+        radio_link: RadioLink,
+        system_ids: List[int],
+        is_finished: Callable[[Vehicle], bool],
+        timeout: float,
+    ):
+        self.radio_link = radio_link
+        self.is_finished = is_finished
+        self.timeout = timeout
+        self.start_time = time.monotonic()
+        self.finish_times: Dict[int, Optional[float]] = {
+            system_id: None for system_id in system_ids
+        }
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self) -> None:
+        deadline = self.start_time + self.timeout
+        while time.monotonic() < deadline:
+            now = time.monotonic()
+            waiting = 0
+            for system_id, finish_time in self.finish_times.items():
+                if finish_time is not None:
+                    continue
+                if self.is_finished(self.radio_link.vehicles[system_id]):
+                    self.finish_times[system_id] = now - self.start_time
+                else:
+                    waiting += 1
+            if not waiting:
+                return
+            time.sleep(POLL_INTERVAL)
+
+    def wait(self) -> Dict[int, Optional[float]]:
+        self.thread.join()
+        return self.finish_times
+
+
+def run_step(
+    radio_link: RadioLink,
+    system_ids: List[int],
+    command: Callable[[], List[Response]],
+    is_finished: Callable[[Vehicle], bool],
+    timeout: float,
+) -> dict:
+    watcher = StepWatcher(radio_link, system_ids, is_finished, timeout)
+    responses = command()
+    call_time = time.monotonic() - watcher.start_time
+    finish_times = watcher.wait()
+    return {
+        "start_time": watcher.start_time,
+        "call_time": call_time,
+        "finish_times": finish_times,
+        "failed_calls": sum(not response["success"] for response in responses),
+    }
+
+
+def get_goto_targets(
+    radio_link: RadioLink, system_ids: List[int]
+) -> Dict[int, Tuple[float, float]]:
+    offset = np.degrees(GOTO_DISTANCE / EARTH_RADIUS)
+    return {
+        system_id: (
+            radio_link.vehicles[system_id].latitude + offset,
+            radio_link.vehicles[system_id].longitude,
+        )
+        for system_id in system_ids
+    }
+
+
+def get_distance(vehicle: Vehicle, target: Tuple[float, float]) -> float:
+    latitude, longitude = target
+    north = np.radians(latitude - vehicle.latitude) * EARTH_RADIUS
+    east = (
+        np.radians(longitude - vehicle.longitude)
+        * EARTH_RADIUS
+        * np.cos(np.radians(latitude))
+    )
+    return float(np.hypot(north, east))
+
+
+def run_scenario(
+    radio_link: RadioLink, system_ids: List[int], step_timeout: float
+) -> Tuple[Dict[str, dict], Dict[int, float]]:
+    """
+    Run the scenario once, get the results of each step and the total time
+    each vehicle that reached its target took.
+    """
+    start_time = time.monotonic()
+    steps: Dict[str, dict] = {}
+
+    steps["arm"] = run_step(
+        radio_link,
+        system_ids,
+        lambda: [radio_link.arm_all_vehicles()],
+        lambda vehicle: vehicle.armed,
+        step_timeout,
+    )
+    steps["guided"] = run_step(
+        radio_link,
+        system_ids,
+        lambda: [radio_link.set_all_vehicles_flight_mode("GUIDED")],
+        lambda vehicle: vehicle.flight_mode == COPTER_MODE_GUIDED,
+        step_timeout,
+    )
+    steps["takeoff"] = run_step(
+        radio_link,
+        system_ids,
+        lambda: [
+            radio_link.copter_takeoff(system_id, TAKEOFF_ALTITUDE)
+            for system_id in system_ids
+        ],
+        lambda vehicle: vehicle.relative_altitude
+        >= TAKEOFF_ALTITUDE - ALTITUDE_TOLERANCE,
+        step_timeout,
+    )
+
+    targets = get_goto_targets(radio_link, system_ids)
+    steps["goto"] = run_step(
+        radio_link,
+        system_ids,
+        lambda: [
+            radio_link.goto_position(
+                system_id,
+                targets[system_id][0],
+                targets[system_id][1],
+                TAKEOFF_ALTITUDE,
+            )
+            for system_id in system_ids
+        ],
+        lambda vehicle: get_distance(vehicle, targets[vehicle.system_id])
+        < POSITION_TOLERANCE,
+        step_timeout,
+    )
+
+    goto_start_time = steps["goto"]["start_time"] - start_time
+    totals = {
+        system_id: goto_start_time + finish_time
+        for system_id, finish_time in steps["goto"]["finish_times"].items()
+        if finish_time is not None
+    }
+    return steps, totals
+
+
+def reset_fleet(radio_link: RadioLink, system_ids: List[int]) -> None:
+    """Land every vehicle back in STABILIZE, ready for the next run."""
+    radio_link.disarm_all_vehicles()
+    radio_link.set_all_vehicles_flight_mode("STABILIZE")
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline and any(
+        radio_link.vehicles[system_id].armed
+        or radio_link.vehicles[system_id].relative_altitude > ALTITUDE_TOLERANCE
+        for system_id in system_ids
+    ):
+        time.sleep(0.1)
+
+
+def percentiles(values: List[float]) -> str:
+    if not values:
+        return "no samples"
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return f"p50 {p50:6.2f}s  p95 {p95:6.2f}s  p99 {p99:6.2f}s"
+
+
+def benchmark_fleet(args: argparse.Namespace, vehicle_count: int, port: int) -> None:
+    fleet = FakeFleet(
+        vehicle_count,
+        port=port,
+        loss=args.loss,
+        delay=args.delay,
+        telemetry_rate=args.rate,
+        seed=1,
+    )
+    radio_link = None
+    try:
+        fleet.start()
+        radio_link = RadioLink(f"udpin:127.0.0.1:{port}", archive_dir=None)
+        if radio_link.master is None:
+            print("Could not connect to the fake fleet")
+            return
+        # Wait for every vehicle's position before using it for goto targets
+        time.sleep(1)
+        system_ids = sorted(radio_link.vehicles.keys())
+
+        step_times: Dict[str, List[float]] = {}
+        call_times: Dict[str, List[float]] = {}
+        unfinished: Dict[str, int] = {}
+        failed_calls: Dict[str, int] = {}
+        totals: List[float] = []
+        for run in range(args.runs):
+            if run:
+                reset_fleet(radio_link, system_ids)
+            steps, run_totals = run_scenario(radio_link, system_ids, args.step_timeout)
+
+            for name, step in steps.items():
+                call_times.setdefault(name, []).append(step["call_time"])
+                failed_calls[name] = failed_calls.get(name, 0) + step["failed_calls"]
+                for finish_time in step["finish_times"].values():
+                    if finish_time is None:
+                        unfinished[name] = unfinished.get(name, 0) + 1
+                    else:
+                        step_times.setdefault(name, []).append(finish_time)
+            totals.extend(run_totals.values())
+
+        print(
+            f"\n{len(system_ids)} vehicles, {args.runs} runs, "
+            f"{args.loss:.0%} loss, {args.delay * 1000:.0f}ms delay"
+        )
+        for name in ["arm", "guided", "takeoff", "goto"]:
+            print(
+                f"  {name + ':':<9}{percentiles(step_times.get(name, []))}  "
+                f"calls took {np.mean(call_times[name]):.2f}s, "
+                f"{failed_calls.get(name, 0)} failed, "
+                f"{unfinished.get(name, 0)} vehicles didn't finish"
+            )
+        print(f"  {'total:':<9}{percentiles(totals)}")
+    finally:
+        if radio_link is not None:
+            radio_link.close()
+        fleet.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--vehicles",
+        default="4,16,64,128",
+        help="Comma separated fleet sizes to run the scenario with",
+    )
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--port", type=int, default=14680)
+    parser.add_argument("--loss", type=float, default=0.02)
+    parser.add_argument("--delay", type=float, default=0.01, help="One-way delay in s")
+    parser.add_argument("--rate", type=float, default=10.0, help="Telemetry rate in Hz")
+    parser.add_argument(
+        "--step-timeout",
+        type=float,
+        default=STEP_TIMEOUT,
+        help="Give up on vehicles that haven't finished a step after this long",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    for index, vehicle_count in enumerate(
+        int(count) for count in args.vehicles.split(",")
+    ):
+        # A fresh port for each fleet so packets from the last one can't arrive
+        benchmark_fleet(args, vehicle_count, args.port + index)
+
+
+if __name__ == "__main__":
+    main()
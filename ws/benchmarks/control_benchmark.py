@@ -0,0 +1,297 @@
+"""
+Benchmark the local control ingress against Socket.IO for a controller on the
+same machine. Starts a fake fleet and the production server (serve.py) with
+the radio link's control ingress open, then measures:
+- how many setpoints a second each path gets into the setpoint streamer when
+  a controller sends them as fast as it can, one vehicle per message and the
+  whole fleet per message
+- the round trip of an arm command, from sending it to getting the result
+
+Both paths feed the same setpoint streamer and command methods, so the
+difference is the cost of JSON, Socket.IO and the web server.
+
+Run from the ws directory with:
+    python -m benchmarks.control_benchmark --vehicles 32
+"""
+
+import argparse
+import logging
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import socketio
+
+from app.control import (
+    ControlAction,
+    pack_command,
+    pack_position_setpoints,
+    unpack_result,
+)
+from benchmarks.fake_fleet import FakeFleet
+from benchmarks.load_test import wait_for_server
+
+RESULT_TIMEOUT = 5.0
+# Setpoints have all been handled once the count stops going up for this long
+SETTLE_TIME = 2.0
+ALTITUDE = 10.0
+
+
+class SocketIOController:
+    """Sends setpoints and commands the way a web client does."""
+
+    def __init__(self, url: str):
+        self.client = socketio.Client(reconnection=False)
+        self.results: Dict[str, dict] = {}
+        self.result_events: Dict[str, threading.Event] = {}
+        for event in [
+            "connect_to_radio_link_result",
+            "arm_vehicle_result",
+            "get_setpoint_status_result",
+        ]:
+            self.result_events[event] = threading.Event()
+            self.client.on(event, self._make_handler(event))
+        self.client.connect(url, transports=["websocket"])
+        self.client.emit("unsubscribe_telemetry", {})
+
+    def _make_handler(self, event: str) -> Callable:
+        def handle_result(message: dict) -> None:
+            self.results[event] = message
+            self.result_events[event].set()
+
+        return handle_result
+
+    def request(
+        self, event: str, data: Optional[dict] = None, timeout: float = RESULT_TIMEOUT
+    ) -> Optional[dict]:
+        result_event = f"{event}_result"
+        self.result_events[result_event].clear()
+        if data is None:
+            self.client.emit(event)
+        else:
+            self.client.emit(event, data)
+        if not self.result_events[result_event].wait(timeout):
+            return None
+        return self.results[result_event]
+
+    def send_setpoints(self, setpoints: List[Tuple[int, float, float, float]]) -> None:
+        self.client.emit(
+            "stream_setpoints",
+            {
+                "setpoints": [
+                    {
+                        "system_id": system_id,
+                        "latitude": latitude,
+                        "longitude": longitude,
+                        "altitude": altitude,
+                    }
+                    for system_id, latitude, longitude, altitude in setpoints
+                ]
+            },
+        )
+
+    def arm(self, system_id: int) -> bool:
+        result = self.request("arm_vehicle", {"system_id": system_id, "force": False})
+        return result is not None and result["success"]
+
+    def get_setpoint_updates(self) -> int:
+        result = self.request("get_setpoint_status", timeout=60)
+        return result["data"]["updates"] if result else 0
+
+
+class IngressController:
+    """Sends setpoints and commands to the control ingress over UDP."""
+
+    def __init__(self, port: int):
+        self.address = ("127.0.0.1", port)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.settimeout(RESULT_TIMEOUT)
+        self.sequence = 0
+
+    def _next_sequence(self) -> int:
+        self.sequence = (self.sequence + 1) % 65536
+        return self.sequence
+
+    def send_setpoints(self, setpoints: List[Tuple[int, float, float, float]]) -> None:
+        self.sock.sendto(
+            pack_position_setpoints(self._next_sequence(), setpoints), self.address
+        )
+
+    def arm(self, system_id: int) -> bool:
+        sequence = self._next_sequence()
+        self.sock.sendto(
+            pack_command(sequence, ControlAction.ARM, system_id), self.address
+        )
+        try:
+            while True:
+                result_sequence, success, _ = unpack_result(self.sock.recv(65535))
+                if result_sequence == sequence:
+                    return success
+        except socket.timeout:
+            return False
+
+
+Controller = Union[SocketIOController, IngressController]
+
+
+def measure_setpoints(
+    controller: Controller,
+    status: SocketIOController,
+    setpoints: List[Tuple[int, float, float, float]],
+    per_message: int,
+    duration: float,
+) -> Tuple[float, float]:
+    """
+    Send setpoints flat out, get the setpoints sent and accepted per second.
+    Socket.IO buffers what the server hasn't read yet, so accepting is timed
+    until the server has worked through everything sent.
+    """
+    messages = [
+        setpoints[i : i + per_message] for i in range(0, len(setpoints), per_message)
+    ]
+    start_updates = status.get_setpoint_updates()
+    sent = 0
+    start_time = time.monotonic()
+    while time.monotonic() - start_time < duration:
+        for message in messages:
+            controller.send_setpoints(message)
+            sent += len(message)
+    sent_rate = sent / (time.monotonic() - start_time)
+
+    accepted = 0
+    last_change_time = time.monotonic()
+    while accepted < sent and time.monotonic() - last_change_time < SETTLE_TIME:
+        updates = status.get_setpoint_updates() - start_updates
+        if updates != accepted:
+            accepted = updates
+            last_change_time = time.monotonic()
+        time.sleep(0.1)
+    return sent_rate, accepted / (last_change_time - start_time)
+
+
+def measure_commands(
+    controller: Controller, system_ids: List[int], count: int
+) -> Tuple[List[float], int]:
+    latencies = []
+    failures = 0
+    for i in range(count):
+        start_time = time.perf_counter()
+        if controller.arm(system_ids[i % len(system_ids)]):
+            latencies.append(time.perf_counter() - start_time)
+        else:
+            failures += 1
+    return latencies, failures
+
+
+def percentiles(values: List[float]) -> str:
+    if not values:
+        return "no samples"
+    p50, p95, p99 = np.percentile(np.array(values) * 1000, [50, 95, 99])
+    return f"p50 {p50:6.2f}ms  p95 {p95:6.2f}ms  p99 {p99:6.2f}ms"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vehicles", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--commands", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=4.0, help="Telemetry rate in Hz")
+    parser.add_argument("--link-process", action="store_true")
+    parser.add_argument("--server-port", type=int, default=4300)
+    parser.add_argument("--fleet-port", type=int, default=14670)
+    parser.add_argument("--control-port", type=int, default=14690)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    fleet = FakeFleet(
+        args.vehicles, port=args.fleet_port, telemetry_rate=args.rate, seed=1
+    )
+    url = f"http://127.0.0.1:{args.server_port}"
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "serve.py",
+            "--port",
+            str(args.server_port),
+            "--log-level",
+            "WARNING",
+        ]
+        + (["--link-process"] if args.link_process else [])
+    )
+    socketio_controller: Optional[SocketIOController] = None
+    try:
+        if not wait_for_server(url):
+            print(f"Could not reach the server at {url}")
+            return
+        fleet.start()
+
+        socketio_controller = SocketIOController(url)
+        connect_result = socketio_controller.request(
+            "connect_to_radio_link",
+            {
+                "connectionType": "network",
+                "port": f"udpin:127.0.0.1:{args.fleet_port}",
+                "archiveTelemetry": False,
+                "controlAddress": args.control_port,
+            },
+            timeout=15,
+        )
+        if not connect_result or not connect_result["success"]:
+            print("Server did not connect to the fleet")
+            return
+        system_ids = sorted(
+            vehicle["system_id"] for vehicle in connect_result["data"]["vehicles"]
+        )
+        setpoints = [
+            (
+                system_id,
+                fleet.vehicles[system_id].latitude,
+                fleet.vehicles[system_id].longitude,
+                ALTITUDE,
+            )
+            for system_id in system_ids
+        ]
+
+        # Status requests on their own connection, so they don't wait behind
+        # the setpoints being measured
+        status_controller = SocketIOController(url)
+        controllers: Dict[str, Controller] = {
+            "socket.io": socketio_controller,
+            "ingress": IngressController(args.control_port),
+        }
+        print(f"{len(system_ids)} vehicles against {url}")
+        for per_message, label in [(1, "1 per message"), (len(setpoints), "fleet")]:
+            for name, controller in controllers.items():
+                sent, accepted = measure_setpoints(
+                    controller,
+                    status_controller,
+                    setpoints,
+                    per_message,
+                    args.duration,
+                )
+                print(
+                    f"  setpoints, {label + ':':<15}{name:<10}"
+                    f"{sent:9.0f}/s sent {accepted:9.0f}/s accepted"
+                )
+        for name, controller in controllers.items():
+            latencies, failures = measure_commands(
+                controller, system_ids, args.commands
+            )
+            print(
+                f"  arm round trip:{'':<11}{name:<10}{percentiles(latencies)}, "
+                f"{failures} failed"
+            )
+    finally:
+        if socketio_controller is not None and socketio_controller.client.connected:
+            socketio_controller.client.disconnect()
+        fleet.stop()
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Benchmark the fleet endurance estimate against fitting each vehicle's battery
+window on its own.
+
+Run from the ws directory with:
+    python -m benchmarks.endurance_benchmark --vehicles 500
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from app.endurance import (
+    RESERVE_PERCENT,
+    WINDOW_DURATION,
+    WINDOW_SIZE,
+    predict_endurance,
+)
+
+
+def create_windows(vehicle_count: int, seed: int) -> tuple:
+    """Battery windows sampled at 2 Hz, draining at different rates with noise."""
+    rng = np.random.default_rng(seed)
+    now = 1000.0
+    times = np.tile(now - np.arange(WINDOW_SIZE)[::-1] / 2, (vehicle_count, 1))
+    drain_rates = rng.uniform(0, 0.2, (vehicle_count, 1))
+    remaining = 90 - drain_rates * (times - times[:, :1])
+    remaining = np.round(remaining + rng.normal(0, 0.3, remaining.shape))
+    # Some vehicles joined recently and have only part of a window
+    for row in rng.choice(vehicle_count, vehicle_count // 10, replace=False):
+        times[row, : rng.integers(WINDOW_SIZE)] = np.nan
+    return now, times, remaining
+
+
+def predict_each(times: np.ndarray, remaining: np.ndarray, now: float) -> np.ndarray:
+    endurance = np.full(len(times), np.nan)
+    for row in range(len(times)):
+        valid = np.isfinite(times[row]) & (times[row] > now - WINDOW_DURATION)
+        if valid.sum() < 5:
+            continue
+        slope, intercept = np.polyfit(times[row, valid] - now, remaining[row, valid], 1)
+        endurance[row] = (
+            max(intercept - RESERVE_PERCENT, 0) / -slope if slope < 0 else np.inf
+        )
+    return endurance
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vehicles", type=int, default=500)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    now, times, remaining = create_windows(args.vehicles, args.seed)
+
+    _, endurance = predict_endurance(
+        times, remaining, now, RESERVE_PERCENT, WINDOW_DURATION
+    )
+    assert np.allclose(
+        endurance, predict_each(times, remaining, now), equal_nan=True
+    ), "Fleet and per vehicle estimates differ"
+
+    start_time = time.perf_counter()
+    for _ in range(args.iterations):
+        predict_endurance(times, remaining, now, RESERVE_PERCENT, WINDOW_DURATION)
+    fleet_time = (time.perf_counter() - start_time) / args.iterations
+
+    start_time = time.perf_counter()
+    for _ in range(args.iterations):
+        predict_each(times, remaining, now)
+    each_time = (time.perf_counter() - start_time) / args.iterations
+
+    print(f"{args.vehicles} vehicles, {WINDOW_SIZE} samples each")
+    print(f"Whole fleet at once: {fleet_time * 1000:.2f}ms per estimate")
+    print(f"One vehicle at once: {each_time * 1000:.2f}ms per estimate")
+
+
+if __name__ == "__main__":
+    main()
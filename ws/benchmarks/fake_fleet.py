@@ -0,0 +1,575 @@
+"""
+A lightweight simulated fleet of ArduPilot style vehicles sharing one UDP
+MAVLink stream, for benchmarking the backend without running SITL.
+
+Every vehicle sends heartbeats and telemetry, answers COMMAND_LONGs, follows
+guided position targets and speaks the mission upload and parameter
+protocols. Packet loss and one-way delay can be added in both directions.
+
+Run from the ws directory to fly the GUI against it:
+    python -m benchmarks.fake_fleet --vehicles 20 --port 14550
+"""
+
+import argparse
+import heapq
+import itertools
+import math
+import random
+import socket
+import struct
+import threading
+import time
+import zlib
+from typing import Callable, Dict, List, Optional, Tuple
+
+from pymavlink.dialects.v20 import ardupilotmega as mavlink2
+
+COPTER_MODE_STABILIZE = 0
+COPTER_MODE_GUIDED = 4
+EARTH_RADIUS = 6378137.0
+MISSION_REQUEST_TIMEOUT = 1.0
+PARAM_COUNT = 1000
+FLIGHT_SW_VERSION = 0x04050700
+
+
+class FakeLink:
+    """UDP link shared by the whole fleet that simulates loss and delay."""
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        loss: float = 0.0,
+        delay: float = 0.0,
+        seed: int = 0,
+    ):
+        self.address = (host, port)
+        self.loss = loss
+        self.delay = delay
+        self.random = random.Random(seed)
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.settimeout(0.1)
+
+        self.scheduled: List[Tuple[float, int, Callable]] = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+
+        self.packets_sent = 0
+        self.packets_dropped = 0
+
+    def dropped(self) -> bool:
+        if self.loss > 0 and self.random.random() < self.loss:
+            self.packets_dropped += 1
+            return True
+        return False
+
+    def schedule(self, callback: Callable) -> None:
+        if self.delay <= 0:
+            callback()
+            return
+
+        with self.condition:
+            heapq.heappush(
+                self.scheduled,
+                (time.monotonic() + self.delay, next(self.counter), callback),
+            )
+            self.condition.notify()
+
+    def write(self, buf: bytes) -> None:
+        if self.dropped():
+            return
+        self.schedule(lambda: self._send(bytes(buf)))
+
+    def _send(self, buf: bytes) -> None:
+        try:
+            self.sock.sendto(buf, self.address)
+            self.packets_sent += 1
+        except OSError:
+            pass
+
+    def run_scheduler(self, is_running: threading.Event) -> None:
+        while is_running.is_set():
+            with self.condition:
+                if not self.scheduled:
+                    self.condition.wait(timeout=0.1)
+                    continue
+                due_time, _, callback = self.scheduled[0]
+                wait_time = due_time - time.monotonic()
+                if wait_time > 0:
+                    self.condition.wait(timeout=wait_time)
+                    continue
+                heapq.heappop(self.scheduled)
+            callback()
+
+
+class FakeVehicle:
+    def __init__(
+        self,
+        system_id: int,
+        link: FakeLink,
+        latitude: float,
+        longitude: float,
+    ):
+        self.system_id = system_id
+        self.mav = mavlink2.MAVLink(link, srcSystem=system_id, srcComponent=1)
+        self.boot_time = time.monotonic()
+
+        self.armed = False
+        self.mode = COPTER_MODE_STABILIZE
+        self.latitude = latitude
+        self.longitude = longitude
+        self.altitude = 0.0
+        self.heading = 0.0
+        self.velocity_north = 0.0
+        self.velocity_east = 0.0
+        self.target: Optional[Tuple[float, float, float]] = None
+        self.speed = 5.0
+        self.climb_rate = 2.0
+
+        self.battery_voltage = 12.6
+        self.battery_remaining = 100.0
+
+        self.mission: List[mavlink2.MAVLink_mission_item_int_message] = []
+        self.mission_count: Optional[int] = None
+        self.mission_upload: List[
+            Optional[mavlink2.MAVLink_mission_item_int_message]
+        ] = []
+        self.mission_next_seq = 0
+        self.mission_last_request_time = 0.0
+
+        # Roughly the size of an ArduCopter parameter table
+        self.param_names = [f"SIM_PARAM_{i:04d}" for i in range(PARAM_COUNT)]
+        self.params = {name: float(i % 50) for i, name in enumerate(self.param_names)}
+        self.param_stream_next: Optional[int] = None
+
+    def time_boot_ms(self) -> int:
+        return int((time.monotonic() - self.boot_time) * 1000)
+
+    def send_heartbeat(self) -> None:
+        base_mode = mavlink2.MAV_MODE_FLAG_CUSTOM_MODE_ENABLED
+        if self.armed:
+            base_mode |= mavlink2.MAV_MODE_FLAG_SAFETY_ARMED
+        self.mav.heartbeat_send(
+            mavlink2.MAV_TYPE_QUADROTOR,
+            mavlink2.MAV_AUTOPILOT_ARDUPILOTMEGA,
+            base_mode,
+            self.mode,
+            mavlink2.MAV_STATE_ACTIVE if self.armed else mavlink2.MAV_STATE_STANDBY,
+        )
+
+    def send_telemetry(self) -> None:
+        self.mav.global_position_int_send(
+            self.time_boot_ms(),
+            int(self.latitude * 1e7),
+            int(self.longitude * 1e7),
+            int((584 + self.altitude) * 1000),
+            int(self.altitude * 1000),
+            int(self.velocity_north * 100),
+            int(self.velocity_east * 100),
+            0,
+            int(self.heading * 100) % 36000,
+        )
+        self.mav.attitude_send(
+            self.time_boot_ms(), 0, 0, math.radians(self.heading), 0, 0, 0
+        )
+        self.mav.vfr_hud_send(
+            0,
+            math.hypot(self.velocity_north, self.velocity_east),
+            int(self.heading),
+            50 if self.armed else 0,
+            self.altitude,
+            0,
+        )
+
+    def send_slow_telemetry(self) -> None:
+        current = 1500 if self.armed else 50  # cA
+        self.mav.sys_status_send(
+            0,
+            0,
+            0,
+            200,
+            int(self.battery_voltage * 1000),
+            current,
+            int(self.battery_remaining),
+            0,
+            0,
+            0,
+            0,
+            0,
+            0,
+        )
+        self.mav.battery_status_send(
+            0,
+            mavlink2.MAV_BATTERY_FUNCTION_ALL,
+            mavlink2.MAV_BATTERY_TYPE_LIPO,
+            2500,
+            [int(self.battery_voltage * 1000)] + [65535] * 9,
+            current,
+            -1,
+            -1,
+            int(self.battery_remaining),
+        )
+
+    def update(self, dt: float) -> None:
+        if self.armed:
+            self.battery_voltage = max(self.battery_voltage - 0.002 * dt, 10.5)
+            self.battery_remaining = max(self.battery_remaining - 0.05 * dt, 0)
+
+        if not self.armed or self.mode != COPTER_MODE_GUIDED or self.target is None:
+            self.velocity_north = self.velocity_east = 0.0
+            return
+
+        target_lat, target_lon, target_alt = self.target
+        north = math.radians(target_lat - self.latitude) * EARTH_RADIUS
+        east = (
+            math.radians(target_lon - self.longitude)
+            * EARTH_RADIUS
+            * math.cos(math.radians(self.latitude))
+        )
+        distance = math.hypot(north, east)
+        step = min(self.speed * dt, distance)
+        if distance > 0.01:
+            self.velocity_north = self.speed * north / distance
+            self.velocity_east = self.speed * east / distance
+            self.heading = math.degrees(math.atan2(east, north)) % 360
+            self.latitude += math.degrees(step * north / distance / EARTH_RADIUS)
+            self.longitude += math.degrees(
+                step
+                * east
+                / distance
+                / (EARTH_RADIUS * math.cos(math.radians(self.latitude)))
+            )
+        else:
+            self.velocity_north = self.velocity_east = 0.0
+
+        climb = target_alt - self.altitude
+        self.altitude += max(-self.climb_rate * dt, min(self.climb_rate * dt, climb))
+
+    def get_param_hash(self) -> int:
+        crc = 0
+        for name in self.param_names:
+            crc = zlib.crc32(name.encode(), crc)
+            crc = zlib.crc32(struct.pack("<f", self.params[name]), crc)
+        return crc
+
+    def send_param(self, index: int) -> None:
+        name = self.param_names[index]
+        self.mav.param_value_send(
+            name.encode(),
+            self.params[name],
+            mavlink2.MAV_PARAM_TYPE_REAL32,
+            len(self.param_names),
+            index,
+        )
+
+    def stream_params(self, count: int) -> None:
+        """Send the next few params of a PARAM_REQUEST_LIST, like ArduPilot does."""
+        if self.param_stream_next is None:
+            return
+        end = min(self.param_stream_next + count, len(self.param_names))
+        for index in range(self.param_stream_next, end):
+            self.send_param(index)
+        self.param_stream_next = end if end < len(self.param_names) else None
+
+    def handle_param_request_read(
+        self, msg: mavlink2.MAVLink_param_request_read_message
+    ) -> None:
+        if msg.param_index >= 0:
+            if msg.param_index < len(self.param_names):
+                self.send_param(msg.param_index)
+        elif msg.param_id == "_HASH_CHECK":
+            hash_value = struct.unpack("<f", struct.pack("<I", self.get_param_hash()))
+            self.mav.param_value_send(
+                b"_HASH_CHECK",
+                hash_value[0],
+                mavlink2.MAV_PARAM_TYPE_UINT32,
+                len(self.param_names),
+                65535,
+            )
+        elif msg.param_id in self.params:
+            self.send_param(self.param_names.index(msg.param_id))
+
+    def handle_param_set(self, msg: mavlink2.MAVLink_param_set_message) -> None:
+        if msg.param_id not in self.params:
+            return
+        self.params[msg.param_id] = msg.param_value
+        self.send_param(self.param_names.index(msg.param_id))
+
+    def send_autopilot_version(self) -> None:
+        self.mav.autopilot_version_send(
+            mavlink2.MAV_PROTOCOL_CAPABILITY_MAVLINK2
+            | mavlink2.MAV_PROTOCOL_CAPABILITY_MISSION_INT,
+            FLIGHT_SW_VERSION,
+            0,
+            0,
+            0,
+            [0x66, 0x61, 0x6B, 0x65, 0, 0, 0, 0],
+            [0] * 8,
+            [0] * 8,
+            0,
+            0,
+            self.system_id,
+        )
+
+    def acknowledge(self, command: int, result: int) -> None:
+        self.mav.command_ack_send(command, result)
+
+    def handle_command_long(self, msg: mavlink2.MAVLink_command_long_message) -> None:
+        if msg.command == mavlink2.MAV_CMD_COMPONENT_ARM_DISARM:
+            self.armed = msg.param1 == 1
+            if not self.armed:
+                self.altitude = 0.0
+                self.target = None
+            self.acknowledge(msg.command, mavlink2.MAV_RESULT_ACCEPTED)
+            self.send_heartbeat()
+        elif msg.command == mavlink2.MAV_CMD_DO_SET_MODE:
+            self.mode = int(msg.param2)
+            self.acknowledge(msg.command, mavlink2.MAV_RESULT_ACCEPTED)
+            self.send_heartbeat()
+        elif msg.command == mavlink2.MAV_CMD_NAV_TAKEOFF:
+            if not self.armed or self.mode != COPTER_MODE_GUIDED:
+                self.acknowledge(msg.command, mavlink2.MAV_RESULT_FAILED)
+                return
+            self.target = (self.latitude, self.longitude, msg.param7)
+            self.acknowledge(msg.command, mavlink2.MAV_RESULT_ACCEPTED)
+        elif msg.command == mavlink2.MAV_CMD_SET_MESSAGE_INTERVAL:
+            self.acknowledge(msg.command, mavlink2.MAV_RESULT_ACCEPTED)
+        elif (
+            msg.command == mavlink2.MAV_CMD_REQUEST_MESSAGE
+            and int(msg.param1) == mavlink2.MAVLINK_MSG_ID_AUTOPILOT_VERSION
+        ):
+            self.acknowledge(msg.command, mavlink2.MAV_RESULT_ACCEPTED)
+            self.send_autopilot_version()
+        else:
+            self.acknowledge(msg.command, mavlink2.MAV_RESULT_UNSUPPORTED)
+
+    def request_mission_item(self) -> None:
+        self.mission_last_request_time = time.monotonic()
+        self.mav.mission_request_int_send(
+            255,
+            mavlink2.MAV_COMP_ID_MISSIONPLANNER,
+            self.mission_next_seq,
+            mavlink2.MAV_MISSION_TYPE_MISSION,
+        )
+
+    def handle_mission_count(self, msg: mavlink2.MAVLink_mission_count_message) -> None:
+        self.mission_count = msg.count
+        self.mission_upload = [None] * msg.count
+        self.mission_next_seq = 0
+        if msg.count == 0:
+            self.mission = []
+            self.mission_count = None
+            self.mav.mission_ack_send(
+                255,
+                mavlink2.MAV_COMP_ID_MISSIONPLANNER,
+                mavlink2.MAV_MISSION_ACCEPTED,
+                mavlink2.MAV_MISSION_TYPE_MISSION,
+            )
+            return
+        self.request_mission_item()
+
+    def handle_mission_item_int(
+        self, msg: mavlink2.MAVLink_mission_item_int_message
+    ) -> None:
+        if msg.current == 2:
+            # Guided mode target rather than a mission item
+            if self.mode == COPTER_MODE_GUIDED:
+                self.target = (msg.x / 1e7, msg.y / 1e7, msg.z)
+            return
+
+        if self.mission_count is None or msg.seq != self.mission_next_seq:
+            return
+
+        self.mission_upload[msg.seq] = msg
+        self.mission_next_seq += 1
+        if self.mission_next_seq < self.mission_count:
+            self.request_mission_item()
+            return
+
+        self.mission = [item for item in self.mission_upload if item is not None]
+        self.mission_count = None
+        self.mav.mission_ack_send(
+            255,
+            mavlink2.MAV_COMP_ID_MISSIONPLANNER,
+            mavlink2.MAV_MISSION_ACCEPTED,
+            mavlink2.MAV_MISSION_TYPE_MISSION,
+        )
+
+    def handle_message(self, msg: mavlink2.MAVLink_message) -> None:
+        msg_type = msg.get_type()
+        if msg_type == "COMMAND_LONG":
+            self.handle_command_long(msg)
+        elif msg_type == "SET_POSITION_TARGET_GLOBAL_INT":
+            position_ignored = (
+                msg.type_mask & mavlink2.POSITION_TARGET_TYPEMASK_X_IGNORE
+            )
+            if self.mode == COPTER_MODE_GUIDED and not position_ignored:
+                self.target = (msg.lat_int / 1e7, msg.lon_int / 1e7, msg.alt)
+        elif msg_type == "MISSION_COUNT":
+            self.handle_mission_count(msg)
+        elif msg_type == "MISSION_ITEM_INT":
+            self.handle_mission_item_int(msg)
+        elif msg_type == "PARAM_REQUEST_LIST":
+            self.param_stream_next = 0
+        elif msg_type == "PARAM_REQUEST_READ":
+            self.handle_param_request_read(msg)
+        elif msg_type == "PARAM_SET":
+            self.handle_param_set(msg)
+        elif msg_type == "TIMESYNC" and msg.tc1 == 0:
+            self.mav.timesync_send(
+                int((time.monotonic() - self.boot_time) * 1e9), msg.ts1
+            )
+
+    def check_timeouts(self) -> None:
+        if (
+            self.mission_count is not None
+            and time.monotonic() - self.mission_last_request_time
+            > MISSION_REQUEST_TIMEOUT
+        ):
+            self.request_mission_item()
+
+
+class FakeFleet:
+    def __init__(
+        self,
+        vehicle_count: int,
+        host: str = "127.0.0.1",
+        port: int = 14550,
+        loss: float = 0.0,
+        delay: float = 0.0,
+        telemetry_rate: float = 4.0,
+        first_system_id: int = 1,
+        seed: int = 0,
+        param_rate: float = 200.0,
+    ):
+        self.link = FakeLink(host, port, loss, delay, seed)
+        self.telemetry_rate = telemetry_rate
+        self.param_rate = param_rate
+
+        self.vehicles: Dict[int, FakeVehicle] = {}
+        for i in range(vehicle_count):
+            system_id = first_system_id + i
+            row, column = divmod(i, 10)
+            self.vehicles[system_id] = FakeVehicle(
+                system_id,
+                self.link,
+                -35.363 - row * 0.0002,
+                149.165 + column * 0.0002,
+            )
+
+        self.parser = mavlink2.MAVLink(None)
+        self.parser.robust_parsing = True
+
+        self.is_running = threading.Event()
+        self.threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        self.is_running.set()
+        for target in (self._receive, self._simulate, self.link.run_scheduler):
+            thread = threading.Thread(
+                target=target,
+                args=(self.is_running,) if target == self.link.run_scheduler else (),
+                daemon=True,
+            )
+            thread.start()
+            self.threads.append(thread)
+
+        # Send the first heartbeats straight away so the GCS finds every vehicle
+        for vehicle in self.vehicles.values():
+            vehicle.send_heartbeat()
+
+    def stop(self) -> None:
+        self.is_running.clear()
+        for thread in self.threads:
+            thread.join(timeout=1)
+        self.link.sock.close()
+
+    def _dispatch(self, msg: mavlink2.MAVLink_message) -> None:
+        target_system = getattr(msg, "target_system", 0)
+        if target_system == 0:
+            targets = list(self.vehicles.values())
+        elif target_system in self.vehicles:
+            targets = [self.vehicles[target_system]]
+        else:
+            return
+
+        for vehicle in targets:
+            vehicle.handle_message(msg)
+
+    def _receive(self) -> None:
+        while self.is_running.is_set():
+            try:
+                data, _ = self.link.sock.recvfrom(65535)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+
+            try:
+                messages = self.parser.parse_buffer(data) or []
+            except mavlink2.MAVError:
+                continue
+
+            for msg in messages:
+                if msg.get_type() == "BAD_DATA" or self.link.dropped():
+                    continue
+                self.link.schedule(lambda msg=msg: self._dispatch(msg))
+
+    def _simulate(self) -> None:
+        interval = 1 / self.telemetry_rate
+        params_per_tick = max(int(self.param_rate * interval), 1)
+        last_update = time.monotonic()
+        last_heartbeat = last_update
+        while self.is_running.is_set():
+            now = time.monotonic()
+            dt = now - last_update
+            last_update = now
+            send_heartbeat = now - last_heartbeat >= 1
+            if send_heartbeat:
+                last_heartbeat = now
+
+            for vehicle in list(self.vehicles.values()):
+                vehicle.update(dt)
+                vehicle.send_telemetry()
+                vehicle.check_timeouts()
+                vehicle.stream_params(params_per_tick)
+                if send_heartbeat:
+                    vehicle.send_heartbeat()
+                    vehicle.send_slow_telemetry()
+
+            time.sleep(max(interval - (time.monotonic() - now), 0))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vehicles", type=int, default=4)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=14550)
+    parser.add_argument("--loss", type=float, default=0.0, help="Loss probability")
+    parser.add_argument("--delay", type=float, default=0.0, help="One-way delay in s")
+    parser.add_argument("--rate", type=float, default=4.0, help="Telemetry rate in Hz")
+    args = parser.parse_args()
+
+    fleet = FakeFleet(
+        args.vehicles,
+        args.host,
+        args.port,
+        loss=args.loss,
+        delay=args.delay,
+        telemetry_rate=args.rate,
+    )
+    fleet.start()
+    print(f"Simulating {args.vehicles} vehicles to {args.host}:{args.port}")
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fleet.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Benchmark how many telemetry messages reach the web process's listeners per
+second while the web process is busy, with the radio link in the same process
+and in its own process (RadioLinkProcess). Busy threads encoding JSON stand in
+for Socket.IO clients being served.
+
+The link process only helps when there is a spare core for it to run on.
+
+Run from the ws directory with:
+    python -m benchmarks.link_process_benchmark --vehicles 100 --busy-threads 4
+"""
+
+import argparse
+import json
+import logging
+import threading
+import time
+from typing import Callable, Dict
+
+from app.link_process import RadioLinkProcess
+from app.radio_link import RadioLink
+from app.snapshot import TELEMETRY_MESSAGES
+from benchmarks.fake_fleet import FakeFleet
+
+
+def keep_busy(is_running: threading.Event) -> None:
+    payload = {"data": [{"lat": i, "lon": i * 2, "alt": i * 3} for i in range(200)]}
+    while is_running.is_set():
+        json.dumps(payload)
+
+
+def measure(
+    create_link: Callable, busy_threads: int, duration: float
+) -> Dict[str, float]:
+    link = create_link()
+    if link.master is None:
+        raise RuntimeError("Could not connect to the fake fleet")
+
+    counts = {"messages": 0}
+
+    def count_message(message: object) -> None:
+        counts["messages"] += 1
+
+    for message_type in TELEMETRY_MESSAGES:
+        link.add_message_listener(message_type, count_message)
+
+    is_running = threading.Event()
+    is_running.set()
+    threads = [
+        threading.Thread(target=keep_busy, args=(is_running,), daemon=True)
+        for _ in range(busy_threads)
+    ]
+    for thread in threads:
+        thread.start()
+
+    time.sleep(1)
+    start_count = counts["messages"]
+    time.sleep(duration)
+    rate = (counts["messages"] - start_count) / duration
+
+    is_running.clear()
+    for thread in threads:
+        thread.join()
+    link.close()
+    return {"rate": rate}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vehicles", type=int, default=100)
+    parser.add_argument("--rate", type=float, default=10.0, help="Telemetry rate in Hz")
+    parser.add_argument("--busy-threads", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--port", type=int, default=14680)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    fleet = FakeFleet(args.vehicles, port=args.port, telemetry_rate=args.rate, seed=1)
+    fleet.start()
+    address = f"udpin:127.0.0.1:{args.port}"
+    try:
+        for name, create_link in [
+            ("same process", lambda: RadioLink(address, archive_dir=None)),
+            ("link process", lambda: RadioLinkProcess(address, archive_dir=None)),
+        ]:
+            result = measure(create_link, args.busy_threads, args.duration)
+            print(
+                f"{name:13} {result['rate']:8.0f} messages/s with "
+                f"{args.busy_threads} busy threads"
+            )
+    finally:
+        fleet.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,645 @@
+"""
+Load test the backend with many Socket.IO clients watching a simulated fleet.
+
+Starts a fake fleet and the production server (serve.py), opens the radio
+link from a control client and then runs each client in its own process. A
+client subscribes to some or all of the telemetry and sends a scripted mix of
+requests, one at a time, while measuring:
+- the round trip of each kind of request and how many got no reply
+- how old GLOBAL_POSITION_INT messages are when they arrive, from the fake
+  vehicle's send time, and how many never arrived
+- the telemetry rate
+and the server's CPU use and memory (with its link process, if it has one).
+
+Run from the ws directory with:
+    python -m benchmarks.load_test --clients 12 --vehicles 50
+
+Pass a list of client counts to step through them against the same server
+and find where it stops keeping up:
+    python -m benchmarks.load_test --clients 4,8,16,32,64
+
+Requests are picked at random with the given weights out of ACTIONS:
+    python -m benchmarks.load_test --actions is_connected_to_radio_link:5,goto_position:1
+
+Pass --replay to play a telemetry log (a .tlog from a ground station) to the
+server instead of running the fake fleet. Nothing answers commands then, and
+telemetry latency and losses aren't measured as the send times aren't known.
+
+Pass --link-process to run the server's radio link in its own process.
+
+Pass --url to test a server that is already running instead, for example the
+development server started with python app.py:
+    python -m benchmarks.load_test --url http://127.0.0.1:4237
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import socketio
+import websocket
+from pymavlink import mavutil
+
+from benchmarks.fake_fleet import FakeFleet
+
+REQUEST_INTERVAL = 0.2
+REQUEST_TIMEOUT = 5.0
+SETTLE_TIME = 2.0
+ORIGIN_LATITUDE = -35.363
+ORIGIN_LONGITUDE = 149.165
+
+# A stage has degraded once telemetry per client falls this far below the
+# first stage, or requests take longer than --max-request-p95
+MIN_TELEMETRY_RATIO = 0.9
+
+# Requests a client can send, from the system ID it's working on to the
+# event's argument (None for events without one)
+ACTIONS: Dict[str, Callable[[int], Optional[dict]]] = {
+    "is_connected_to_radio_link": lambda system_id: None,
+    "get_fleet_snapshot": lambda system_id: {},
+    "get_fleet_alerts": lambda system_id: {},
+    "get_telemetry_latency": lambda system_id: {"system_ids": [system_id]},
+    "query_nearest_vehicles": lambda system_id: {
+        "latitude": ORIGIN_LATITUDE,
+        "longitude": ORIGIN_LONGITUDE,
+        "count": 5,
+    },
+    "arm_vehicle": lambda system_id: {"system_id": system_id, "force": False},
+    "disarm_vehicle": lambda system_id: {"system_id": system_id, "force": False},
+    "set_vehicle_flight_mode": lambda system_id: {
+        "system_id": system_id,
+        "flight_mode": 4,  # GUIDED
+    },
+    "goto_position": lambda system_id: {
+        "system_id": system_id,
+        "latitude": ORIGIN_LATITUDE + random.uniform(-0.001, 0.001),
+        "longitude": ORIGIN_LONGITUDE + random.uniform(-0.001, 0.001),
+        "altitude": 20,
+    },
+}
+DEFAULT_ACTIONS = "is_connected_to_radio_link:1"
+
+
+def parse_actions(actions: str) -> List[Tuple[str, float]]:
+    """Parse "event:weight,event:weight" into a list of events and weights."""
+    parsed = []
+    for action in actions.split(","):
+        event, _, weight = action.partition(":")
+        if event not in ACTIONS:
+            raise argparse.ArgumentTypeError(
+                f"Unknown action {event}, choose from {', '.join(ACTIONS)}"
+            )
+        parsed.append((event, float(weight or 1)))
+    return parsed
+
+
+class LoadTestClient:
+    """
+    A minimal Socket.IO client speaking the websocket transport directly, each
+    one runs in its own process. Only the messages used for latencies are
+    decoded, so on a small machine the clients don't starve the server.
+    """
+
+    def __init__(
+        self,
+        index: int,
+        boot_times: Dict[int, float],
+        system_ids: List[int],
+        actions: List[Tuple[str, float]],
+        subscription: Optional[dict],
+        telemetry_rate: float,
+    ):
+        self.index = index
+        self.boot_times = boot_times
+        self.system_ids = system_ids
+        self.actions = actions
+        self.subscription = subscription
+        self.telemetry_rate = telemetry_rate
+        self.random = random.Random(index)
+
+        self.telemetry_count = 0
+        self.telemetry_latencies: List[float] = []
+        self.telemetry_missed = 0
+        self.last_time_boot_ms: Dict[int, int] = {}
+        self.request_latencies: Dict[str, List[float]] = {}
+        self.request_failures: Dict[str, int] = {}
+        self.request_timeouts: Dict[str, int] = {}
+        self.pending_event: Optional[str] = None
+        self.request_sent_time = 0.0
+        self.recording = False
+
+    def handle_telemetry(self, frame: str) -> None:
+        self.telemetry_count += 1
+        if '"GLOBAL_POSITION_INT"' not in frame:
+            return
+
+        data = json.loads(frame[2:])[1]["data"]
+        system_id = data["system_id"]
+        boot_time = self.boot_times.get(system_id)
+        if boot_time is None:
+            return
+
+        # The monotonic clock is shared between processes on Linux
+        sent_time = boot_time + data["time_boot_ms"] / 1000
+        self.telemetry_latencies.append(time.monotonic() - sent_time)
+
+        # Gaps in the vehicle's send times are messages that never made it
+        last_time_boot_ms = self.last_time_boot_ms.get(system_id)
+        if last_time_boot_ms is not None:
+            gap = (data["time_boot_ms"] - last_time_boot_ms) / 1000
+            self.telemetry_missed += max(round(gap * self.telemetry_rate) - 1, 0)
+        self.last_time_boot_ms[system_id] = data["time_boot_ms"]
+
+    def handle_result(self, frame: str) -> None:
+        if self.pending_event is None or not frame.startswith(
+            f'42["{self.pending_event}_result"'
+        ):
+            return
+
+        event = self.pending_event
+        self.request_latencies.setdefault(event, []).append(
+            time.monotonic() - self.request_sent_time
+        )
+        if not json.loads(frame[2:])[1].get("success", True):
+            self.request_failures[event] = self.request_failures.get(event, 0) + 1
+        self.pending_event = None
+
+    def handle_frame(self, connection: websocket.WebSocket, frame: str) -> None:
+        if frame == "2":
+            # Engine.IO ping
+            connection.send("3")
+        elif not self.recording:
+            return
+        elif frame.startswith('42["telemetry_message"'):
+            self.handle_telemetry(frame)
+        elif frame.startswith('42["'):
+            self.handle_result(frame)
+
+    def send_request(self, connection: websocket.WebSocket) -> None:
+        # Only one request in flight at a time, a lost reply is given up on
+        if self.pending_event is not None:
+            if time.monotonic() - self.request_sent_time < REQUEST_TIMEOUT:
+                return
+            self.request_timeouts[self.pending_event] = (
+                self.request_timeouts.get(self.pending_event, 0) + 1
+            )
+
+        events, weights = zip(*self.actions)
+        event = self.random.choices(events, weights)[0]
+        argument = ACTIONS[event](self.random.choice(self.system_ids))
+
+        self.pending_event = event
+        self.request_sent_time = time.monotonic()
+        connection.send(
+            f"42{json.dumps([event] if argument is None else [event, argument])}"
+        )
+
+    def run(self, url: str, start_time: float, duration: float) -> dict:
+        connection = websocket.create_connection(
+            f"{url.replace('http', 'ws', 1)}/socket.io/?EIO=4&transport=websocket"
+        )
+        try:
+            connection.recv()  # Engine.IO open packet
+            connection.send("40")  # Connect to the default namespace
+            if self.subscription is not None:
+                connection.send(
+                    f"42{json.dumps(['subscribe_telemetry', self.subscription])}"
+                )
+            connection.settimeout(REQUEST_INTERVAL / 4)
+
+            last_request_time = 0.0
+            while time.monotonic() - start_time < duration:
+                now = time.monotonic()
+                self.recording = now >= start_time
+                if self.recording and now - last_request_time >= REQUEST_INTERVAL:
+                    last_request_time = now
+                    self.send_request(connection)
+
+                try:
+                    frame = connection.recv()
+                except websocket.WebSocketTimeoutException:
+                    continue
+                if isinstance(frame, str):
+                    self.handle_frame(connection, frame)
+        finally:
+            connection.close()
+
+        if self.pending_event is not None:
+            self.request_timeouts[self.pending_event] = (
+                self.request_timeouts.get(self.pending_event, 0) + 1
+            )
+
+        return {
+            "telemetry_rate": self.telemetry_count / duration,
+            "telemetry_latencies": self.telemetry_latencies,
+            "telemetry_missed": self.telemetry_missed,
+            "request_latencies": self.request_latencies,
+            "request_failures": self.request_failures,
+            "request_timeouts": self.request_timeouts,
+        }
+
+
+def run_client(
+    index: int,
+    url: str,
+    client_settings: dict,
+    start_time: float,
+    duration: float,
+    results: multiprocessing.Queue,
+) -> None:
+    logging.basicConfig(level=logging.WARNING)
+    try:
+        results.put(
+            LoadTestClient(index, **client_settings).run(url, start_time, duration)
+        )
+    except Exception as e:
+        results.put({"error": f"Client {index} failed: {e}"})
+
+
+def replay_log(path: str, port: int, is_running: threading.Event) -> None:
+    """Send the messages in a telemetry log to the server at their recorded pace, looping."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    while is_running.is_set():
+        log = mavutil.mavlink_connection(path)
+        first_timestamp: Optional[float] = None
+        start_time = time.monotonic()
+        while is_running.is_set():
+            msg = log.recv_match()
+            if msg is None:
+                break
+            if msg.get_type() == "BAD_DATA":
+                continue
+            if first_timestamp is None:
+                first_timestamp = msg._timestamp
+            delay = msg._timestamp - first_timestamp - (time.monotonic() - start_time)
+            if delay > 0:
+                time.sleep(delay)
+            sock.sendto(msg.get_msgbuf(), ("127.0.0.1", port))
+        log.close()
+    sock.close()
+
+
+def percentiles(values: List[float]) -> str:
+    if not values:
+        return "no samples"
+    p50, p95, p99 = np.percentile(np.array(values) * 1000, [50, 95, 99])
+    return f"p50 {p50:7.1f}ms  p95 {p95:7.1f}ms  p99 {p99:7.1f}ms"
+
+
+def get_process_tree(pid: int) -> List[int]:
+    """Get a process and all of its children, Linux only."""
+    pids = [pid]
+    for parent in pids:
+        try:
+            for task in os.listdir(f"/proc/{parent}/task"):
+                with open(f"/proc/{parent}/task/{task}/children") as children_file:
+                    pids.extend(int(child) for child in children_file.read().split())
+        except OSError:
+            continue
+    return pids
+
+
+def get_process_cpu_time(pid: int) -> Optional[float]:
+    """Get the user and system CPU time of a process and its children, Linux only."""
+    total = 0.0
+    for process_id in get_process_tree(pid):
+        try:
+            with open(f"/proc/{process_id}/stat") as stat_file:
+                fields = stat_file.read().rsplit(")", 1)[1].split()
+        except OSError:
+            if process_id == pid:
+                return None
+            continue
+        total += (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    return total
+
+
+def get_process_rss(pid: int) -> Optional[int]:
+    """Get the resident memory of a process and its children in bytes, Linux only."""
+    total = 0
+    for process_id in get_process_tree(pid):
+        try:
+            with open(f"/proc/{process_id}/statm") as statm_file:
+                total += int(statm_file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except OSError:
+            if process_id == pid:
+                return None
+    return total
+
+
+def wait_for_server(url: str, timeout: float = 10) -> bool:
+    start_time = time.monotonic()
+    while time.monotonic() - start_time < timeout:
+        probe = socketio.Client(reconnection=False)
+        try:
+            probe.connect(url, transports=["websocket"], wait_timeout=1)
+            probe.disconnect()
+            return True
+        except socketio.exceptions.ConnectionError:
+            time.sleep(0.2)
+    return False
+
+
+def get_subscription(args: argparse.Namespace, system_ids: List[int]) -> Optional[dict]:
+    if args.subscribe_vehicles is None and args.subscribe_messages is None:
+        # Keep the default of everything
+        return None
+    return {
+        "system_ids": system_ids if args.subscribe_vehicles is not None else None,
+        "message_types": args.subscribe_messages.split(",")
+        if args.subscribe_messages is not None
+        else None,
+        "replace": True,
+    }
+
+
+def run_stage(
+    args: argparse.Namespace,
+    url: str,
+    client_count: int,
+    all_system_ids: List[int],
+    boot_times: Dict[int, float],
+    server_pid: Optional[int],
+) -> Optional[dict]:
+    """Run one set of clients against the server, get their combined results."""
+    results: multiprocessing.Queue = multiprocessing.Queue()
+    processes: List[multiprocessing.Process] = []
+    start_time = time.monotonic() + SETTLE_TIME
+    for index in range(client_count):
+        # Each client works on its own slice of the fleet, wrapping around
+        slice_size = args.subscribe_vehicles or len(all_system_ids)
+        system_ids = [
+            all_system_ids[(index * slice_size + offset) % len(all_system_ids)]
+            for offset in range(min(slice_size, len(all_system_ids)))
+        ]
+        client_settings = {
+            "boot_times": boot_times,
+            "system_ids": system_ids,
+            "actions": args.actions,
+            "subscription": get_subscription(args, system_ids),
+            "telemetry_rate": args.rate,
+        }
+        process = multiprocessing.Process(
+            target=run_client,
+            args=(index, url, client_settings, start_time, args.duration, results),
+            daemon=True,
+        )
+        process.start()
+        processes.append(process)
+
+    try:
+        time.sleep(max(start_time - time.monotonic(), 0))
+        cpu_start = get_process_cpu_time(server_pid) if server_pid else None
+        rss_samples = []
+        while time.monotonic() - start_time < args.duration:
+            if server_pid:
+                rss = get_process_rss(server_pid)
+                if rss is not None:
+                    rss_samples.append(rss)
+            time.sleep(min(0.5, args.duration))
+        cpu_end = get_process_cpu_time(server_pid) if server_pid else None
+
+        client_results = [
+            results.get(timeout=args.duration + 30) for _ in range(client_count)
+        ]
+    finally:
+        for process in processes:
+            process.join(timeout=5)
+
+    for result in client_results:
+        if "error" in result:
+            print(result["error"])
+    client_results = [result for result in client_results if "error" not in result]
+    if not client_results:
+        return None
+
+    request_latencies: Dict[str, List[float]] = {}
+    request_failures: Dict[str, int] = {}
+    request_timeouts: Dict[str, int] = {}
+    for result in client_results:
+        for event, latencies in result["request_latencies"].items():
+            request_latencies.setdefault(event, []).extend(latencies)
+        for event, count in result["request_failures"].items():
+            request_failures[event] = request_failures.get(event, 0) + count
+        for event, count in result["request_timeouts"].items():
+            request_timeouts[event] = request_timeouts.get(event, 0) + count
+
+    return {
+        "clients": client_count,
+        "rates": [result["telemetry_rate"] for result in client_results],
+        "telemetry_latencies": [
+            latency
+            for result in client_results
+            for latency in result["telemetry_latencies"]
+        ],
+        "telemetry_missed": sum(
+            result["telemetry_missed"] for result in client_results
+        ),
+        "request_latencies": request_latencies,
+        "request_failures": request_failures,
+        "request_timeouts": request_timeouts,
+        "cpu": (cpu_end - cpu_start) / args.duration
+        if cpu_start is not None and cpu_end is not None
+        else None,
+        "rss": max(rss_samples) if rss_samples else None,
+    }
+
+
+def print_stage(stage: dict) -> None:
+    rates = stage["rates"]
+    print(f"\n{stage['clients']} clients")
+    print(f"  Telemetry per client:  min {min(rates):.0f}/s  max {max(rates):.0f}/s")
+    print(f"  Telemetry latency:     {percentiles(stage['telemetry_latencies'])}")
+    print(f"  Telemetry missed:      {stage['telemetry_missed']}")
+    for event, latencies in sorted(stage["request_latencies"].items()):
+        print(
+            f"  {event + ':':<34}{percentiles(latencies)}  "
+            f"{len(latencies)} replies, "
+            f"{stage['request_failures'].get(event, 0)} failed, "
+            f"{stage['request_timeouts'].get(event, 0)} timed out"
+        )
+    for event, count in sorted(stage["request_timeouts"].items()):
+        if event not in stage["request_latencies"]:
+            print(f"  {event + ':':<34}no replies, {count} timed out")
+    if stage["cpu"] is not None:
+        print(f"  Server CPU:            {stage['cpu']:.0%}")
+    if stage["rss"] is not None:
+        print(f"  Server memory:         {stage['rss'] / 1e6:.0f}MB peak")
+
+
+def get_degradation(
+    stage: dict, first_stage: dict, max_request_p95: float
+) -> Optional[str]:
+    """Get why the server isn't keeping up at this stage, if it isn't."""
+    mean_rate = np.mean(stage["rates"])
+    first_mean_rate = np.mean(first_stage["rates"])
+    if first_mean_rate and mean_rate < first_mean_rate * MIN_TELEMETRY_RATIO:
+        return f"telemetry per client fell to {mean_rate / first_mean_rate:.0%}"
+
+    latencies = [
+        latency
+        for event_latencies in stage["request_latencies"].values()
+        for latency in event_latencies
+    ]
+    if latencies and np.percentile(latencies, 95) * 1000 > max_request_p95:
+        return f"request p95 over {max_request_p95:.0f}ms"
+    if sum(stage["request_timeouts"].values()):
+        return "requests timed out"
+    return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--clients",
+        default="12",
+        help="Number of clients, or a comma separated list to run one after another",
+    )
+    parser.add_argument("--vehicles", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--rate", type=float, default=4.0, help="Telemetry rate in Hz")
+    parser.add_argument(
+        "--actions",
+        type=parse_actions,
+        default=DEFAULT_ACTIONS,
+        help="Requests to send as event:weight pairs",
+    )
+    parser.add_argument(
+        "--subscribe-vehicles",
+        type=int,
+        help="Subscribe each client to this many vehicles instead of all of them",
+    )
+    parser.add_argument(
+        "--subscribe-messages",
+        help="Subscribe each client to these message types instead of all of them",
+    )
+    parser.add_argument("--max-request-p95", type=float, default=250.0)
+    parser.add_argument("--replay", help="Play this telemetry log instead")
+    parser.add_argument("--url", help="Use an already running server")
+    parser.add_argument(
+        "--link-process",
+        action="store_true",
+        help="Run the server's radio link in its own process",
+    )
+    parser.add_argument("--server-port", type=int, default=4300)
+    parser.add_argument("--fleet-port", type=int, default=14670)
+    args = parser.parse_args()
+    client_counts = [int(count) for count in args.clients.split(",")]
+
+    logging.basicConfig(level=logging.WARNING)
+
+    fleet: Optional[FakeFleet] = None
+    replaying = threading.Event()
+    if args.replay is None:
+        fleet = FakeFleet(
+            args.vehicles, port=args.fleet_port, telemetry_rate=args.rate, seed=1
+        )
+    server: Optional[subprocess.Popen] = None
+    url = args.url
+    if url is None:
+        url = f"http://127.0.0.1:{args.server_port}"
+        server = subprocess.Popen(
+            [
+                sys.executable,
+                "serve.py",
+                "--port",
+                str(args.server_port),
+                "--log-level",
+                "WARNING",
+            ]
+            + (["--link-process"] if args.link_process else [])
+        )
+
+    control_client = socketio.Client(reconnection=False)
+    try:
+        if not wait_for_server(url):
+            print(f"Could not reach the server at {url}")
+            return
+
+        boot_times: Dict[int, float] = {}
+        if fleet is not None:
+            fleet.start()
+            boot_times = {
+                system_id: vehicle.boot_time
+                for system_id, vehicle in fleet.vehicles.items()
+            }
+        else:
+            replaying.set()
+            threading.Thread(
+                target=replay_log,
+                args=(args.replay, args.fleet_port, replaying),
+                daemon=True,
+            ).start()
+
+        # A separate client opens the radio link and keeps it open
+        connect_result = threading.Event()
+        connected_system_ids: List[int] = []
+
+        def handle_connect_result(message: dict) -> None:
+            connected_system_ids.extend(
+                vehicle["system_id"]
+                for vehicle in message.get("data", {}).get("vehicles", [])
+            )
+            connect_result.set()
+
+        control_client.on("connect_to_radio_link_result", handle_connect_result)
+        control_client.connect(url, transports=["websocket"])
+        control_client.emit("unsubscribe_telemetry", {})
+        control_client.emit(
+            "connect_to_radio_link",
+            {"connectionType": "network", "port": f"udpin:127.0.0.1:{args.fleet_port}"},
+        )
+        if not connect_result.wait(15) or not connected_system_ids:
+            print("Server did not connect to the fleet")
+            return
+
+        print(
+            f"{len(connected_system_ids)} {'' if fleet else 'replayed '}vehicles "
+            f"at {args.rate}Hz, {args.duration:.0f}s per stage against {url}"
+        )
+        stages: List[dict] = []
+        for client_count in client_counts:
+            stage = run_stage(
+                args,
+                url,
+                client_count,
+                sorted(connected_system_ids),
+                boot_times,
+                server.pid if server else None,
+            )
+            if stage is None:
+                break
+            print_stage(stage)
+            stages.append(stage)
+
+        if len(stages) > 1:
+            for stage in stages[1:]:
+                reason = get_degradation(stage, stages[0], args.max_request_p95)
+                if reason is not None:
+                    print(f"\nDegraded at {stage['clients']} clients: {reason}")
+                    break
+            else:
+                print(f"\nKept up with {stages[-1]['clients']} clients")
+    finally:
+        if control_client.connected:
+            control_client.disconnect()
+        replaying.clear()
+        if fleet is not None:
+            fleet.stop()
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=10)
+
+
+if __name__ == "__main__":
+    main()
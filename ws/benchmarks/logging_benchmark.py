@@ -0,0 +1,87 @@
+"""
+Benchmark the cost of logging to the thread that logs, with a slow output
+stream standing in for a terminal or pipe that can't keep up. Compares
+logging.basicConfig with the queue based pipeline from app.logs.
+
+Run from the ws directory with:
+    python -m benchmarks.logging_benchmark --messages 2000 --write-delay 0.0005
+"""
+
+import argparse
+import io
+import logging
+import time
+
+import numpy as np
+
+from app.logs import setup_logging, stop_logging
+
+
+class SlowStream(io.StringIO):
+    def __init__(self, write_delay: float):
+        super().__init__()
+        self.write_delay = write_delay
+
+    def write(self, text: str) -> int:
+        time.sleep(self.write_delay)
+        return super().write(text)
+
+
+def reset_logging() -> None:
+    root_logger = logging.getLogger()
+    for handler in root_logger.handlers[:]:
+        root_logger.removeHandler(handler)
+
+
+def log_flood(logger: logging.Logger, messages: int, vehicles: int) -> np.ndarray:
+    """Log a STATUSTEXT flood the way the reader thread does."""
+    call_times = np.empty(messages)
+    for i in range(messages):
+        start = time.perf_counter()
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(f"{i % vehicles + 1}: PreArm: Gyros inconsistent {i}")
+        call_times[i] = time.perf_counter() - start
+    return call_times
+
+
+def report(name: str, call_times: np.ndarray) -> None:
+    p50, p99 = np.percentile(call_times * 1e6, [50, 99])
+    print(
+        f"{name:22} total {call_times.sum() * 1000:8.1f}ms  "
+        f"p50 {p50:8.1f}us  p99 {p99:8.1f}us"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--vehicles", type=int, default=50)
+    parser.add_argument("--write-delay", type=float, default=0.0005)
+    args = parser.parse_args()
+
+    logger = logging.getLogger("radio_link")
+
+    reset_logging()
+    logging.basicConfig(level=logging.INFO, stream=SlowStream(args.write_delay))
+    report("basicConfig", log_flood(logger, args.messages, args.vehicles))
+
+    reset_logging()
+    setup_logging(
+        logging.INFO, rate_limit_burst=None, stream=SlowStream(args.write_delay)
+    )
+    report("queue", log_flood(logger, args.messages, args.vehicles))
+    stop_logging()
+
+    reset_logging()
+    setup_logging(logging.INFO, stream=SlowStream(args.write_delay))
+    report("queue + rate limit", log_flood(logger, args.messages, args.vehicles))
+    stop_logging()
+
+    reset_logging()
+    setup_logging(logging.WARNING, stream=SlowStream(args.write_delay))
+    report("level disabled", log_flood(logger, args.messages, args.vehicles))
+    stop_logging()
+
+
+if __name__ == "__main__":
+    main()
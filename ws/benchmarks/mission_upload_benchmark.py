@@ -0,0 +1,96 @@
+"""
+Benchmark concurrent mission uploads to a simulated fleet.
+
+Compares uploading to a single vehicle, to every vehicle one after another
+and to every vehicle at once.
+
+Run from the ws directory with:
+    python -m benchmarks.mission_upload_benchmark --vehicles 20 --items 200
+"""
+
+import argparse
+import logging
+import time
+from typing import Dict, List
+
+from pymavlink.mavutil import mavlink
+
+from app.mission import MissionItem
+from app.radio_link import RadioLink
+from benchmarks.fake_fleet import FakeFleet
+
+
+def create_mission(item_count: int) -> List[MissionItem]:
+    return [
+        {
+            "command": mavlink.MAV_CMD_NAV_WAYPOINT,
+            "latitude": -35.363 + seq * 1e-5,
+            "longitude": 149.165,
+            "altitude": 20,
+        }
+        for seq in range(item_count)
+    ]
+
+
+def timed_upload(
+    radio_link: RadioLink, missions: Dict[int, List[MissionItem]]
+) -> float:
+    start_time = time.perf_counter()
+    result = radio_link.upload_missions(missions)
+    elapsed = time.perf_counter() - start_time
+    if not result["success"]:
+        print(f"  upload failed: {result['message']}")
+    return elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vehicles", type=int, default=20)
+    parser.add_argument("--items", type=int, default=200)
+    parser.add_argument("--port", type=int, default=14650)
+    parser.add_argument("--loss", type=float, default=0.0)
+    parser.add_argument("--delay", type=float, default=0.01, help="One-way delay in s")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    fleet = FakeFleet(
+        args.vehicles, port=args.port, loss=args.loss, delay=args.delay, seed=1
+    )
+    radio_link = None
+    try:
+        fleet.start()
+        radio_link = RadioLink(f"udpin:127.0.0.1:{args.port}")
+        if radio_link.master is None:
+            print("Could not connect to the fake fleet")
+            return
+
+        system_ids = sorted(radio_link.vehicles.keys())
+        print(f"Connected to {len(system_ids)} vehicles")
+        mission = create_mission(args.items)
+
+        single = timed_upload(radio_link, {system_ids[0]: mission})
+        print(f"Single vehicle upload:      {single:.2f}s")
+
+        sequential_start = time.perf_counter()
+        for system_id in system_ids:
+            timed_upload(radio_link, {system_id: mission})
+        sequential = time.perf_counter() - sequential_start
+        print(f"Sequential fleet upload:    {sequential:.2f}s")
+
+        concurrent = timed_upload(
+            radio_link, {system_id: mission for system_id in system_ids}
+        )
+        print(f"Concurrent fleet upload:    {concurrent:.2f}s")
+        print(
+            f"Concurrent upload took {concurrent / single:.1f}x a single upload, "
+            f"{sequential / concurrent:.1f}x faster than sequential"
+        )
+    finally:
+        if radio_link is not None:
+            radio_link.close()
+        fleet.stop()
+
+
+if __name__ == "__main__":
+    main()
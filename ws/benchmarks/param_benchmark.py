@@ -0,0 +1,75 @@
+"""
+Benchmark fetching parameters from a simulated fleet.
+
+Compares a full download from one vehicle, from every vehicle at once with
+packet loss, and a reconnect where every vehicle is loaded from the cache.
+
+Run from the ws directory with:
+    python -m benchmarks.param_benchmark --vehicles 20 --loss 0.02
+"""
+
+import argparse
+import logging
+import tempfile
+import time
+from typing import List
+
+from app.radio_link import RadioLink
+from benchmarks.fake_fleet import FakeFleet
+
+
+def timed_fetch(radio_link: RadioLink, system_ids: List[int], use_cache: bool) -> float:
+    start_time = time.perf_counter()
+    result = radio_link.fetch_params(system_ids, use_cache)
+    elapsed = time.perf_counter() - start_time
+    if not result["success"]:
+        print(f"  fetch failed: {result['message']}")
+    return elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vehicles", type=int, default=20)
+    parser.add_argument("--port", type=int, default=14660)
+    parser.add_argument("--loss", type=float, default=0.02)
+    parser.add_argument("--delay", type=float, default=0.01, help="One-way delay in s")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    fleet = FakeFleet(
+        args.vehicles, port=args.port, loss=args.loss, delay=args.delay, seed=1
+    )
+    radio_link = None
+    try:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            fleet.start()
+            radio_link = RadioLink(f"udpin:127.0.0.1:{args.port}")
+            if radio_link.master is None:
+                print("Could not connect to the fake fleet")
+                return
+            radio_link.param_manager.cache.cache_dir = cache_dir
+
+            system_ids = sorted(radio_link.vehicles.keys())
+            print(f"Connected to {len(system_ids)} vehicles")
+
+            single = timed_fetch(radio_link, system_ids[:1], use_cache=False)
+            print(f"Single vehicle download:    {single:.2f}s")
+
+            concurrent = timed_fetch(radio_link, system_ids, use_cache=False)
+            print(f"Concurrent fleet download:  {concurrent:.2f}s")
+
+            cached = timed_fetch(radio_link, system_ids, use_cache=True)
+            print(f"Cached fleet fetch:         {cached:.2f}s")
+            print(
+                f"Fleet download took {concurrent / single:.1f}x a single download, "
+                f"the cache was {concurrent / cached:.1f}x faster"
+            )
+    finally:
+        if radio_link is not None:
+            radio_link.close()
+        fleet.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Benchmark the fleet proximity monitor against a simulated fleet.
+
+Run from the ws directory with:
+    python -m benchmarks.proximity_benchmark --vehicles 500
+"""
+
+import argparse
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+from pymavlink.mavutil import mavlink
+
+from app.proximity import ProximityMonitor, find_close_pairs
+from app.types import VehicleType
+from app.vehicle import Vehicle
+
+ORIGIN_LATITUDE = -35.363
+ORIGIN_LONGITUDE = 149.165
+
+
+def create_fleet(vehicle_count: int, area_size: float, seed: int) -> dict:
+    rng = np.random.default_rng(seed)
+    vehicles = {}
+    for system_id in range(1, vehicle_count + 1):
+        vehicle = Vehicle(
+            system_id,
+            mavlink.MAV_COMP_ID_AUTOPILOT1,
+            mavlink.MAV_TYPE_QUADROTOR,
+            VehicleType.COPTER,
+        )
+        vehicle.latitude = ORIGIN_LATITUDE + rng.uniform(0, area_size) / 111_320
+        vehicle.longitude = ORIGIN_LONGITUDE + rng.uniform(0, area_size) / 91_000
+        vehicle.msl_altitude = 584 + rng.uniform(10, 30)
+        vehicle.velocity_north, vehicle.velocity_east = rng.normal(0, 5, 2)
+        vehicle.last_position_time = time.time()
+        vehicles[system_id] = vehicle
+    return vehicles
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vehicles", type=int, default=500)
+    parser.add_argument("--area", type=float, default=2000, help="Side length in m")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=10, help="Target rate in Hz")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    vehicles = create_fleet(args.vehicles, args.area, args.seed)
+    is_active = threading.Event()
+    is_active.set()
+    radio_link = SimpleNamespace(vehicles=vehicles, is_active=is_active)
+    monitor = ProximityMonitor(radio_link)  # type: ignore[arg-type]
+
+    # Check both code paths agree before timing them
+    _, positions, velocities = monitor._get_fleet_state()
+    brute_force = find_close_pairs(
+        positions, velocities, 10.0, 5.0, use_spatial_hash=False
+    )
+    spatial_hash = find_close_pairs(
+        positions, velocities, 10.0, 5.0, use_spatial_hash=True
+    )
+    print(f"Conflicting pairs found: {len(brute_force)}")
+    assert {frozenset(pair) for pair in zip(brute_force.first, brute_force.second)} == {
+        frozenset(pair) for pair in zip(spatial_hash.first, spatial_hash.second)
+    }, "Spatial hash and brute force results differ"
+
+    timings = []
+    for _ in range(args.iterations):
+        for vehicle in vehicles.values():
+            vehicle.last_position_time = time.time()
+        start_time = time.perf_counter()
+        monitor._update_alerts(monitor.check())
+        timings.append(time.perf_counter() - start_time)
+
+    timings_ms = np.array(timings) * 1000
+    budget_ms = 1000 / args.rate
+    p50, p95, p99 = np.percentile(timings_ms, [50, 95, 99])
+    print(
+        f"{args.vehicles} vehicles, {args.iterations} checks: "
+        f"p50={p50:.2f}ms p95={p95:.2f}ms p99={p99:.2f}ms max={timings_ms.max():.2f}ms"
+    )
+    print(
+        f"Budget at {args.rate:g} Hz is {budget_ms:.0f}ms per check, "
+        f"{'keeps up' if p99 < budget_ms else 'FALLS BEHIND'}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+Benchmark streaming guided setpoints to a simulated fleet while a client
+pushes new targets much faster than the link should carry them. Each vehicle's
+target moves around a circle. With "direct" every update is sent straight
+away with goto_position, the way clients had to before, and with "streamer"
+updates go through the SetpointStreamer, which only sends the latest target
+at its rate within its byte budget.
+
+How far the target each vehicle is actually flying to lags behind the one the
+client last pushed is sampled throughout, along with the outbound packets and
+bytes per second.
+
+Run from the ws directory with:
+    python -m benchmarks.setpoint_benchmark --vehicles 32 --push-rate 100
+"""
+
+import argparse
+import logging
+import math
+import threading
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from app.radio_link import RadioLink
+from benchmarks.fake_fleet import EARTH_RADIUS, FakeFleet
+
+CIRCLE_RADIUS = 20.0
+CIRCLE_SPEED = 5.0
+ALTITUDE = 10.0
+SAMPLE_INTERVAL = 0.05
+
+
+def get_circle_target(
+    centre: Tuple[float, float], elapsed: float
+) -> Tuple[float, float]:
+    angle = CIRCLE_SPEED * elapsed / CIRCLE_RADIUS
+    latitude = centre[0] + math.degrees(CIRCLE_RADIUS * math.cos(angle) / EARTH_RADIUS)
+    longitude = centre[1] + math.degrees(
+        CIRCLE_RADIUS
+        * math.sin(angle)
+        / (EARTH_RADIUS * math.cos(math.radians(centre[0])))
+    )
+    return latitude, longitude
+
+
+def get_distance(a: Tuple[float, float], b: Tuple[float, float]) -> float:
+    north = math.radians(a[0] - b[0]) * EARTH_RADIUS
+    east = math.radians(a[1] - b[1]) * EARTH_RADIUS * math.cos(math.radians(a[0]))
+    return math.hypot(north, east)
+
+
+def push_targets(
+    radio_link: RadioLink,
+    mode: str,
+    centres: Dict[int, Tuple[float, float]],
+    latest: Dict[int, Tuple[float, float]],
+    push_rate: float,
+    is_running: threading.Event,
+) -> None:
+    interval = 1 / push_rate
+    start_time = time.monotonic()
+    while is_running.is_set():
+        now = time.monotonic()
+        targets = {
+            system_id: get_circle_target(centre, now - start_time)
+            for system_id, centre in centres.items()
+        }
+        if mode == "direct":
+            for system_id, (latitude, longitude) in targets.items():
+                radio_link.goto_position(system_id, latitude, longitude, ALTITUDE)
+        else:
+            radio_link.setpoint_streamer.update_setpoints(
+                [
+                    {
+                        "system_id": system_id,
+                        "latitude": latitude,
+                        "longitude": longitude,
+                        "altitude": ALTITUDE,
+                    }
+                    for system_id, (latitude, longitude) in targets.items()
+                ]
+            )
+        latest.update(targets)
+        time.sleep(max(interval - (time.monotonic() - now), 0))
+
+
+def measure(args: argparse.Namespace, mode: str, port: int) -> Dict[str, float]:
+    fleet = FakeFleet(args.vehicles, port=port, telemetry_rate=args.rate, seed=1)
+    radio_link = None
+    try:
+        fleet.start()
+        radio_link = RadioLink(
+            f"udpin:127.0.0.1:{port}",
+            archive_dir=None,
+            link_capacity=args.link_capacity,
+        )
+        if radio_link.master is None:
+            raise RuntimeError("Could not connect to the fake fleet")
+        radio_link.setpoint_streamer.set_rate(args.setpoint_rate)
+        radio_link.set_all_vehicles_flight_mode("GUIDED")
+
+        system_ids = sorted(radio_link.vehicles.keys())
+        centres = {
+            system_id: (
+                fleet.vehicles[system_id].latitude,
+                fleet.vehicles[system_id].longitude,
+            )
+            for system_id in system_ids
+        }
+        latest: Dict[int, Tuple[float, float]] = {}
+
+        is_running = threading.Event()
+        is_running.set()
+        pusher = threading.Thread(
+            target=push_targets,
+            args=(radio_link, mode, centres, latest, args.push_rate, is_running),
+            daemon=True,
+        )
+
+        outbound = radio_link.outbound
+        start_packets, start_bytes = outbound.packets_sent, outbound.bytes_sent
+        start_time = time.monotonic()
+        pusher.start()
+
+        lags: List[float] = []
+        while time.monotonic() - start_time < args.duration:
+            time.sleep(SAMPLE_INTERVAL)
+            for system_id, target in list(latest.items()):
+                flying_to = fleet.vehicles[system_id].target
+                if flying_to is not None:
+                    lags.append(get_distance(target, flying_to[:2]))
+
+        elapsed = time.monotonic() - start_time
+        is_running.clear()
+        pusher.join()
+
+        p50, p95, p99 = np.percentile(lags, [50, 95, 99]) if lags else (0, 0, 0)
+        return {
+            "packets_per_second": (outbound.packets_sent - start_packets) / elapsed,
+            "bytes_per_second": (outbound.bytes_sent - start_bytes) / elapsed,
+            "lag_p50": p50,
+            "lag_p95": p95,
+            "lag_p99": p99,
+            "queue_delay_p95": (outbound.get_status()["queue_delay"] or {}).get(
+                "p95", 0.0
+            ),
+        }
+    finally:
+        if radio_link is not None and radio_link.master is not None:
+            radio_link.close()
+        fleet.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vehicles", type=int, default=32)
+    parser.add_argument(
+        "--push-rate", type=float, default=100.0, help="Client updates per second"
+    )
+    parser.add_argument("--setpoint-rate", type=float, default=10.0)
+    parser.add_argument(
+        "--link-capacity",
+        type=int,
+        default=50000,
+        help="Link capacity in B/s, setpoints get a share of it",
+    )
+    parser.add_argument("--rate", type=float, default=10.0, help="Telemetry rate in Hz")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--port", type=int, default=14680)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    print(
+        f"{args.vehicles} vehicles, targets pushed at {args.push_rate:.0f} Hz, "
+        f"setpoints streamed at {args.setpoint_rate:.0f} Hz"
+    )
+    for index, mode in enumerate(["direct", "streamer"]):
+        result = measure(args, mode, args.port + index)
+        print(
+            f"  {mode + ':':<10}{result['packets_per_second']:7.0f} packets/s "
+            f"{result['bytes_per_second']:8.0f} B/s out, target lag "
+            f"p50 {result['lag_p50']:5.2f}m p95 {result['lag_p95']:5.2f}m "
+            f"p99 {result['lag_p99']:5.2f}m, "
+            f"queue delay p95 {result['queue_delay_p95']:.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
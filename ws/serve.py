@@ -0,0 +1,62 @@
+"""
+Production server for the backend. Runs on gevent's event loop instead of the
+Werkzeug development server, with debug mode off. The standard library is
+monkey patched first so the radio link threads become greenlets and
+app.async_mode switches Socket.IO to gevent.
+
+Run from the ws directory with:
+    python serve.py --host 127.0.0.1 --port 4237
+"""
+
+from gevent import monkey
+
+monkey.patch_all()
+
+import argparse  # noqa: E402
+import logging  # noqa: E402
+import os  # noqa: E402
+
+from flask import Flask  # noqa: E402
+
+import app.shared_state as state  # noqa: E402
+from app import async_mode, socketio  # noqa: E402
+from app.endpoints import endpoints  # noqa: E402
+from app.logs import setup_logging  # noqa: E402
+
+os.environ["MAVLINK20"] = "1"
+
+logger = logging.getLogger("multicontrol")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=4237)
+    parser.add_argument("--log-level", default="INFO")
+    parser.add_argument(
+        "--link-process",
+        action="store_true",
+        help="Run the radio link in its own process",
+    )
+    args = parser.parse_args()
+
+    setup_logging(args.log_level.upper())
+    state.use_link_process = args.link_process
+
+    logger.info(f"Initialising app with async mode {async_mode}")
+    app = Flask(__name__)
+    app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", "secret-key")
+
+    app.register_blueprint(endpoints)
+
+    socketio.init_app(app)
+
+    try:
+        socketio.run(app, host=args.host, port=args.port, log_output=False)
+    finally:
+        if state.radio_link is not None:
+            state.radio_link.close()
+
+
+if __name__ == "__main__":
+    main()